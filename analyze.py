@@ -0,0 +1,70 @@
+"""
+Accuracy statistics for the tool comparison: confusion matrices (reference tag
+x user tag), accuracy, over-, under- and critical under-triage rates and
+Time_to_Tag per tool and scenario, with bootstrap confidence intervals, and the
+differences between tools.
+
+    python step_aggregate.py && python analyze.py
+    python analyze.py --ledgers data_out          (read the ledger CSVs instead)
+    python analyze.py --cluster session           (resample participants, not encounters)
+
+Reads the real encounter rows of the consolidated dataset (data_aggregate/) and
+writes confusion_matrices.csv, accuracy_statistics.csv, tool_comparisons.csv and
+analysis.json to --out (src/analysis.py).
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from src import aggregation, analysis
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Confusion matrices and bootstrap accuracy statistics per tool.")
+    parser.add_argument("--dataset", default=aggregation.AGGREGATE_DIR, help="Consolidated dataset (step_aggregate.py)")
+    parser.add_argument("--ledgers", help="Read this directory of ledger CSVs instead of the dataset")
+    parser.add_argument("--out", default="analysis_out", help="Directory for the tables and JSON")
+    parser.add_argument("--replicates", type=int, default=analysis.BOOTSTRAP_REPLICATES)
+    parser.add_argument("--confidence", type=float, default=analysis.CONFIDENCE)
+    parser.add_argument("--cluster", choices=["encounter", "session"], default="encounter",
+                        help="Bootstrap resampling unit")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    encounters = analysis.load_encounters(args.dataset, args.ledgers)
+    loaded = time.perf_counter()
+    if encounters.empty:
+        print("No real encounter rows found.")
+        sys.exit(1)
+    results = analysis.analyze(encounters, args.replicates, args.confidence, args.cluster, args.seed)
+    analyzed = time.perf_counter()
+
+    os.makedirs(args.out, exist_ok=True)
+    results["confusion"].to_csv(os.path.join(args.out, "confusion_matrices.csv"), index=False)
+    results["statistics"].to_csv(os.path.join(args.out, "accuracy_statistics.csv"), index=False)
+    results["comparisons"].to_csv(os.path.join(args.out, "tool_comparisons.csv"), index=False)
+    settings = {"source": args.ledgers or args.dataset, "replicates": args.replicates,
+                "confidence": args.confidence, "cluster": args.cluster, "seed": args.seed}
+    with open(os.path.join(args.out, "analysis.json"), "w", encoding="utf-8") as f:
+        json.dump(analysis.to_json(results, settings), f, indent=2)
+
+    stats = results["statistics"]
+    print(f"{len(encounters)} encounters from {encounters['session_id'].nunique()} sessions "
+          f"(read {loaded - started:.2f}s, {args.replicates} bootstrap replicates {analyzed - loaded:.2f}s) -> {args.out}")
+    print(f"{'tool':<10}{'scenario':<12}{'n':>7}{'accuracy':>22}{'critical under':>22}{'mean Time_to_Tag (s)':>26}")
+    for row in stats.itertuples():
+        print(f"{row.tool_id:<10}{row.scenario_type:<12}{row.encounters:>7}"
+              f"{row.accuracy:>9.1%} [{row.accuracy_ci_low:.1%}, {row.accuracy_ci_high:.1%}]"
+              f"{row.critical_under_rate:>9.1%} [{row.critical_under_rate_ci_low:.1%}, "
+              f"{row.critical_under_rate_ci_high:.1%}]"
+              f"{row.mean_time_to_tag_ms / 1000:>12.1f} [{row.mean_time_to_tag_ms_ci_low / 1000:.1f}, "
+              f"{row.mean_time_to_tag_ms_ci_high / 1000:.1f}]")
+
+
+if __name__ == "__main__":
+    main()
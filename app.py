@@ -1,11 +1,10 @@
 import streamlit as st
 import pandas as pd
 import os
-import time
 import hashlib
 import io
 from datetime import datetime
-from src import utils, engine, components, cloud
+from src import utils, engine, components, cloud, timing
 
 # Set Page Config
 st.set_page_config(page_title="STEP: Triage Study", page_icon="🚑", layout="wide")
@@ -13,7 +12,33 @@ st.set_page_config(page_title="STEP: Triage Study", page_icon="🚑", layout="wi
 # Constants
 CONTENT_PACK_PATH = "config/study_content_pack.xlsx"
 
+def reload_session_pack():
+    """
+    Registers a live session's content pack again after the shared registry evicted
+    it: from the compiled pack cache, else from its source if that still has the
+    same hash. The session's patient queue and progress are left as they are.
+    """
+    content_hash = st.session_state.content_pack_hash
+    source = st.session_state.get("content_pack_source") or {}
+    sheets = utils.read_content_pack_cache(content_hash)
+    if sheets is None and source.get("mode") == "Mode A":
+        if os.path.exists(source["path"]) and utils.calculate_hash(source["path"]) == content_hash:
+            sheets = utils.load_content_pack_cached(source["path"], content_hash)
+    elif sheets is None and source.get("mode") == "Mode C":
+        fetched = cloud.fetch_gsheet_data(source["sheet"])
+        if fetched:
+            fetched = utils.prepare_content_pack(fetched)
+            if utils.calculate_sheets_hash(fetched) == content_hash:
+                sheets = fetched
+    if sheets is None:
+        st.error("This session's content pack has changed or is no longer available, so the session "
+                 "cannot continue. Please contact the study team.")
+        st.stop()
+    engine.load_content_pack(content_hash, lambda: sheets)
+
 def main():
+    timing.mark_rerun()
+
     with st.sidebar:
         st.header("Admin Settings")
         data_mode = st.radio("Data Source", [
@@ -23,9 +48,14 @@ def main():
         ])
         st.divider()
 
+    # A session already under way whose pack was evicted: reload the pack only,
+    # never start the session (or its patient queue) over
+    if "session_id" in st.session_state and not engine.content_pack_loaded():
+        reload_session_pack()
+
     # Admin Logic: What data mode is selected?
-    if "content_pack" not in st.session_state:
-        sheets = None
+    if not engine.content_pack_loaded():
+        load_sheets = None
         content_hash = None
 
         if "Mode A" in data_mode:
@@ -45,8 +75,9 @@ def main():
             if selected_local_file:
                 pack_path = os.path.join(config_dir, selected_local_file)
                 content_hash = utils.calculate_hash(pack_path)
-                sheets = utils.load_content_pack(pack_path)
+                load_sheets = lambda: utils.load_content_pack_cached(pack_path, content_hash)
                 st.session_state.data_mode = "Mode A"
+                st.session_state.content_pack_source = {"mode": "Mode A", "path": pack_path}
             else:
                 st.info("Please select a config file from the sidebar to begin.")
                 st.stop()
@@ -56,8 +87,10 @@ def main():
             if uploaded_file is not None:
                 bytes_data = uploaded_file.getvalue()
                 content_hash = hashlib.sha256(bytes_data).hexdigest()
-                sheets = utils.load_content_pack(io.BytesIO(bytes_data))
+                load_sheets = lambda: utils.load_content_pack_cached(io.BytesIO(bytes_data), content_hash)
                 st.session_state.data_mode = "Mode B"
+                # The upload is not kept: a reload after eviction relies on the compiled pack cache
+                st.session_state.content_pack_source = {"mode": "Mode B"}
             else:
                 st.info("Please upload a local patient queue (.xlsx) to begin.")
                 st.stop()
@@ -71,34 +104,34 @@ def main():
             
             selected_sheet = st.sidebar.selectbox("Select Study Content Pack", available_sheets, index=None, placeholder="Choose a sheet...")
             if selected_sheet:
-                content_hash = hashlib.sha256(selected_sheet.encode()).hexdigest()
                 sheets = cloud.fetch_gsheet_data(selected_sheet)
                 st.session_state.active_google_sheet = selected_sheet
                 
                 if not sheets:
                     st.error("Failed to load data from the selected Google Sheet.")
                     st.stop()
+                sheets = utils.prepare_content_pack(sheets)
+                # Key by the fetched data, not the sheet name, so edits to the sheet start a new pack
+                content_hash = utils.calculate_sheets_hash(sheets)
+                # Cached on disk too, so this version can be reloaded after a later edit to the sheet
+                load_sheets = lambda: utils.write_content_pack_cache(content_hash, sheets)
+                st.session_state.content_pack_source = {"mode": "Mode C", "sheet": selected_sheet}
             else:
                 st.info("Please select a Google Sheet to begin.")
                 st.stop()
 
-        # Validate
-        utils.validate_content_pack(sheets)
-        
-        # Defensively cast Is_Practice to boolean in case of string parsing (GSheets)
-        if "Patients" in sheets:
-            sheets["Patients"]["Is_Practice"] = sheets["Patients"].get("Is_Practice", False).apply(
-                lambda x: True if str(x).strip().upper() == "TRUE" or x is True else False
-            )
+        # Packs arrive validated and normalised (utils.prepare_content_pack).
+        # One shared copy per hash, loaded only if not registered yet; this session only keeps the hash
+        engine.load_content_pack(content_hash, load_sheets)
+        st.session_state.content_pack_hash = content_hash
 
-        st.session_state.content_pack = sheets # Make sure this is set so resume/initialize doesn't fail if they need it immediately
-        
         # Try Resume or Initialize
-        resumed = engine.try_resume_session(sheets, content_hash)
+        resumed = engine.try_resume_session(content_hash)
         if not resumed:
-            engine.initialize_session(sheets, content_hash)
+            engine.initialize_session(content_hash)
             engine.generate_patient_queue()
             engine.save_session_state()
+        engine.start_replication(content_hash)
 
         engine.ensure_query_param()
         st.rerun()
@@ -114,8 +147,7 @@ def main():
         st.write(f"Session ID: {st.session_state.session_id}")
         st.write(f"Version: {st.session_state.app_version}")
         if st.button("Withdraw & Delete Session", type="primary"):
-            if os.path.exists(st.session_state.log_filepath):
-                os.remove(st.session_state.log_filepath)
+            engine.delete_ledger()
             engine.delete_session_state()
             st.warning("Session withdrawn and log deleted.")
             st.stop()
@@ -132,11 +164,11 @@ def main():
         curr_idx = st.session_state.current_patient_index
         st.session_state.can_go_back = True
 
-        queue = st.session_state.patient_queue
+        queue_ids = st.session_state.patient_queue_ids
 
-        if curr_idx < len(queue):
-            prev_patient = queue[prev_idx]
-            curr_patient = queue[curr_idx]
+        if curr_idx < len(queue_ids):
+            prev_patient = engine.get_patient(queue_ids[prev_idx])
+            curr_patient = engine.get_patient(queue_ids[curr_idx])
 
             # Washout Check
             # Trigger between Scenario A and B.
@@ -167,7 +199,7 @@ def main():
                     # THEN PREPARE WASHOUT
                     st.session_state.washout_active = True
                     st.session_state.can_go_back = False
-                    st.session_state.washout_start_time = datetime.now()
+                    st.session_state.washout_start_time = timing.anchor()
                     st.session_state.card_start_time = None
                     st.session_state.accumulated_cost_ms = 0
                     engine.save_session_state()
@@ -186,18 +218,26 @@ def main():
     # 4. Phase 1: Onboarding
     if not st.session_state.onboarding_complete:
         if not st.session_state.get("splash_viewed", False):
-            ph = st.empty()
-            ph.markdown("""
+            # Played by the browser as an overlay above the onboarding form, so
+            # the script run is not held open while it fades
+            st.markdown("""
             <style>
             @keyframes fadeInOut {
-                0% { opacity: 0; }
+                0% { opacity: 0; visibility: visible; }
                 15% { opacity: 1; }
                 85% { opacity: 1; }
-                100% { opacity: 0; }
+                100% { opacity: 0; visibility: hidden; }
             }
             .splash {
+                position: fixed;
+                inset: 0;
+                z-index: 1000100;
+                display: flex;
+                align-items: center;
+                justify-content: center;
                 text-align: center;
-                margin-top: 30vh;
+                padding: 0 5vw;
+                background-color: #ffffff;
                 animation: fadeInOut 4.5s forwards;
             }
             </style>
@@ -205,8 +245,6 @@ def main():
                 <h1 style="font-size: 3.5em; margin-bottom: 0; line-height: 1.2;">Welcome to the Standardised Triage Evaluation Platform (STEP)</h1>
             </div>
             """, unsafe_allow_html=True)
-            time.sleep(4.8)
-            ph.empty()
             st.session_state.splash_viewed = True
 
         st.title("Onboarding")
@@ -315,7 +353,7 @@ def main():
         st.warning("All subsequent cases will be timed and logged for analysis. Please treat them as a real scenario.")
         if st.button("Start Simulation", type="primary"):
             st.session_state.practice_transition_active = False
-            st.session_state.block_start_time = datetime.now()
+            st.session_state.block_start_time = timing.anchor()
             engine.start_new_patient() 
             engine.save_session_state()
             st.rerun()
@@ -325,11 +363,14 @@ def main():
     patient = engine.get_current_patient()
 
     if patient:
+        model = engine.get_render_model(patient)
+        engine.prefetch_next_patient()
+
         # Header
         col1_h, col2_h = st.columns([0.85, 0.15])
         with col1_h:
-            st.progress((st.session_state.current_patient_index) / len(st.session_state.patient_queue))
-            st.caption(f"Patient {st.session_state.current_patient_index + 1} / {len(st.session_state.patient_queue)}")
+            st.progress((st.session_state.current_patient_index) / len(st.session_state.patient_queue_ids))
+            st.caption(f"Patient {st.session_state.current_patient_index + 1} / {len(st.session_state.patient_queue_ids)}")
         with col2_h:
             if st.session_state.current_patient_index > 0 and st.session_state.get("can_go_back", False):
                 if st.button("⬅️ Go Back", use_container_width=True):
@@ -343,7 +384,7 @@ def main():
             st.session_state.header_sticky = False
 
         # Custom CSS for HUD Layout
-        components.inject_custom_css()
+        components.inject_custom_css(st.session_state.tool_id)
 
         # === HEADER LAYOUT (Unified) ===
         with st.container():
@@ -354,27 +395,31 @@ def main():
                 # Avatar Left | Info Right
                 c_avatar, c_info = st.columns([0.25, 0.75], gap="small")
                 with c_avatar:
-                    components.render_patient_avatar(patient)
+                    components.render_patient_avatar(model)
                 with c_info:
-                    components.render_patient_info(patient)
+                    components.render_patient_info(model)
 
             # 2. Triage Section (Right)
             with c_triage:
                 st.markdown("#### Triage decision.")
                 # Render Tools
-                components.render_triage_tools(st.session_state.content_pack["Tools"], st.session_state.tool_id)
+                components.render_triage_tools(st.session_state.tool_id)
         
         st.divider()
         
         # === ACTION GRID (Full Width) ===
         st.markdown("### Actions")
-        components.render_action_buttons(patient, st.session_state.content_pack["Config"])
+        components.render_action_buttons(model)
+
+        # Browser-side click timing (STEP_CLIENT_TIMING=1); reports arrive once the next card is up
+        engine.log_client_timing(timing.click_timer(engine.card_key()))
         
         # Sidebar Removed completely from this view.
 
     else:
         # Phase 5: Completion
         st.title("STEP: Study Complete")
+        engine.log_client_timing(timing.click_timer(None))
 
         if not st.session_state.get("post_perception_done"):
             st.markdown("### Final Feedback")
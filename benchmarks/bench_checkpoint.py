@@ -0,0 +1,116 @@
+"""
+Session checkpoint cost as a session grows: full JSON rewrite vs the delta journal.
+
+Run from the repo root:
+    python benchmarks/bench_checkpoint.py [--saves 200]
+
+For each session length the benchmark pre-populates completed_encounters and
+then times `--saves` consecutive checkpoints, each following one new reveal
+event (the common click). Writes are timed inline, without the write-behind pool.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+
+sys.path.append(os.getcwd())
+
+from src import checkpoint
+
+ENCOUNTER_COUNTS = [10, 100, 1000]
+
+
+def make_encounter(i):
+    return {
+        "t_run_ms": i * 9000, "session_id": "bench", "record_type": "encounter",
+        "patient_id": f"ent_{i:04d}", "tool_id": "SMART", "scenario_type": "Entrapment",
+        "is_practice": False, "patient_sequence_order": i + 1,
+        "Time_to_First_Action": 1200, "Time_to_Tag": 8400, "Time_to_Hemorrhage_Ctrl": "",
+        "Time_to_Airway_Ctrl": 3100, "Dwell_rr": 900, "Dwell_pulse_rad": 1100,
+        "Dwell_Measurable": True, "Seq_Error_Count": 0, "Seq_Error_Measurable": True,
+        "LSI_Applicable": True, "Required_LSI": "airway_man", "Missed_LSI_Flag": "False",
+        "Missing_LSI_List": "", "Error_Class": "None", "User_Tag": "Red", "Reference_Tag": "Red",
+    }
+
+
+def make_event(i):
+    return {
+        "t_run_ms": i * 350, "session_id": "bench", "record_type": "event",
+        "patient_id": "ent_0001", "tool_id": "SMART", "event_type": "reveal",
+        "action_key": "rr", "t_real_ms": i * 350, "t_sim_ms": i * 350 + 5000,
+        "decision_normalized": "",
+    }
+
+
+def make_payload(n_encounters):
+    return {
+        "version": 2, "session_id": "bench", "current_patient_index": n_encounters,
+        "patient_queue_ids": [f"ent_{i:04d}" for i in range(40)],
+        "revealed_actions": [], "accumulated_cost_ms": 0,
+        "encounter_events": [],
+        "completed_encounters": [make_encounter(i) for i in range(n_encounters)],
+        "ledger_row_index": n_encounters * 5,
+    }
+
+
+def bench_full_rewrite(payload, saves):
+    timings = []
+    for i in range(saves):
+        payload["encounter_events"].append(make_event(i))
+        payload["ledger_row_index"] += 1
+        start = time.perf_counter()
+        with open(checkpoint.snapshot_path("bench"), "w", encoding="utf-8") as f:
+            json.dump(payload, f)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def bench_journal(payload, saves):
+    ops, tracker = checkpoint.prepare(payload, None)
+    checkpoint.persist("bench", ops)
+    timings = []
+    for i in range(saves):
+        payload["encounter_events"].append(make_event(i))
+        payload["ledger_row_index"] += 1
+        start = time.perf_counter()
+        ops, tracker = checkpoint.prepare(payload, tracker)
+        checkpoint.persist("bench", ops)
+        timings.append(time.perf_counter() - start)
+    assert checkpoint.load("bench") == payload
+    return timings
+
+
+def summarise(timings):
+    ordered = sorted(timings)
+    median = ordered[len(ordered) // 2] * 1000
+    mean = sum(timings) / len(timings) * 1000
+    return median, mean
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--saves", type=int, default=200, help="checkpoints timed per session length")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="step_bench_checkpoint_")
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    os.makedirs("data_out", exist_ok=True)
+    try:
+        print(f"{'encounters':>10} {'full rewrite median/mean ms':>30} {'journal median/mean ms':>26}")
+        for n in ENCOUNTER_COUNTS:
+            full = summarise(bench_full_rewrite(make_payload(n), args.saves))
+            checkpoint.delete("bench")
+            journal = summarise(bench_journal(make_payload(n), args.saves))
+            checkpoint.delete("bench")
+            print(f"{n:>10} {full[0]:>18.3f} / {full[1]:<9.3f} {journal[0]:>14.3f} / {journal[1]:<9.3f}")
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
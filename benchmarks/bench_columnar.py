@@ -0,0 +1,162 @@
+"""
+Disk size and analyst load time: CSV ledgers vs the columnar ledger (src/columnar.py).
+
+Run from the repo root:
+    python benchmarks/bench_columnar.py [--sessions 500]
+
+Synthetic sessions (reveals, decisions, encounters, NASA-TLX, post-survey,
+session end) are written through the files backend with the columnar copy on,
+so both formats hold the same rows. The columnar copy is measured after
+shutdown, once its streams are compacted to Parquet. Load times are for the
+analyst's usual reads: every row in the wide view, the typed encounter table,
+and the typed decision events.
+"""
+import os
+import sys
+import glob
+import time
+import random
+import shutil
+import argparse
+import tempfile
+
+sys.path.append(os.getcwd())
+
+import pandas as pd
+from src import columnar, engine, rescoring, storage
+
+ENCOUNTER_NUMBERS = ["Time_to_First_Action", "Time_to_Tag", "Dwell_rr", "Dwell_pulse_rad", "Seq_Error_Count"]
+
+
+def session_rows(rng, session_id):
+    """A session's ledger rows as append_ledger_row hands them to the store, split at phase boundaries."""
+    common = {"session_id": session_id, "schema_version": engine.SCHEMA_VERSION, "app_version": engine.APP_VERSION,
+              "content_pack_hash": "c" * 64, "participant_role": "Paramedic", "fatigue_status": "Rested",
+              "prior_triage_training": "Yes", "clock_source": "monotonic", "tool_id": rng.choice(["SMART", "TST"])}
+    phases, t_run = [], 0
+    for order in range(1, 41):
+        patient = dict(common, patient_id=f"P{order:02d}", scenario_type="Day", is_practice="False")
+        rows, t_real = [], 0
+        for _ in range(rng.randint(2, 7)):
+            t_real += rng.randint(300, 6000)
+            rows.append(dict(patient, record_type="event", event_type="reveal", action_key=rng.choice(
+                ["rr", "pulse_rad", "walk", "cap_refill", "airway"]), reference_tag_normalized="Red",
+                t_real_ms=str(t_real), t_sim_ms=str(t_real + 500), server_latency_ms=str(rng.randint(2, 30))))
+        t_real += rng.randint(300, 6000)
+        rows.append(dict(patient, record_type="event", event_type="decision", action_key="triage_decision",
+                         decision_raw="Immediate", user_tag_normalized="Red", reference_tag_normalized="Red",
+                         deviation=str(rng.choice([-1, 0, 0, 1])), t_real_ms=str(t_real), t_sim_ms=str(t_real + 500),
+                         server_latency_ms=str(rng.randint(2, 30))))
+        rows.append(dict(patient, record_type="encounter", patient_sequence_order=str(order),
+                         Time_to_First_Action=str(rng.randint(300, 6000)), Time_to_Tag=str(t_real),
+                         Dwell_rr=str(rng.randint(300, 6000)), Dwell_Measurable="True", Seq_Error_Count="0",
+                         Seq_Error_Measurable="True", LSI_Applicable="False",
+                         Error_Class=rng.choice(["Correct", "Over", "Under"])))
+        t_run += t_real
+        for row in rows:
+            row["t_run_ms"] = str(t_run)
+        phases.append(rows)
+        if order % 20 == 0:
+            phases.append([dict(common, record_type="tlx", t_run_ms=str(t_run), scenario_type="Day",
+                                **{f"nasa_{k}": str(rng.randint(0, 100)) for k in
+                                   ["mental", "temporal", "effort", "frustration", "performance"]})])
+    phases.append([dict(common, record_type="post", t_run_ms=str(t_run), post_understanding="60",
+                        post_preparedness="70", post_tool_effective="80")])
+    phases.append([dict(common, record_type="session_end", t_run_ms=str(t_run), n_encounters_total="40",
+                        n_real_encounters="40", mean_time_to_tag_ms=str(rng.randint(1000, 9000) / 3),
+                        critical_under_rate="0.05")])
+    return phases
+
+
+def write_sessions(workdir, n_sessions, seed):
+    rng = random.Random(seed)
+    ledgers = os.path.join(workdir, "data_out")
+    store = storage.FileStore(engine.LEDGER_COLUMNS, columnar=columnar.ColumnarLedger(
+        engine.LEDGER_COLUMNS, directory=os.path.join(ledgers, "columnar")))
+    for n in range(n_sessions):
+        session_id = f"{n:08d}-0000-4000-8000-{rng.getrandbits(48):012x}"
+        path = os.path.join(ledgers, f"logs_{session_id}_20260101_000000.csv")
+        index = 0
+        for rows in session_rows(rng, session_id):
+            for row in rows:
+                index += 1
+                fresh = {c: "" for c in engine.LEDGER_COLUMNS}
+                fresh.update(row, ledger_row_index=str(index))
+                store.append_ledger_row(path, fresh)
+            store.flush_ledger(path)
+        store.close_ledger(path)
+    store.close()
+    return ledgers
+
+
+def timed(fn, repeats=3):
+    """Best of repeats, in seconds, and the last result."""
+    best, result = None, None
+    for _ in range(repeats):
+        started = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def csv_encounters(ledgers):
+    df = rescoring.load_ledgers(ledgers, record_types=("encounter",))
+    for column in ENCOUNTER_NUMBERS:
+        df[column] = pd.to_numeric(df[column], errors="coerce")
+    return df
+
+
+def csv_decisions(ledgers):
+    df = rescoring.load_ledgers(ledgers, record_types=("event",))
+    df = df[df["event_type"] == "decision"].copy()
+    for column in ["t_real_ms", "deviation"]:
+        df[column] = pd.to_numeric(df[column], errors="coerce")
+    return df
+
+
+def columnar_decisions(directory):
+    df = columnar.read_columnar("event", directory)
+    return df[df["event_type"] == "decision"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sessions", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="step_bench_columnar_")
+    try:
+        ledgers = write_sessions(workdir, args.sessions, args.seed)
+        directory = os.path.join(ledgers, "columnar")
+        csv_files = storage.list_ledger_files(ledgers)
+        parts = glob.glob(os.path.join(directory, "*", "*.parquet"))
+        csv_bytes = sum(os.path.getsize(p) for p in csv_files)
+        columnar_bytes = sum(os.path.getsize(p) for p in parts)
+        rows = sum(1 for p in csv_files for _ in open(p, encoding="utf-8")) - len(csv_files)
+
+        print(f"{args.sessions} sessions, {rows} ledger rows")
+        print(f"{'':<28}{'CSV':>12}{'columnar':>12}{'ratio':>8}")
+        print(f"{'files':<28}{len(csv_files):>12}{len(parts):>12}")
+        print(f"{'size (KB)':<28}{csv_bytes / 1024:>12.0f}{columnar_bytes / 1024:>12.0f}"
+              f"{csv_bytes / columnar_bytes:>7.1f}x")
+
+        loads = [
+            ("all rows, wide view (s)", lambda: rescoring.load_ledgers(ledgers, record_types=tuple(
+                set(columnar.RECORD_COLUMNS) | {"other"})), lambda: columnar.read_wide(directory)),
+            ("encounters, typed (s)", lambda: csv_encounters(ledgers),
+             lambda: columnar.read_columnar("encounter", directory)),
+            ("decision events, typed (s)", lambda: csv_decisions(ledgers), lambda: columnar_decisions(directory)),
+        ]
+        for label, from_csv, from_columnar in loads:
+            csv_s, csv_df = timed(from_csv)
+            columnar_s, columnar_df = timed(from_columnar)
+            assert len(csv_df) == len(columnar_df), (label, len(csv_df), len(columnar_df))
+            print(f"{label:<28}{csv_s:>12.3f}{columnar_s:>12.3f}{csv_s / columnar_s:>7.1f}x")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
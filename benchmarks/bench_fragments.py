@@ -0,0 +1,227 @@
+"""
+Server CPU, payload and latency per reveal click: fragment reruns vs full-page reruns.
+
+Run from the repo root:
+    python benchmarks/bench_fragments.py [--reveals 60]
+
+Starts `streamlit run app.py` twice in a scratch directory, once with the action
+grid and triage panel as fragments and once with STEP_FRAGMENTS=0. Each time a
+websocket client plays a participant: it picks the content pack, completes
+onboarding, then reveals findings (and makes a decision when a card runs out)
+until --reveals reveal clicks have been timed. Server CPU is read from
+/proc/<pid>/stat around each reveal and resident memory from /proc/<pid>/status
+after the last one, so this needs Linux. --no-post-script-gc runs the server with
+runner.postScriptGC off, to weigh its CPU saving against memory growth.
+"""
+import os
+import sys
+import time
+import shutil
+import asyncio
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+sys.path.append(os.getcwd())
+
+import websockets
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+import load_test
+from bench_startup import CONTENT_PACK, free_port, percentile
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+# Buttons that only move the participant on to the next card
+ADVANCE_BUTTONS = ["Start Practice", "Start Simulation", "Submit Assessment", "Skip Washout", "Start Next Scenario"]
+RECV_TIMEOUT_S = 30
+
+
+def cpu_seconds(pid):
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+
+
+def rss_mb(pid):
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return None
+
+
+class Browser:
+    """
+    The page as a browser tab holds it: elements by delta path, replaced by each
+    run's deltas, with stale ones dropped when the run (or fragment run) ends.
+    """
+
+    def __init__(self, ws):
+        self.ws = ws
+        self.elements = {}
+        self.cache = {}
+
+    async def run(self, trigger=None, widgets=()):
+        msg = BackMsg()
+        msg.rerun_script.query_string = ""
+        msg.rerun_script.page_script_hash = ""
+        msg.rerun_script.widget_states.widgets.extend(widgets)
+        if trigger:
+            state = msg.rerun_script.widget_states.widgets.add()
+            state.id = trigger["id"]
+            state.trigger_value = True
+            msg.rerun_script.fragment_id = trigger["fragment_id"]
+        await self.ws.send(msg.SerializeToString())
+
+        received = 0
+        touched = set()
+        fragments = set()
+        while True:
+            raw = await asyncio.wait_for(self.ws.recv(), RECV_TIMEOUT_S)
+            received += len(raw)
+            fm = ForwardMsg()
+            fm.ParseFromString(raw)
+            kind = fm.WhichOneof("type")
+            if kind == "new_session":
+                # A script run (a rerun requested by the script starts another)
+                touched = set()
+                fragments = set()
+            elif kind == "ref_hash":
+                path = list(fm.metadata.delta_path)
+                fm = self.cache[fm.ref_hash]
+                kind = "delta"
+            else:
+                path = list(fm.metadata.delta_path)
+                if fm.hash:
+                    self.cache[fm.hash] = fm
+            if kind == "delta" and fm.delta.WhichOneof("type") == "new_element":
+                element = fm.delta.new_element
+                element_type = element.WhichOneof("type")
+                key = tuple(path)
+                touched.add(key)
+                fragments.add(fm.delta.fragment_id)
+                self.elements[key] = {"type": element_type, "proto": getattr(element, element_type),
+                                      "fragment_id": fm.delta.fragment_id}
+            elif kind == "script_finished":
+                status = fm.script_finished
+                if status == ForwardMsg.FINISHED_SUCCESSFULLY:
+                    self.elements = {k: v for k, v in self.elements.items() if k in touched}
+                elif status == ForwardMsg.FINISHED_FRAGMENT_RUN_SUCCESSFULLY:
+                    self.elements = {k: v for k, v in self.elements.items()
+                                     if k in touched or v["fragment_id"] not in fragments}
+                else:
+                    continue
+                return received
+
+    def widgets(self, element_type, label=None):
+        found = []
+        for element in self.elements.values():
+            if element["type"] == element_type and (label is None or element["proto"].label == label):
+                found.append({"id": element["proto"].id, "label": element["proto"].label,
+                              "fragment_id": element["fragment_id"], "proto": element["proto"]})
+        return found
+
+    def button(self, label=None, key_prefix=None):
+        for button in self.widgets("button", label):
+            if key_prefix is None or f"-{key_prefix}" in button["id"]:
+                return button
+        return None
+
+
+async def onboard(browser):
+    """Content pack, onboarding form and practice intro, as load_test.py does them."""
+    await browser.run()
+    picker = browser.widgets("selectbox", "Select In-App Config File")[0]
+    choice = BackMsg().rerun_script.widget_states.widgets.add()
+    choice.id = picker["id"]
+    choice.string_value = CONTENT_PACK
+    await browser.run(widgets=[choice])
+
+    answers = []
+    for label, options in load_test.ONBOARDING_ANSWERS.items():
+        state = BackMsg().rerun_script.widget_states.widgets.add()
+        state.id = browser.widgets("selectbox", label)[0]["id"]
+        state.string_value = options[0]
+        answers.append(state)
+    for checkbox in browser.widgets("checkbox"):
+        state = BackMsg().rerun_script.widget_states.widgets.add()
+        state.id = checkbox["id"]
+        state.bool_value = True
+        answers.append(state)
+    await browser.run(trigger=browser.button("Start Study"), widgets=answers)
+
+
+async def participant(port, pid, reveals):
+    async with websockets.connect(f"ws://127.0.0.1:{port}/_stcore/stream",
+                                  subprotocols=["streamlit"], max_size=None) as ws:
+        browser = Browser(ws)
+        await onboard(browser)
+        samples = []
+        while len(samples) < reveals:
+            reveal = browser.button(key_prefix="btn_")
+            if reveal:
+                cpu = cpu_seconds(pid)
+                started = time.perf_counter()
+                received = await browser.run(trigger=reveal)
+                samples.append({"ms": (time.perf_counter() - started) * 1000,
+                                "cpu_ms": (cpu_seconds(pid) - cpu) * 1000, "bytes": received})
+                continue
+            button = browser.button(key_prefix="decision_")
+            if button is None:
+                button = next((browser.button(label) for label in ADVANCE_BUTTONS if browser.button(label)), None)
+            if button is None:
+                raise RuntimeError(f"stuck at {[b['label'] for b in browser.widgets('button')]}")
+            await browser.run(trigger=button)
+        return samples, rss_mb(pid)
+
+
+def measure(workdir, fragments, reveals, post_script_gc=True):
+    port = free_port()
+    env = dict(os.environ, STEP_FRAGMENTS="1" if fragments else "0")
+    server = subprocess.Popen(
+        [sys.executable, "-m", "streamlit", "run", os.path.join(load_test.REPO_DIR, "app.py"),
+         "--server.headless", "true", "--server.port", str(port), "--browser.gatherUsageStats", "false",
+         "--server.fileWatcherType", "none", "--runner.postScriptGC", str(post_script_gc).lower()],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.time() + 30
+        while True:
+            try:
+                return asyncio.run(participant(port, server.pid, reveals))
+            except OSError:
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.2)
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--reveals", type=int, default=60)
+    parser.add_argument("--no-post-script-gc", action="store_true",
+                        help="Turn off Streamlit's full gc.collect() after each script run")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="step_fragments_")
+    load_test.prepare_workdir(workdir)
+    # The server reads .streamlit/config.toml from its working directory
+    os.symlink(os.path.join(load_test.REPO_DIR, ".streamlit"), os.path.join(workdir, ".streamlit"))
+    try:
+        print(f"{args.reveals} reveal clicks each, postScriptGC {'off' if args.no_post_script_gc else 'on'}")
+        print(f"{'mode':<10} {'CPU ms/click':>13} {'bytes/click':>12} {'p50 ms':>8} {'p95 ms':>8} {'RSS MB':>8}")
+        for name, fragments in [("full page", False), ("fragments", True)]:
+            samples, rss = measure(workdir, fragments, args.reveals, not args.no_post_script_gc)
+            latency = [s["ms"] for s in samples]
+            print(f"{name:<10} {statistics.mean(s['cpu_ms'] for s in samples):>13.1f} "
+                  f"{statistics.median(s['bytes'] for s in samples):>12.0f} "
+                  f"{statistics.median(latency):>8.1f} {percentile(latency, 0.95):>8.1f} {rss:>8.1f}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
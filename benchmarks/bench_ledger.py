@@ -0,0 +1,102 @@
+"""
+Ledger write throughput: legacy open-append-close per row vs the buffered LedgerWriter.
+
+Run from the repo root:
+    python benchmarks/bench_ledger.py [--rows 200]
+
+Each simulated session writes its own ledger CSV from its own thread, which is
+how concurrent Streamlit sessions hit the disk.
+"""
+import os
+import sys
+import csv
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+
+sys.path.append(os.getcwd())
+
+from src.engine import LEDGER_COLUMNS
+from src.ledger import LedgerWriter
+
+SESSION_COUNTS = [1, 10, 100]
+
+
+def make_row(i):
+    row = {col: "" for col in LEDGER_COLUMNS}
+    row.update({
+        "ledger_row_index": str(i),
+        "record_type": "event",
+        "event_type": "reveal",
+        "action_key": "rr",
+        "t_real_ms": str(i * 350),
+    })
+    return row
+
+
+def legacy_append(filepath, row):
+    """The pre-LedgerWriter implementation of append_ledger_row's I/O."""
+    header = not os.path.exists(filepath)
+    with open(filepath, "a", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=LEDGER_COLUMNS)
+        if header:
+            writer.writeheader()
+        writer.writerow(row)
+        f.flush()
+
+
+def run_legacy(workdir, session_idx, rows):
+    path = os.path.join(workdir, f"logs_{session_idx}.csv")
+    for row in rows:
+        legacy_append(path, row)
+
+
+def run_writer(durability):
+    def _run(workdir, session_idx, rows):
+        path = os.path.join(workdir, f"logs_{session_idx}.csv")
+        writer = LedgerWriter(path, LEDGER_COLUMNS, durability=durability)
+        for i, row in enumerate(rows):
+            writer.append(row)
+            # Phase boundary every 5 rows mirrors the reveal/decision rhythm
+            if i % 5 == 4:
+                writer.flush()
+        writer.close()
+    return _run
+
+
+def measure(target, n_sessions, n_rows):
+    workdir = tempfile.mkdtemp(prefix="step_bench_ledger_")
+    rows = [make_row(i) for i in range(n_rows)]
+    threads = [threading.Thread(target=target, args=(workdir, s, rows)) for s in range(n_sessions)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    shutil.rmtree(workdir, ignore_errors=True)
+    return (n_sessions * n_rows) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=200, help="rows written per session")
+    args = parser.parse_args()
+
+    variants = [
+        ("legacy (open/append/close)", run_legacy),
+        ("LedgerWriter buffered", run_writer("buffered")),
+        ("LedgerWriter group_commit", run_writer("group_commit")),
+    ]
+
+    print(f"Rows per session: {args.rows} (phase boundary flush every 5 rows)")
+    print(f"{'variant':<30}" + "".join(f"{n:>12} sess" for n in SESSION_COUNTS))
+    for name, target in variants:
+        rates = [measure(target, n, args.rows) for n in SESSION_COUNTS]
+        print(f"{name:<30}" + "".join(f"{r:>12.0f} r/s" for r in rates))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+What each patient-screen rerun sends to the browser: ForwardMsg bytes, elements,
+iframes and the raw HTML nodes injected through markdown and iframes.
+
+Run from the repo root:
+    python benchmarks/bench_payload.py [--reruns 60]
+
+Scripts a participant through app.py with AppTest (the load_test.py flow) and
+records the messages of every rerun that ends on a patient card. DOM node
+counts proper need a browser; the raw HTML tag count stands in for the nodes
+the app itself injects, on top of Streamlit's own per-element markup.
+"""
+import os
+import sys
+import shutil
+import argparse
+import tempfile
+import statistics
+from html.parser import HTMLParser
+
+sys.path.append(os.getcwd())
+
+from streamlit.testing.v1.local_script_runner import LocalScriptRunner
+
+import load_test
+
+_last_run = []
+_forward_msgs = LocalScriptRunner.forward_msgs
+
+
+def _recording_forward_msgs(self):
+    msgs = _forward_msgs(self)
+    _last_run[:] = list(msgs)
+    return msgs
+
+
+class TagCounter(HTMLParser):
+    def __init__(self):
+        super().__init__()
+        self.tags = 0
+
+    def handle_starttag(self, tag, attrs):
+        self.tags += 1
+
+
+def html_nodes(text):
+    counter = TagCounter()
+    counter.feed(text)
+    return counter.tags
+
+
+def measure(msgs):
+    stats = {"bytes": 0, "elements": 0, "iframes": 0, "html_nodes": 0, "style_bytes": 0}
+    for msg in msgs:
+        stats["bytes"] += msg.ByteSize()
+        if msg.WhichOneof("type") != "delta" or msg.delta.WhichOneof("type") != "new_element":
+            continue
+        element = msg.delta.new_element
+        kind = element.WhichOneof("type")
+        stats["elements"] += 1
+        if kind in ("iframe", "component_instance"):
+            stats["iframes"] += 1
+        raw = ""
+        if kind == "markdown" and element.markdown.allow_html:
+            raw = element.markdown.body
+        elif kind == "iframe":
+            raw = element.iframe.srcdoc
+        elif kind == "html":
+            raw = element.html.body
+        if raw:
+            stats["html_nodes"] += html_nodes(raw)
+            if "<style" in raw or "<script" in raw:
+                stats["style_bytes"] += len(raw.encode("utf-8"))
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--reruns", type=int, default=60)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="step_payload_")
+    load_test.prepare_workdir(workdir)
+    os.chdir(workdir)
+    LocalScriptRunner.forward_msgs = _recording_forward_msgs
+    try:
+        participant = load_test.Participant(0, args.seed, timeout=30)
+        samples = []
+        while len(samples) < args.reruns and not participant.done:
+            participant.step()
+            if participant.error:
+                raise RuntimeError(participant.error)
+            if any(b.key and b.key.startswith("decision_") for b in participant.at.button):
+                samples.append(measure(_last_run))
+    finally:
+        LocalScriptRunner.forward_msgs = _forward_msgs
+        os.chdir(load_test.REPO_DIR)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"{len(samples)} patient-screen reruns (median per rerun)")
+    for name in ["bytes", "elements", "iframes", "html_nodes", "style_bytes"]:
+        print(f"  {name:<12} {statistics.median(s[name] for s in samples):>8.0f}")
+
+
+if __name__ == "__main__":
+    main()
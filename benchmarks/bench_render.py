@@ -0,0 +1,142 @@
+"""
+Per-rerun cost of preparing the patient card and action grid:
+the old DataFrame path vs the precompiled PatientRenderModel.
+
+Run from the repo root:
+    python benchmarks/bench_render.py [--reruns 300]
+
+Only the data preparation that components.py performs each rerun is timed
+(filtering actions, building the grid, resolving findings and the avatar path);
+the Streamlit element calls themselves are identical in both versions.
+
+The avatar section compares decoding the full-size PNG and re-encoding it for
+the browser (what st.image did with a PIL image) against the shared avatar cache.
+"""
+import os
+import sys
+import time
+import argparse
+
+sys.path.append(os.getcwd())
+
+import io
+import pandas as pd
+from PIL import Image
+from src import utils
+from src.engine import get_investigation_result
+from src.pack_index import ContentPackIndex, CATEGORY_LAYOUTS
+from src.avatars import AvatarCache
+
+CONTENT_PATH = "config/study_content_pack.xlsx"
+
+
+def legacy_prepare(patient, config_df, tool_id, revealed):
+    """The pre-render-model logic of render_patient_* and render_action_buttons."""
+    avatar_file = patient.get("Avatar_File", "default.png")
+    if pd.isna(avatar_file):
+        avatar_file = "default.png"
+    path = os.path.join("assets/img", avatar_file)
+    if not os.path.exists(path) or not avatar_file:
+        path = "assets/img/default.png"
+
+    visible_text = patient.get("Visible_Text")
+    if pd.isna(visible_text) or visible_text is None:
+        visible_text = "No visible findings recorded."
+
+    valid_actions = config_df[config_df['Valid_Tools'].str.contains(tool_id, na=False)]
+    grid = []
+    for header_name, action_keys in CATEGORY_LAYOUTS[tool_id].items():
+        cat_actions = pd.DataFrame()
+        for key in action_keys:
+            match = valid_actions[valid_actions['Action_Key'] == key]
+            if not match.empty:
+                cat_actions = pd.concat([cat_actions, match])
+        if cat_actions.empty:
+            continue
+        visible_buttons = []
+        for _, row in cat_actions.iterrows():
+            key = row['Action_Key']
+            raw_result = str(patient.get(f"{key}_Text", ""))
+            if key not in ["airway_man", "hemorrhage_ctrl", "recovery_pos"]:
+                if "not applicable" in raw_result.lower():
+                    continue
+            visible_buttons.append(row)
+        if not visible_buttons:
+            continue
+        for _, row in pd.DataFrame(visible_buttons).iterrows():
+            key = row['Action_Key']
+            if key in revealed:
+                grid.append((key, get_investigation_result(patient, key)))
+            else:
+                grid.append((key, row['Button_Label']))
+    return path, visible_text, grid
+
+
+def model_prepare(model, tool_id, revealed):
+    grid = []
+    for _, _, actions in model.layout(tool_id):
+        for action in actions:
+            if action.key in revealed:
+                grid.append((action.key, model.results[action.key]))
+            else:
+                grid.append((action.key, action.label))
+    return model.avatar_path, model.visible_text, grid
+
+
+def legacy_avatar(path):
+    """Image.open plus st.image's JPEG encode of the full-size image."""
+    image = Image.open(path)
+    out = io.BytesIO()
+    image.convert("RGB").save(out, format="JPEG", quality=90)
+    return out.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--reruns", type=int, default=300)
+    args = parser.parse_args()
+
+    sheets = utils.prepare_content_pack(utils.load_content_pack(CONTENT_PATH))
+    patients = sheets["Patients"].to_dict("records")
+
+    start = time.perf_counter()
+    index = ContentPackIndex(sheets)
+    compile_ms = (time.perf_counter() - start) * 1000
+    print(f"Compile {len(patients)} patients: {compile_ms:.1f} ms (once per content pack)")
+
+    for tool_id in ["SMART", "TST"]:
+        revealed = {"walk", "rr"}
+        start = time.perf_counter()
+        for i in range(args.reruns):
+            legacy_prepare(patients[i % len(patients)], sheets["Config"], tool_id, revealed)
+        legacy_us = (time.perf_counter() - start) / args.reruns * 1e6
+
+        start = time.perf_counter()
+        for i in range(args.reruns):
+            model_prepare(index.patient_model(patients[i % len(patients)]["ID"]), tool_id, revealed)
+        model_us = (time.perf_counter() - start) / args.reruns * 1e6
+
+        print(f"{tool_id:<6} legacy {legacy_us:10.1f} us/rerun   render model {model_us:8.1f} us/rerun   "
+              f"({legacy_us / model_us:.0f}x)")
+
+    paths = sorted({index.patient_model(p["ID"]).avatar_path for p in patients})
+    reruns = min(args.reruns, 50)
+    start = time.perf_counter()
+    legacy_bytes = 0
+    for i in range(reruns):
+        legacy_bytes = len(legacy_avatar(paths[i % len(paths)]))
+    legacy_us = (time.perf_counter() - start) / reruns * 1e6
+
+    cache = AvatarCache()
+    for path in paths:
+        cache.get_bytes(path)
+    start = time.perf_counter()
+    for i in range(args.reruns):
+        cached_bytes = len(cache.get_bytes(paths[i % len(paths)]))
+    cached_us = (time.perf_counter() - start) / args.reruns * 1e6
+    print(f"avatar legacy {legacy_us:10.1f} us/rerun ({legacy_bytes / 1024:.0f} KB)   "
+          f"avatar cache {cached_us:8.1f} us/rerun ({cached_bytes / 1024:.0f} KB)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Ledger replication cost as ledgers pile up: the first pass over a long history,
+then a steady-state pass after a few rows were appended to many ledgers.
+
+Run from the repo root:
+    python benchmarks/bench_replication.py [--ledgers 3000] [--rows 40] [--touched 100]
+
+Writes --ledgers ledger CSVs of --rows rows each to a scratch data_out/, replicates
+them to a directory sink, then appends one row to --touched of them and
+replicates again. Reports each pass's time, batches and the cursor file's size.
+"""
+import os
+import sys
+import csv
+import time
+import uuid
+import shutil
+import argparse
+import tempfile
+
+sys.path.append(os.getcwd())
+
+from src.engine import LEDGER_COLUMNS
+from src import replication
+
+
+def make_row(session_id, i):
+    row = {col: "" for col in LEDGER_COLUMNS}
+    row.update({"session_id": session_id, "ledger_row_index": str(i), "record_type": "event",
+                "event_type": "reveal", "action_key": "rr", "t_real_ms": str(i * 350)})
+    return row
+
+
+def write_ledgers(directory, n_ledgers, n_rows):
+    paths = []
+    for n in range(n_ledgers):
+        session_id = str(uuid.uuid4())
+        path = os.path.join(directory, f"logs_{session_id}_20260101_{n:06d}.csv")
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=LEDGER_COLUMNS)
+            writer.writeheader()
+            writer.writerows(make_row(session_id, i) for i in range(1, n_rows + 1))
+        paths.append((path, session_id))
+    return paths
+
+
+def timed_pass(replicator):
+    batches = replicator.batches
+    started = time.perf_counter()
+    rows = replicator.run_once()
+    return rows, replicator.batches - batches, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--ledgers", type=int, default=3000)
+    parser.add_argument("--rows", type=int, default=40)
+    parser.add_argument("--touched", type=int, default=100)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="step_replication_")
+    ledgers = os.path.join(workdir, "data_out")
+    os.makedirs(ledgers)
+    try:
+        paths = write_ledgers(ledgers, args.ledgers, args.rows)
+        sink = replication.DirectorySink(os.path.join(workdir, "replica"), LEDGER_COLUMNS)
+        state_path = os.path.join(workdir, "replication_bench.json")
+        replicator = replication.Replicator("bench", replication.FileLedgerSource(ledgers), sink,
+                                            state_path=state_path)
+
+        rows, batches, elapsed = timed_pass(replicator)
+        print(f"First pass: {rows} rows from {args.ledgers} ledgers in {batches} batches, {elapsed:.2f}s; "
+              f"cursor {os.path.getsize(state_path) / 1024:.0f} KB")
+
+        for path, session_id in paths[:args.touched]:
+            with open(path, "a", newline="", encoding="utf-8") as f:
+                csv.DictWriter(f, fieldnames=LEDGER_COLUMNS).writerow(make_row(session_id, args.rows + 1))
+        rows, batches, elapsed = timed_pass(replicator)
+        print(f"Steady state: {rows} new rows across {args.touched} ledgers in {batches} batches, "
+              f"{elapsed * 1000:.0f} ms")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
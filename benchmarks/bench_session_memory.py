@@ -0,0 +1,88 @@
+"""
+Memory held per browser session for the content pack:
+a private copy of the pack in every session vs the shared content-pack registry.
+
+Run from the repo root:
+    python benchmarks/bench_session_memory.py [--sessions 200]
+
+Legacy sessions each hold their own DataFrames (what st.session_state.content_pack
+held), the patient_map of record dicts and the patient_queue of records.
+Registry sessions hold only the content hash and the queue of patient IDs; the
+pack itself is registered once. Allocations are measured with tracemalloc.
+"""
+import os
+import sys
+import pickle
+import random
+import argparse
+import tracemalloc
+
+sys.path.append(os.getcwd())
+
+from src import utils
+from src.content_registry import ContentPackRegistry
+
+CONTENT_PATH = "config/study_content_pack.xlsx"
+
+
+def queue_ids(df_patients):
+    ids = df_patients["ID"].tolist()
+    random.shuffle(ids)
+    return ids
+
+
+def legacy_session(pack_bytes):
+    sheets = pickle.loads(pack_bytes)
+    records = sheets["Patients"].to_dict("records")
+    patient_map = {record["ID"]: record for record in records}
+    ids = queue_ids(sheets["Patients"])
+    return {
+        "content_pack": sheets,
+        "patient_map": patient_map,
+        "patient_queue": [patient_map[pid] for pid in ids],
+        "patient_queue_ids": ids,
+    }
+
+
+def registry_session(registry, content_hash, sheets):
+    pack = registry.register(content_hash, sheets)
+    return {
+        "content_pack_hash": content_hash,
+        "patient_queue_ids": queue_ids(pack.sheets["Patients"]),
+    }
+
+
+def measure(make_session, n_sessions):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    sessions = [make_session() for _ in range(n_sessions)]
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del sessions
+    return current - before, peak - before
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sessions", type=int, default=200)
+    args = parser.parse_args()
+
+    content_hash = utils.calculate_hash(CONTENT_PATH)
+    sheets = utils.prepare_content_pack(utils.load_content_pack(CONTENT_PATH))
+    # Each legacy session parsed its own copy; unpickling reproduces that without re-reading Excel
+    pack_bytes = pickle.dumps(sheets, protocol=pickle.HIGHEST_PROTOCOL)
+
+    legacy_total, legacy_peak = measure(lambda: legacy_session(pack_bytes), args.sessions)
+    registry = ContentPackRegistry()
+    shared_total, shared_peak = measure(lambda: registry_session(registry, content_hash, sheets), args.sessions)
+
+    n = args.sessions
+    print(f"{n} sessions, {len(sheets['Patients'])} patients per pack")
+    print(f"{'mode':<10} {'total MB':>10} {'peak MB':>10} {'KB/session':>12}")
+    for name, total, peak in [("legacy", legacy_total, legacy_peak), ("registry", shared_total, shared_peak)]:
+        print(f"{name:<10} {total / 1e6:10.2f} {peak / 1e6:10.2f} {total / n / 1024:12.1f}")
+    print(f"registry holds {len(registry)} pack(s); reduction {legacy_total / max(shared_total, 1):.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+Time-to-first-interactive for a burst of new participants arriving at once.
+
+Run from the repo root:
+    python benchmarks/bench_startup.py [--bursts 1 10 25] [--port 8599]
+
+Starts the app with `streamlit run` and drives it over Streamlit's websocket
+protocol, the way a browser tab does: N sessions connect together, each picks
+the Mode A content pack, and the clock stops when that session receives the
+onboarding form's "Start Study" button (the first screen a participant can
+act on).
+
+Needs the `websockets` package (installed with current Streamlit releases).
+Like load_test.py, the sessions leave checkpoints in data_out/.
+"""
+import os
+import sys
+import time
+import socket
+import asyncio
+import argparse
+import statistics
+import subprocess
+
+sys.path.append(os.getcwd())
+
+import websockets
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+CONTENT_PACK = "study_content_pack.xlsx"
+READY_BUTTON = "Start Study"
+
+
+def rerun_message(widgets=()):
+    msg = BackMsg()
+    msg.rerun_script.query_string = ""
+    msg.rerun_script.page_script_hash = ""
+    msg.rerun_script.widget_states.widgets.extend(widgets)
+    return msg.SerializeToString()
+
+
+async def read_run(ws, until_element=None):
+    """
+    Reads ForwardMsgs until a script run finishes successfully. Returns the
+    elements delivered ({type: [proto, ...]}) and when until_element first
+    arrived (perf_counter).
+    """
+    elements = {}
+    seen_at = None
+    while True:
+        fm = ForwardMsg()
+        fm.ParseFromString(await ws.recv())
+        kind = fm.WhichOneof("type")
+        if kind == "delta" and fm.delta.WhichOneof("type") == "new_element":
+            element = fm.delta.new_element
+            element_type = element.WhichOneof("type")
+            proto = getattr(element, element_type)
+            elements.setdefault(element_type, []).append(proto)
+            if seen_at is None and until_element and until_element(element_type, proto):
+                seen_at = time.perf_counter()
+        elif kind == "script_finished" and fm.script_finished == ForwardMsg.FINISHED_SUCCESSFULLY:
+            return elements, seen_at
+
+
+def is_ready_button(element_type, proto):
+    return element_type == "button" and proto.label == READY_BUTTON
+
+
+async def new_participant(port):
+    """One browser tab: open the app, choose the content pack, wait for onboarding."""
+    async with websockets.connect(f"ws://127.0.0.1:{port}/_stcore/stream",
+                                  subprotocols=["streamlit"], max_size=None) as ws:
+        start = time.perf_counter()
+        await ws.send(rerun_message())
+        elements, _ = await read_run(ws)
+        first_paint = time.perf_counter() - start
+
+        picker = next(p for p in elements["selectbox"] if p.label == "Select In-App Config File")
+        choice = BackMsg().rerun_script.widget_states.widgets.add()
+        choice.id = picker.id
+        choice.string_value = CONTENT_PACK
+        await ws.send(rerun_message([choice]))
+        _, ready_at = await read_run(ws, until_element=is_ready_button)
+        if ready_at is None:
+            raise RuntimeError(f'"{READY_BUTTON}" was never rendered')
+        return {"first_paint": first_paint, "interactive": ready_at - start}
+
+
+async def burst(port, sessions):
+    return await asyncio.gather(*[new_participant(port) for _ in range(sessions)])
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(port):
+    server = subprocess.Popen(
+        [sys.executable, "-m", "streamlit", "run", "app.py", "--server.headless", "true",
+         "--server.port", str(port), "--browser.gatherUsageStats", "false"],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return server
+        except OSError:
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError("streamlit server did not start")
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--bursts", type=int, nargs="+", default=[1, 10, 25])
+    parser.add_argument("--port", type=int, default=0)
+    args = parser.parse_args()
+
+    port = args.port or free_port()
+    server = start_server(port)
+    try:
+        # Warm-up session loads the content pack into the shared caches
+        asyncio.run(burst(port, 1))
+        print(f"{'sessions':>8} {'paint p50':>10} {'ready p50':>10} {'ready p95':>10} "
+              f"{'ready max':>10} {'wall s':>7}")
+        for sessions in args.bursts:
+            start = time.perf_counter()
+            results = asyncio.run(burst(port, sessions))
+            wall = time.perf_counter() - start
+            ready = [r["interactive"] for r in results]
+            print(f"{sessions:>8} {statistics.median(r['first_paint'] for r in results):>10.2f} "
+                  f"{statistics.median(ready):>10.2f} {percentile(ready, 0.95):>10.2f} {max(ready):>10.2f} {wall:>7.2f}")
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+"""
+Prebuilds the resized WebP avatar variants served from static/avatars/.
+
+    python build_avatar_cache.py [--pack config/study_content_pack.xlsx]
+
+The app builds a missing variant on first use, so this is optional; running it
+before a session keeps that one-off resize off the first participant's rerun.
+"""
+import os
+import sys
+import argparse
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from src import utils, avatars
+from src.pack_index import ContentPackIndex, AVATAR_DIR, DEFAULT_AVATAR
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prebuild avatar variants for a content pack.")
+    parser.add_argument("--pack", default="config/study_content_pack.xlsx", help="Content pack (.xlsx)")
+    args = parser.parse_args()
+
+    content_hash = utils.calculate_hash(args.pack)
+    index = ContentPackIndex(utils.load_content_pack_cached(args.pack, content_hash))
+
+    sources = {os.path.join(AVATAR_DIR, DEFAULT_AVATAR)}
+    for patient_id in index.patient_ids():
+        sources.add(index.patient_model(patient_id).avatar_path)
+
+    source_bytes = 0
+    variant_bytes = 0
+    for source in sorted(sources):
+        path = avatars.build_static_variant(source)
+        source_bytes += os.path.getsize(source)
+        variant_bytes += os.path.getsize(path)
+        print(f"{source} -> {os.path.relpath(path)}")
+
+    print(f"{len(sources)} avatars: {source_bytes / 1024:.0f} KB source -> "
+          f"{variant_bytes / 1024:.0f} KB at {avatars.AVATAR_DISPLAY_PX}px WebP")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Live researcher dashboard: running metrics over every session, refreshed every
+few seconds. Run it as its own Streamlit app, next to the study, so participants
+never see it:
+
+    streamlit run dashboard.py --server.port 8502
+"""
+import streamlit as st
+import pandas as pd
+from src import live_metrics, storage
+
+st.set_page_config(page_title="STEP: Live Dashboard", page_icon="📈", layout="wide")
+
+
+@st.cache_resource
+def get_metrics():
+    """One set of running aggregates per dashboard server, shared by every open tab."""
+    tail = live_metrics.create_tail("sqlite" if storage.STORAGE_BACKEND == "sqlite" else "files")
+    return live_metrics.LiveMetrics(tail)
+
+
+def fmt(value, pattern):
+    return "–" if value is None else pattern.format(value)
+
+
+@st.fragment(run_every=live_metrics.DASHBOARD_REFRESH_SECONDS)
+def live_panel():
+    metrics = get_metrics()
+    metrics.poll()
+    snap = metrics.snapshot()
+    tag_ms = snap["mean_time_to_tag_ms"]
+
+    cols = st.columns(5)
+    cols[0].metric("Active participants", snap["active"])
+    cols[1].metric("Sessions finished", f"{snap['finished']} / {snap['sessions']}")
+    cols[2].metric("Events / min", fmt(snap["events_per_minute"], "{:.0f}"))
+    cols[3].metric("Mean Time to Tag", fmt(None if tag_ms is None else tag_ms / 1000, "{:.1f} s"))
+    cols[4].metric("Critical under-triage", fmt(snap["critical_under_rate"], "{:.1%}"))
+
+    left, right = st.columns([1, 2])
+    with left:
+        st.subheader("Active by phase")
+        st.dataframe(pd.DataFrame({"phase": list(snap["active_by_phase"]),
+                                   "participants": list(snap["active_by_phase"].values())}),
+                     hide_index=True, width="stretch")
+    with right:
+        st.subheader("By tool and scenario")
+        groups = pd.DataFrame(snap["groups"], columns=["tool_id", "scenario_type", "encounters",
+                                                       "mean_time_to_tag_ms", "critical_under_rate"])
+        st.dataframe(groups, hide_index=True, width="stretch", column_config={
+            "mean_time_to_tag_ms": st.column_config.NumberColumn("mean Time_to_Tag (ms)", format="%.0f"),
+            "critical_under_rate": st.column_config.NumberColumn("critical under rate", format="percent"),
+        })
+
+    st.caption(f"{snap['rows_read']} ledger rows read in total. Last refresh: {snap['last_poll_rows']} new rows, "
+               f"{snap['ledgers_checked']} ledgers checked, {snap['last_poll_ms']:.0f} ms. "
+               f"Active = unfinished and logged within {live_metrics.ACTIVE_WINDOW_SECONDS // 60} min.")
+
+
+st.title("📈 Live Dashboard")
+live_panel()
@@ -0,0 +1,385 @@
+"""
+Headless load test: scripts complete participants through app.py with
+streamlit.testing.v1.AppTest and reports rerun latency, ledger throughput,
+memory per session and error rates.
+
+    python load_test.py --participants 200 --concurrency 50 --processes 4
+
+Each worker process plays one STEP server: it keeps --concurrency participant
+sessions open at once and advances them round-robin, one rerun at a time, so
+they share the process-wide caches (content pack registry, session store,
+write-behind pool) the way browser sessions share a real server. Workers run
+in a scratch directory, so data_out/ in the repo is never touched.
+Results are printed and written to --out as JSON for regression tracking.
+"""
+import os
+import sys
+import csv
+import json
+import glob
+import logging
+import time
+import random
+import shutil
+import sqlite3
+import argparse
+import tempfile
+import multiprocessing
+from datetime import datetime, timezone
+
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_PATH = os.path.join(REPO_DIR, "app.py")
+CONTENT_PACK_FILE = "study_content_pack.xlsx"
+# A participant needs ~130 reruns; anything far beyond that is a stuck flow
+MAX_RERUNS_PER_PARTICIPANT = 1000
+
+ONBOARDING_ANSWERS = {
+    "Role": ["Paramedic", "Nurse", "Doctor", "Police", "Fire/Rescue", "Student/Other"],
+    "Years Experience": ["0-2 years", "2-5 years", "5-10 years", "10+ years"],
+    "Fatigue Status": [
+        "On Shift (Currently working)",
+        "Off Shift (<12 hours since last shift)",
+        "Rested (>12 hours since last shift)",
+    ],
+    "Prior Triage Training": ["None", "Hospital Triage Only", "TST Training", "SMART Training", "Other"],
+    "Assigned Tool": ["SMART", "TST"],
+}
+
+
+class ParticipantError(Exception):
+    pass
+
+
+class Participant:
+    """One scripted browser session. step() performs exactly one rerun."""
+
+    def __init__(self, number, seed, timeout):
+        from streamlit.testing.v1 import AppTest
+
+        self.number = number
+        self.rng = random.Random(seed)
+        self.at = AppTest.from_file(APP_PATH, default_timeout=timeout)
+        self.stage = "start"
+        self.latencies_ms = []
+        self.error = None
+        self.done = False
+        self.patient_index = None
+        self.target_reveals = 0
+
+    def step(self):
+        try:
+            self._step()
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+            self.done = True
+        if len(self.latencies_ms) >= MAX_RERUNS_PER_PARTICIPANT and not self.done:
+            self.error = f"Stuck after {len(self.latencies_ms)} reruns"
+            self.done = True
+
+    def session_state(self, key, default=None):
+        return self.at.session_state[key] if key in self.at.session_state else default
+
+    def _run(self, element=None):
+        started = time.perf_counter()
+        (element or self.at).run()
+        self.latencies_ms.append((time.perf_counter() - started) * 1000)
+        if self.at.exception:
+            raise ParticipantError(self.at.exception[0].message)
+
+    def _button(self, label):
+        for button in self.at.button:
+            if button.label == label:
+                return button
+        return None
+
+    def _step(self):
+        at = self.at
+        if self.stage == "start":
+            self._run()
+            self.stage = "content_pack"
+            return
+
+        if self.stage == "content_pack":
+            self._run(at.sidebar.selectbox[0].select(CONTENT_PACK_FILE))
+            self.stage = "onboarding"
+            return
+
+        if self.stage == "onboarding":
+            for selectbox in at.selectbox:
+                if selectbox.label in ONBOARDING_ANSWERS:
+                    selectbox.select(self.rng.choice(ONBOARDING_ANSWERS[selectbox.label]))
+            for slider in at.slider:
+                slider.set_value(self.rng.randint(0, 100))
+            for checkbox in at.checkbox:
+                checkbox.check()
+            self._run(self._button("Start Study").click())
+            if not self.session_state("onboarding_complete"):
+                raise ParticipantError("Onboarding form was rejected")
+            self.stage = "study"
+            return
+
+        labels = [b.label for b in at.button]
+        if "Start Practice" in labels:
+            self._run(self._button("Start Practice").click())
+        elif "Start Simulation" in labels:
+            self._run(self._button("Start Simulation").click())
+        elif "Submit Assessment" in labels:
+            for slider in at.slider:
+                slider.set_value(self.rng.randint(0, 100))
+            self._run(self._button("Submit Assessment").click())
+        elif "Skip Washout" in labels:
+            self._run(self._button("Skip Washout").click())
+        elif "Start Next Scenario" in labels:
+            self._run(self._button("Start Next Scenario").click())
+        elif "Submit & Finish" in labels:
+            for slider in at.slider:
+                slider.set_value(self.rng.randint(0, 100))
+            self._run(self._button("Submit & Finish").click())
+            if not self.session_state("completion_code"):
+                raise ParticipantError("Finished without a completion code")
+            self.done = True
+        else:
+            self._patient_step()
+
+    def _patient_step(self):
+        at = self.at
+        index = self.session_state("current_patient_index")
+        if index != self.patient_index:
+            self.patient_index = index
+            self.target_reveals = self.rng.randint(0, 4)
+
+        reveals = [b for b in at.button if b.key and b.key.startswith("btn_")]
+        if reveals and len(self.session_state("revealed_actions", ())) < self.target_reveals:
+            self._run(self.rng.choice(reveals).click())
+            return
+
+        decisions = [b for b in at.button if b.key and b.key.startswith("decision_")]
+        if not decisions:
+            raise ParticipantError(f"No action available (buttons: {[b.label for b in at.button]})")
+        self._run(self.rng.choice(decisions).click())
+
+
+def _rss_bytes():
+    """Current resident set size, or the peak where /proc is unavailable."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+    except ImportError:
+        return 0
+
+
+def run_worker(worker_id, participant_numbers, concurrency, seed, timeout, workdir):
+    """Runs participants in one process, keeping `concurrency` sessions live at a time."""
+    os.chdir(workdir)
+    if REPO_DIR not in sys.path:
+        sys.path.insert(0, REPO_DIR)
+    from src import engine, writebehind, utils, prefetch
+    import app  # noqa: F401 (imports every module the script uses)
+
+    # Deprecation notices are logged on every rerun and would drown the report
+    logging.getLogger("streamlit.deprecation_util").disabled = True
+
+    # Shared, one-off costs (imports, the compiled content pack) are not per-session memory
+    pack_path = os.path.join("config", CONTENT_PACK_FILE)
+    content_hash = utils.calculate_hash(pack_path)
+    engine.register_content_pack(content_hash, utils.load_content_pack_cached(pack_path, content_hash))
+
+    rss_start = _rss_bytes()
+    pending = list(participant_numbers)
+    active = []
+    finished = []
+    peak_rss = rss_start
+    peak_sessions = 0
+
+    while pending or active:
+        while pending and len(active) < concurrency:
+            number = pending.pop(0)
+            active.append(Participant(number, seed + number, timeout))
+        peak_sessions = max(peak_sessions, len(active))
+
+        for participant in list(active):
+            participant.step()
+            if participant.done:
+                active.remove(participant)
+                finished.append(participant)
+        peak_rss = max(peak_rss, _rss_bytes())
+
+    wb_metrics = writebehind.get_write_behind().metrics() if writebehind.WRITE_BEHIND_ENABLED else {}
+    prefetch_metrics = prefetch.get_prefetcher().metrics() if prefetch.PREFETCH_ENABLED else {}
+    engine.shutdown_io()
+
+    return {
+        "worker_id": worker_id,
+        "rss_start": rss_start,
+        "rss_peak": peak_rss,
+        "peak_sessions": peak_sessions,
+        "write_behind": wb_metrics,
+        "prefetch": prefetch_metrics,
+        "participants": [
+            {
+                "number": p.number,
+                "session_id": p.session_state("session_id"),
+                "completed": p.error is None,
+                "error": p.error,
+                "reruns": len(p.latencies_ms),
+                "latencies_ms": p.latencies_ms,
+                "expected_ledger_rows": p.session_state("total_ledger_rows", 0),
+            }
+            for p in finished
+        ],
+    }
+
+
+def count_persisted_rows(workdir):
+    """Ledger rows on disk (files backend) or in the database (sqlite backend)."""
+    from src.storage import STORAGE_BACKEND, SQLITE_PATH
+
+    if STORAGE_BACKEND == "sqlite":
+        db_path = os.path.join(workdir, SQLITE_PATH)
+        if not os.path.exists(db_path):
+            return 0
+        with sqlite3.connect(db_path) as conn:
+            return conn.execute("SELECT COUNT(*) FROM ledger").fetchone()[0]
+
+    total = 0
+    for path in glob.glob(os.path.join(workdir, "data_out", "*.csv")):
+        if os.path.basename(path) == "session_index.csv":
+            continue
+        with open(path, newline="", encoding="utf-8") as f:
+            total += max(sum(1 for _ in csv.reader(f)) - 1, 0)
+    return total
+
+
+def prepare_workdir(workdir):
+    """Links the read-only inputs the app opens by relative path."""
+    for name in ("config", "assets"):
+        target = os.path.join(workdir, name)
+        if os.path.exists(target):
+            continue
+        try:
+            os.symlink(os.path.join(REPO_DIR, name), target, target_is_directory=True)
+        except (OSError, NotImplementedError):
+            shutil.copytree(os.path.join(REPO_DIR, name), target)
+
+
+def summarise(args, workdir, results, wall_s):
+    from src.storage import STORAGE_BACKEND
+    from src.ledger import LEDGER_DURABILITY
+    from src.writebehind import WRITE_BEHIND_ENABLED
+    from src.prefetch import PREFETCH_ENABLED
+
+    participants = [p for r in results for p in r["participants"]]
+    latencies = np.array([ms for p in participants for ms in p["latencies_ms"]] or [0.0])
+    failed = [p for p in participants if not p["completed"]]
+    reruns = sum(p["reruns"] for p in participants)
+    persisted_rows = count_persisted_rows(workdir)
+    expected_rows = sum(p["expected_ledger_rows"] for p in participants)
+    rss_growth = sum(max(r["rss_peak"] - r["rss_start"], 0) for r in results)
+    live_sessions = sum(r["peak_sessions"] for r in results)
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+
+    return {
+        "timestamp_utc": datetime.now(timezone.utc).isoformat(),
+        "config": {
+            "participants": args.participants,
+            "concurrency": args.concurrency,
+            "processes": args.processes,
+            "seed": args.seed,
+            "storage_backend": STORAGE_BACKEND,
+            "ledger_durability": LEDGER_DURABILITY,
+            "write_behind": WRITE_BEHIND_ENABLED,
+            "prefetch": PREFETCH_ENABLED,
+        },
+        "wall_s": round(wall_s, 2),
+        "participants_completed": len(participants) - len(failed),
+        "participants_failed": len(failed),
+        "error_rate": round(len(failed) / max(len(participants), 1), 4),
+        "errors": sorted({p["error"] for p in failed})[:20],
+        "reruns": reruns,
+        "reruns_per_s": round(reruns / wall_s, 2),
+        "rerun_ms": {
+            "p50": round(float(p50), 2),
+            "p95": round(float(p95), 2),
+            "p99": round(float(p99), 2),
+            "max": round(float(latencies.max()), 2),
+        },
+        "ledger_rows_persisted": persisted_rows,
+        "ledger_rows_expected": expected_rows,
+        "ledger_rows_per_s": round(persisted_rows / wall_s, 2),
+        "memory_per_session_kb": round(rss_growth / max(live_sessions, 1) / 1024, 1),
+        "peak_rss_mb": round(max(r["rss_peak"] for r in results) / 1e6, 1),
+        "write_behind": [r["write_behind"] for r in results],
+        "prefetch": [r["prefetch"] for r in results],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test app.py with scripted participants.")
+    parser.add_argument("--participants", type=int, default=10, help="Total participants to run")
+    parser.add_argument("--concurrency", type=int, default=10, help="Live sessions per worker process")
+    parser.add_argument("--processes", type=int, default=1, help="Worker processes (simulated servers)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=120, help="Per-rerun timeout in seconds")
+    parser.add_argument("--workdir", help="Scratch directory (default: a new temp dir)")
+    parser.add_argument("--keep", action="store_true", help="Keep the scratch directory and its data_out/")
+    parser.add_argument("--out", default="load_test_results.json", help="JSON results file")
+    args = parser.parse_args()
+
+    workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix="step_load_"))
+    os.makedirs(workdir, exist_ok=True)
+    prepare_workdir(workdir)
+    out_path = os.path.abspath(args.out)
+
+    shares = [list(range(i, args.participants, args.processes)) for i in range(args.processes)]
+    print(f"Running {args.participants} participants in {args.processes} process(es), "
+          f"{args.concurrency} live sessions each. Workdir: {workdir}")
+
+    started = time.perf_counter()
+    if args.processes == 1:
+        results = [run_worker(0, shares[0], args.concurrency, args.seed, args.timeout, workdir)]
+    else:
+        ctx = multiprocessing.get_context("spawn")
+        with ctx.Pool(args.processes) as pool:
+            results = pool.starmap(
+                run_worker,
+                [(i, share, args.concurrency, args.seed, args.timeout, workdir) for i, share in enumerate(shares)],
+            )
+    wall_s = time.perf_counter() - started
+
+    os.chdir(REPO_DIR)
+    summary = summarise(args, workdir, results, wall_s)
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=2)
+
+    print(f"Completed {summary['participants_completed']}/{args.participants} "
+          f"(error rate {summary['error_rate']:.1%}) in {summary['wall_s']} s")
+    print(f"Rerun latency ms: p50 {summary['rerun_ms']['p50']}  p95 {summary['rerun_ms']['p95']}  "
+          f"p99 {summary['rerun_ms']['p99']}  max {summary['rerun_ms']['max']}")
+    print(f"Ledger rows: {summary['ledger_rows_persisted']} persisted / {summary['ledger_rows_expected']} expected, "
+          f"{summary['ledger_rows_per_s']} rows/s")
+    print(f"Memory: ~{summary['memory_per_session_kb']} KB per live session, peak RSS {summary['peak_rss_mb']} MB")
+    for metrics in summary["prefetch"]:
+        if metrics:
+            print(f"Prefetch: hit rate {metrics['hit_rate']:.1%} ({metrics['hits']} warm / {metrics['misses']} cold cards), "
+                  f"{metrics['saved_ms_total']:.0f} ms of avatar work moved off reruns "
+                  f"(cold card {metrics['miss_render_ms_mean']:.1f} ms vs warm {metrics['hit_render_ms_mean']:.2f} ms)")
+    for error in summary["errors"]:
+        print(f"  error: {error}")
+    print(f"Results written to {out_path}")
+
+    if not args.keep and not args.workdir:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
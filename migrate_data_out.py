@@ -0,0 +1,104 @@
+"""
+Imports an existing data_out/ folder (files backend) into the SQLite session store.
+
+    python migrate_data_out.py [--source data_out] [--db data_out/step.sqlite3]
+
+Safe to re-run: ledger rows are keyed by (session_id, ledger_row_index) and
+duplicates are skipped, checkpoints are replaced, and session index rows
+already present are not inserted twice.
+"""
+import os
+import re
+import sys
+import csv
+import glob
+import json
+import argparse
+
+sys.path.append(os.getcwd())
+
+from src import checkpoint
+from src.engine import LEDGER_COLUMNS
+from src.storage import SQLiteStore, SESSION_INDEX_COLUMNS, list_ledger_files
+
+CHECKPOINT_RE = re.compile(r"^session_([0-9a-f-]{36})\.json$")
+BATCH_ROWS = 1000
+
+
+def migrate_ledgers(store, source):
+    n_files, n_rows = 0, 0
+    for path in list_ledger_files(source):
+        # Keep the path format the app stored in log_filepath
+        ledger_path = f"data_out/{os.path.basename(path)}"
+        with open(path, newline="", encoding="utf-8") as f:
+            batch = []
+            for row in csv.DictReader(f):
+                batch.append({col: row.get(col) or "" for col in LEDGER_COLUMNS})
+                if len(batch) >= BATCH_ROWS:
+                    store.insert_ledger_rows(ledger_path, batch)
+                    n_rows += len(batch)
+                    batch = []
+            if batch:
+                store.insert_ledger_rows(ledger_path, batch)
+                n_rows += len(batch)
+        n_files += 1
+    return n_files, n_rows
+
+
+def migrate_checkpoints(store, source):
+    n = 0
+    for path in sorted(glob.glob(os.path.join(source, "session_*.json"))):
+        match = CHECKPOINT_RE.match(os.path.basename(path))
+        if not match:
+            continue
+        session_id = match.group(1)
+        # Replays the journal as well, so the snapshot carries the latest state
+        with open(path, "r", encoding="utf-8") as f:
+            payload = json.load(f)
+        jpath = os.path.join(source, f"session_{session_id}.journal")
+        records = checkpoint.read_journal(jpath) if os.path.exists(jpath) else []
+        payload = checkpoint.replay(payload, records)
+        ops, _ = checkpoint.prepare(payload, None)
+        store.persist_checkpoint(session_id, ops)
+        n += 1
+    return n
+
+
+def migrate_session_index(store, source):
+    path = os.path.join(source, "session_index.csv")
+    if not os.path.exists(path):
+        return 0
+    existing = {(r["session_id"], r["completion_code"]) for r in store.session_index_rows()}
+    n = 0
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            if (row.get("session_id"), row.get("completion_code")) in existing:
+                continue
+            store.append_session_index({col: row.get(col) or "" for col in SESSION_INDEX_COLUMNS})
+            n += 1
+    return n
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--source", default="data_out", help="data_out folder to import")
+    parser.add_argument("--db", default=os.path.join("data_out", "step.sqlite3"), help="SQLite database to create or update")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.source):
+        print(f"FAIL: {args.source} not found.")
+        sys.exit(1)
+
+    store = SQLiteStore(LEDGER_COLUMNS, path=args.db)
+    try:
+        n_files, n_rows = migrate_ledgers(store, args.source)
+        print(f"Ledgers: {n_files} files, {n_rows} rows read")
+        print(f"Checkpoints: {migrate_checkpoints(store, args.source)} sessions")
+        print(f"Session index: {migrate_session_index(store, args.source)} new rows")
+    finally:
+        store.close()
+    print(f"Done. Start the app with STEP_STORAGE_BACKEND=sqlite STEP_SQLITE_PATH={args.db}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Replicates complete ledger rows (every record type) from this server's session
+store to an object store, as gzip-compressed CSV batches.
+
+    python replicate.py --target dir:replica --once
+    python replicate.py --target s3://step-study/ledger          (follows until Ctrl+C)
+    python replicate.py --target dir:replica --status
+
+This is the out-of-process alternative to setting STEP_REPLICATION_TARGET for
+the app; run one or the other for a given target, not both. The cursor is kept
+in data_out/replication_target.json, so a restarted run resumes where the last
+one stopped.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from src import engine, replication
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replicate ledger rows to an object store.")
+    parser.add_argument("--target", default=replication.REPLICATION_TARGET,
+                        help='"dir:<path>" or "s3://<bucket>/<prefix>" (default: STEP_REPLICATION_TARGET)')
+    parser.add_argument("--once", action="store_true", help="Replicate what is there now, then exit")
+    parser.add_argument("--status", action="store_true", help="Print the cursor's position and exit")
+    parser.add_argument("--interval", type=float, default=replication.REPLICATION_INTERVAL_SECONDS,
+                        help="Seconds between passes when following")
+    args = parser.parse_args()
+    if not args.target:
+        parser.error("--target is required (or set STEP_REPLICATION_TARGET)")
+
+    source = replication.create_source(engine.LEDGER_COLUMNS)
+    sink = replication.create_target_sink(args.target, engine.LEDGER_COLUMNS)
+    replicator = replication.Replicator("target", source, sink, interval=args.interval)
+
+    if args.status:
+        updated_at = None
+        if os.path.exists(replicator.state_path):
+            with open(replicator.state_path, "r", encoding="utf-8") as f:
+                updated_at = json.load(f).get("updated_at")
+        metrics = replicator.metrics()
+        print(json.dumps({"target": args.target, "pending": metrics["pending"],
+                          "pending_unit": metrics["pending_unit"], "cursor_updated_at": updated_at}, indent=2))
+        return
+
+    started = time.perf_counter()
+    if args.once:
+        replicator.run_once()
+    else:
+        print(f"Replicating to {args.target} every {args.interval:g}s (Ctrl+C to stop)")
+        replicator.start()
+        try:
+            while True:
+                time.sleep(args.interval)
+                print(json.dumps(replicator.metrics()))
+        except KeyboardInterrupt:
+            pass
+        replicator.stop()
+
+    metrics = replicator.metrics()
+    print(f"{metrics['rows_replicated']} rows in {metrics['batches']} batches "
+          f"in {time.perf_counter() - started:.2f}s; compression {metrics['compression_ratio'] or '-'}x; "
+          f"{metrics['pending']} {metrics['pending_unit']} pending")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Re-scores every recorded encounter in data_out/ against a content pack, for
+when consensus references (Ref_SMART, Ref_Standard_TST), LSI requirements or
+protocol orders are revised after data collection.
+
+    python rescore.py --pack config/study_content_pack.xlsx
+    python rescore.py --pack revised_pack.xlsx --out rescored.csv --changes changes.csv
+
+Reads the event rows of every ledger CSV, recomputes the encounter metrics and
+decision grades in bulk (src/rescoring.py) and writes one row per encounter.
+The ledgers themselves are left untouched.
+"""
+import os
+import sys
+import time
+import argparse
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from src import utils, rescoring
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-score recorded encounters against a content pack.")
+    parser.add_argument("--pack", default="config/study_content_pack.xlsx", help="Content pack (.xlsx)")
+    parser.add_argument("--ledgers", default="data_out", help="Directory holding the ledger CSVs")
+    parser.add_argument("--out", default="rescored_encounters.csv", help="Re-scored encounters (CSV)")
+    parser.add_argument("--changes", help="Also write each value that differs from the recorded one (CSV)")
+    args = parser.parse_args()
+
+    sheets = utils.prepare_content_pack(utils.load_content_pack(args.pack))
+    started = time.perf_counter()
+    ledger = rescoring.load_ledgers(args.ledgers)
+    loaded = time.perf_counter()
+    events = ledger[ledger["record_type"] == "event"]
+    encounters, _ = rescoring.rescore(events, sheets)
+    scored = time.perf_counter()
+    changes = rescoring.compare_with_recorded(encounters, ledger)
+
+    encounters.to_csv(args.out, index=False)
+    if args.changes:
+        changes.to_csv(args.changes, index=False)
+
+    print(f"{len(encounters)} encounters from {len(events)} event rows "
+          f"(read {loaded - started:.2f}s, scored {scored - loaded:.2f}s) -> {args.out}")
+    if changes.empty:
+        print("No values differ from the recorded encounter rows.")
+        return
+    print("Values that differ from the recorded encounter rows:")
+    for column, count in changes.groupby("column").size().items():
+        print(f"  {column:<24} {count}")
+    moved = changes[changes["column"] == "Error_Class"]
+    if not moved.empty:
+        print("Error_Class moves (recorded -> re-scored):")
+        for (before, after), count in moved.groupby(["recorded", "rescored"]).size().items():
+            print(f"  {before or '(blank)':>14} -> {after or '(blank)':<14} {count}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,453 @@
+import os
+import json
+import sqlite3
+import threading
+from datetime import datetime
+from urllib.parse import quote
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from src.engine import LEDGER_COLUMNS, SCHEMA_VERSION
+from src.storage import list_ledger_files, _quote
+
+AGGREGATE_DIR = "data_aggregate"
+# Ledgers are read in blocks of this many bytes (CSV) or rows (SQLite)
+AGGREGATE_BLOCK_BYTES = 8 * 1024 * 1024
+AGGREGATE_CHUNK_ROWS = 50_000
+PARTITION_COLUMNS = ["content_pack_hash", "tool_id"]
+# Hive's name for a blank partition value; Parquet readers turn it back into a null
+BLANK_PARTITION = "__HIVE_DEFAULT_PARTITION__"
+MANIFEST_NAME = "_manifest.json"
+# Rows per Parquet row group, and per part file (each part is committed to the manifest as it closes)
+AGGREGATE_ROW_GROUP_ROWS = 50_000
+AGGREGATE_PART_ROWS = 250_000
+# Values stay the strings the ledger holds; the partition columns are the directory names.
+# source_ledger names the ledger each row came from.
+DATA_COLUMNS = [c for c in LEDGER_COLUMNS if c not in PARTITION_COLUMNS] + ["source_ledger"]
+PARQUET_SCHEMA = pa.schema([(c, pa.string()) for c in DATA_COLUMNS])
+PARTITIONING = ds.partitioning(pa.schema([(c, pa.string()) for c in PARTITION_COLUMNS]), flavor="hive")
+
+
+def _version(value):
+    try:
+        return tuple(int(part) for part in str(value).split("."))
+    except ValueError:
+        return None
+
+
+def _atomic_write(path, data):
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _complete_size(path):
+    """Bytes up to and including the file's last newline: anything after it is still being written."""
+    with open(path, "rb") as f:
+        end = f.seek(0, os.SEEK_END)
+        while end > 0:
+            start = max(0, end - 65536)
+            f.seek(start)
+            newline = f.read(end - start).rfind(b"\n")
+            if newline >= 0:
+                return start + newline + 1
+            end = start
+    return 0
+
+
+# --- Sources: ledgers as units, each re-read whole when it changes ---
+
+class FileLedgers:
+    """The per-session ledger CSVs in a directory; a file has changed when its size or mtime has."""
+
+    def __init__(self, directory="data_out", block_bytes=AGGREGATE_BLOCK_BYTES):
+        self.directory = directory
+        self.block_bytes = block_bytes
+        self.name = f"files:{os.path.abspath(directory)}"
+
+    def units(self):
+        """{unit name: fingerprint}"""
+        units = {}
+        for path in list_ledger_files(self.directory):
+            stat = os.stat(path)
+            units[os.path.basename(path)] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+        return units
+
+    def batches(self, name, rejected):
+        """
+        Arrow record batches of the ledger's rows as written, streamed a block at
+        a time. Rows with the wrong number of fields, or not yet ended by a
+        newline, are counted in rejected instead.
+        """
+        path = os.path.join(self.directory, name)
+        size = _complete_size(path)
+        if os.path.getsize(path) > size:
+            rejected["incomplete"] = rejected.get("incomplete", 0) + 1
+        if size == 0:
+            return
+
+        def malformed(row):
+            rejected["malformed"] = rejected.get("malformed", 0) + 1
+            return "skip"
+
+        with pa.memory_map(path) as source:
+            reader = pa_csv.open_csv(
+                pa.BufferReader(source.read_buffer(size)),
+                read_options=pa_csv.ReadOptions(block_size=self.block_bytes),
+                parse_options=pa_csv.ParseOptions(newlines_in_values=True, invalid_row_handler=malformed),
+                convert_options=pa_csv.ConvertOptions(
+                    column_types={c: pa.string() for c in LEDGER_COLUMNS}, null_values=[],
+                    strings_can_be_null=False, quoted_strings_can_be_null=False),
+            )
+            for batch in reader:
+                yield batch
+
+
+class SQLiteLedgers:
+    """The SQLite store's ledger table, one unit per ledger_path; a unit has changed when rows were added."""
+
+    def __init__(self, path, chunk_rows=AGGREGATE_CHUNK_ROWS):
+        self.path = path
+        self.chunk_rows = chunk_rows
+        self.name = f"sqlite:{os.path.abspath(path)}"
+        self._conn = None
+        self._ledger_paths = {}
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, timeout=30)
+        return self._conn
+
+    def units(self):
+        if not os.path.exists(self.path):
+            return {}
+        rows = self._connection().execute(
+            "SELECT ledger_path, COUNT(*), MAX(row_id) FROM ledger GROUP BY ledger_path"
+        ).fetchall()
+        self._ledger_paths = {os.path.basename(path): path for path, _, _ in rows}
+        return {os.path.basename(path): {"rows": count, "max_row_id": last} for path, count, last in rows}
+
+    def batches(self, name, rejected):
+        conn = self._connection()
+        existing = {row[1] for row in conn.execute("PRAGMA table_info(ledger)")}
+        columns = [c for c in LEDGER_COLUMNS if c in existing]
+        cursor = conn.execute(
+            f"SELECT {', '.join(_quote(c) for c in columns)} FROM ledger WHERE ledger_path = ? ORDER BY row_id",
+            (self._ledger_paths[name],),
+        )
+        while True:
+            rows = cursor.fetchmany(self.chunk_rows)
+            if not rows:
+                break
+            # NULLs are columns added after the row was written
+            yield pa.RecordBatch.from_arrays(
+                [pa.array(["" if v is None else str(v) for v in values], pa.string()) for values in zip(*rows)],
+                names=columns,
+            )
+
+
+def create_source(source="files", directory="data_out", db_path=None):
+    """Ledger source for --source: "files" (CSV ledgers in directory) or "sqlite" (the SQLite store)."""
+    if source == "sqlite":
+        from src import storage
+
+        return SQLiteLedgers(db_path or storage.SQLITE_PATH)
+    return FileLedgers(directory)
+
+
+# --- Validation ---
+
+def validate_batch(batch, rejected):
+    """
+    The batch's valid rows as a table with every LEDGER_COLUMNS column; rejected
+    rows are counted by reason. Columns added to the ledger after a file was
+    started are blank. A column the app never wrote raises ValueError, which
+    rejects the whole ledger.
+    """
+    unknown = [c for c in batch.schema.names if c not in LEDGER_COLUMNS]
+    if unknown:
+        raise ValueError(f"columns not in LEDGER_COLUMNS: {', '.join(unknown)}")
+    blank = pa.array([""] * batch.num_rows, pa.string())
+    table = pa.table([batch.column(c) if c in batch.schema.names else blank for c in LEDGER_COLUMNS],
+                     names=LEDGER_COLUMNS)
+
+    no_key = pc.or_(pc.equal(table["session_id"], ""),
+                    pc.invert(pc.match_substring_regex(table["ledger_row_index"], r"^\d+$")))
+    current = _version(SCHEMA_VERSION)
+    supported = [v for v in pc.unique(table["schema_version"]).to_pylist()
+                 if _version(v) is not None and _version(v) <= current]
+    bad_version = pc.invert(pc.is_in(table["schema_version"], value_set=pa.array(supported, pa.string())))
+
+    remaining = np.ones(table.num_rows, dtype=bool)
+    for reason, mask in [("no_key", no_key), ("schema_version", bad_version)]:
+        mask = mask.to_numpy(zero_copy_only=False)
+        hits = remaining & mask
+        if hits.any():
+            rejected[reason] = rejected.get(reason, 0) + int(hits.sum())
+        remaining &= ~mask
+    return table.filter(pa.array(remaining))
+
+
+def partition_path(content_pack_hash, tool_id):
+    """Hive-style partition directory for a row, relative to the dataset root."""
+    return os.path.join(f"content_pack_hash={quote(content_pack_hash or BLANK_PARTITION, safe='')}",
+                        f"tool_id={quote(tool_id or BLANK_PARTITION, safe='')}")
+
+
+# --- Aggregator ---
+
+class Aggregator:
+    """
+    Streams ledgers into one Parquet dataset partitioned by content_pack_hash and
+    tool_id. Rows of many ledgers share each part file, in large row groups. The
+    manifest is the dataset's source of truth: it records each ledger's
+    fingerprint and the parts holding its rows, so a later run reads only new or
+    changed ledgers, and rewrites only the parts that held rows of changed or
+    deleted ones. Rows are deduplicated on (session_id, ledger_row_index),
+    across ledgers too.
+    """
+
+    def __init__(self, source, out_dir=AGGREGATE_DIR, row_group_rows=AGGREGATE_ROW_GROUP_ROWS,
+                 part_rows=AGGREGATE_PART_ROWS):
+        self.source = source
+        self.out_dir = out_dir
+        self.row_group_rows = row_group_rows
+        self.part_rows = part_rows
+        self.manifest_path = os.path.join(out_dir, MANIFEST_NAME)
+        self.manifest = {}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                self.manifest = json.load(f)
+        self.units = self.manifest.get("units", {})
+        # session_id -> ledgers with rows of it (a session normally has one)
+        self.session_units = {}
+        for name, entry in self.units.items():
+            for session_id in entry["sessions"]:
+                self.session_units.setdefault(session_id, set()).add(name)
+
+        # Parts being written: rows in them are not in the manifest until _commit()
+        self._run_id = datetime.now().strftime("%Y%m%dT%H%M%S%f")
+        self._part_no = 0
+        self._open = {}
+        self._open_rows = 0
+        self._uncommitted = set()
+        self._open_keys = set()
+
+        # Built from another source or for other ledger columns: start over
+        if self.manifest and (self.manifest.get("source") != source.name
+                              or self.manifest.get("columns") != DATA_COLUMNS):
+            self.reset()
+
+    def save_manifest(self):
+        os.makedirs(self.out_dir, exist_ok=True)
+        manifest = {"source": self.source.name, "columns": DATA_COLUMNS, "schema_version": SCHEMA_VERSION,
+                    "updated_at": datetime.now().isoformat(), "units": self.units}
+        _atomic_write(self.manifest_path, json.dumps(manifest, indent=1).encode("utf-8"))
+
+    def _path(self, part):
+        return os.path.join(self.out_dir, part)
+
+    def _tmp_path(self, part):
+        # A leading "." keeps unfinished files out of dataset reads
+        return os.path.join(self.out_dir, os.path.dirname(part), f".{os.path.basename(part)}.tmp")
+
+    def _files(self):
+        """Parquet files under the dataset directory, finished or not, relative to it."""
+        for dirpath, _, files in os.walk(self.out_dir):
+            for name in files:
+                if name.endswith(".parquet") or name.endswith(".parquet.tmp"):
+                    yield os.path.relpath(os.path.join(dirpath, name), self.out_dir)
+
+    def reset(self):
+        """Forgets every ledger and deletes the dataset's files."""
+        self.units, self.session_units = {}, {}
+        self.save_manifest()
+        for part in list(self._files()):
+            os.remove(self._path(part))
+
+    def _recover(self):
+        """
+        Makes the files agree with the manifest after an interrupted run: files it
+        does not list are deleted. Returns the ledgers whose parts are missing.
+        """
+        listed = {part for entry in self.units.values() for part in entry["parts"]}
+        for part in list(self._files()):
+            if part not in listed:
+                os.remove(self._path(part))
+        return {name for name, entry in self.units.items()
+                if any(not os.path.exists(self._path(part)) for part in entry["parts"])}
+
+    def _forget(self, names):
+        """Rewrites each part holding rows of these ledgers without them, then drops them from the manifest."""
+        if not names:
+            return
+        doomed = pa.array(sorted(names), pa.string())
+        for part in sorted({part for name in names for part in self.units[name]["parts"]}):
+            if not os.path.exists(self._path(part)):
+                continue
+            writer = None
+            parquet = pq.ParquetFile(self._path(part))
+            for batch in parquet.iter_batches(batch_size=self.row_group_rows):
+                batch = batch.filter(pc.invert(pc.is_in(batch.column("source_ledger"), value_set=doomed)))
+                if batch.num_rows:
+                    if writer is None:
+                        writer = pq.ParquetWriter(self._tmp_path(part), PARQUET_SCHEMA, compression="zstd")
+                    writer.write_batch(batch)
+            parquet.close()
+            if writer is None:
+                os.remove(self._path(part))
+            else:
+                writer.close()
+                os.replace(self._tmp_path(part), self._path(part))
+        for name in names:
+            for session_id in self.units.pop(name)["sessions"]:
+                self.session_units[session_id].discard(name)
+        self.save_manifest()
+
+    def _committed_keys(self, session_id, name):
+        """Keys of session_id's rows in committed parts, from ledgers other than name."""
+        keys = set()
+        for other in self.session_units.get(session_id, ()):
+            if other == name or other in self._uncommitted:
+                continue
+            for part in self.units[other]["parts"]:
+                table = pq.read_table(self._path(part), columns=["ledger_row_index"],
+                                      filters=[("session_id", "=", session_id), ("source_ledger", "=", other)])
+                keys.update(f"{session_id}\x1f{i}" for i in table.column("ledger_row_index").to_pylist())
+        return keys
+
+    def _write(self, partition, tables):
+        """Queues a ledger's rows for partition's open part; returns the part."""
+        state = self._open.get(partition)
+        if state is None:
+            part = os.path.join(partition, f"part-{self._run_id}-{self._part_no:04d}.parquet")
+            os.makedirs(os.path.dirname(self._tmp_path(part)), exist_ok=True)
+            state = self._open[partition] = {
+                "part": part, "pending": [], "rows": 0,
+                "writer": pq.ParquetWriter(self._tmp_path(part), PARQUET_SCHEMA, compression="zstd"),
+            }
+        state["pending"].extend(tables)
+        state["rows"] += sum(t.num_rows for t in tables)
+        if state["rows"] >= self.row_group_rows:
+            self._flush(state)
+        return state["part"]
+
+    def _flush(self, state):
+        if state["pending"]:
+            state["writer"].write_table(pa.concat_tables(state["pending"]), row_group_size=self.row_group_rows)
+        state["pending"], state["rows"] = [], 0
+
+    def _commit(self):
+        """Closes the open parts and records them (with their ledgers) in the manifest."""
+        for state in self._open.values():
+            self._flush(state)
+            state["writer"].close()
+        # Saved first: if the renames do not happen, the ledgers' parts are missing and _recover reads them again
+        self.save_manifest()
+        for state in self._open.values():
+            os.replace(self._tmp_path(state["part"]), self._path(state["part"]))
+        self._open, self._open_rows = {}, 0
+        self._uncommitted, self._open_keys = set(), set()
+        self._part_no += 1
+
+    def _process(self, name, fingerprint):
+        entry = {"fingerprint": fingerprint, "parts": [], "sessions": [], "rows_read": 0, "rows": 0,
+                 "duplicates": 0, "rejected": {}, "error": ""}
+        tables = {}
+        sessions = set()
+        keys_here = set()
+        elsewhere = set()
+        try:
+            for batch in self.source.batches(name, entry["rejected"]):
+                entry["rows_read"] += batch.num_rows
+                table = validate_batch(batch, entry["rejected"])
+
+                for session_id in pc.unique(table["session_id"]).to_pylist():
+                    if session_id not in sessions:
+                        sessions.add(session_id)
+                        elsewhere |= self._committed_keys(session_id, name)
+                keys = pc.binary_join_element_wise(table["session_id"], table["ledger_row_index"], "\x1f")
+                keys = keys.to_numpy(zero_copy_only=False)
+                # First occurrence of each key, unless an earlier block or ledger had it
+                keep = np.zeros(len(keys), dtype=bool)
+                keep[np.unique(keys, return_index=True)[1]] = True
+                keep &= np.fromiter((k not in keys_here and k not in self._open_keys and k not in elsewhere
+                                     for k in keys), dtype=bool, count=len(keys))
+                keys_here.update(keys[keep])
+                entry["duplicates"] += int((~keep).sum())
+                table = table.filter(pa.array(keep))
+                table = table.append_column("source_ledger", pa.array([name] * table.num_rows, pa.string()))
+                entry["rows"] += table.num_rows
+
+                for group in table.group_by(PARTITION_COLUMNS).aggregate([]).to_pylist():
+                    rows = table.filter(pc.and_(pc.equal(table["content_pack_hash"], group["content_pack_hash"]),
+                                                pc.equal(table["tool_id"], group["tool_id"])))
+                    partition = partition_path(group["content_pack_hash"], group["tool_id"])
+                    tables.setdefault(partition, []).append(rows.select(DATA_COLUMNS))
+        except (ValueError, pa.ArrowInvalid) as e:
+            # Nothing of a rejected ledger is written
+            entry.update(error=str(e), rows=0, duplicates=0)
+            tables, sessions, keys_here = {}, set(), set()
+
+        entry["parts"] = sorted(self._write(partition, parts) for partition, parts in tables.items())
+        entry["sessions"] = sorted(sessions)
+        for session_id in sessions:
+            self.session_units.setdefault(session_id, set()).add(name)
+        self.units[name] = entry
+        self._uncommitted.add(name)
+        self._open_keys |= keys_here
+        self._open_rows += entry["rows"]
+        return entry
+
+    def run(self, full=False):
+        """Brings the dataset up to date with the source. Returns counts for the run."""
+        current = self.source.units()
+        stats = {"ledgers": len(current), "processed": 0, "unchanged": 0, "removed": 0, "failed": 0,
+                 "rows_read": 0, "rows_written": 0, "duplicates": 0, "rejected": {}}
+        if full:
+            self.reset()
+        stale = self._recover()
+        stats["removed"] = sum(name not in current for name in self.units)
+        self._forget(stale | {name for name, entry in self.units.items()
+                              if name not in current or entry["fingerprint"] != current[name]})
+        for name in sorted(current):
+            if name in self.units:
+                stats["unchanged"] += 1
+                continue
+            entry = self._process(name, current[name])
+            stats["processed"] += 1
+            stats["failed"] += bool(entry["error"])
+            stats["rows_read"] += entry["rows_read"]
+            stats["rows_written"] += entry["rows"]
+            stats["duplicates"] += entry["duplicates"]
+            for reason, count in entry["rejected"].items():
+                stats["rejected"][reason] = stats["rejected"].get(reason, 0) + count
+            if self._open_rows >= self.part_rows:
+                self._commit()
+        self._commit()
+        return stats
+
+    def failures(self):
+        """{ledger name: reason} for ledgers rejected whole."""
+        return {name: entry["error"] for name, entry in self.units.items() if entry["error"]}
+
+
+def read_dataset(out_dir=AGGREGATE_DIR, columns=None, filters=None):
+    """
+    The consolidated ledger as a DataFrame of strings. columns and filters (pyarrow
+    filter tuples, e.g. [("tool_id", "=", "SMART")]) are applied while reading.
+    """
+    df = pd.read_parquet(out_dir, engine="pyarrow", columns=columns, filters=filters, partitioning=PARTITIONING)
+    for column in PARTITION_COLUMNS:
+        if column in df.columns:
+            df[column] = df[column].fillna("")
+    return df
@@ -0,0 +1,246 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from src.engine import OUTCOME_LEVELS
+
+GROUP_COLUMNS = ["tool_id", "scenario_type"]
+# Every scenario of a tool together
+ALL_SCENARIOS = "All"
+ENCOUNTER_COLUMNS = ["session_id", "tool_id", "scenario_type", "is_practice", "User_Tag", "Reference_Tag",
+                     "Time_to_Tag", "Error_Class"]
+# Encounter rows hold the outcome; the tags are on the decision event before them
+LEDGER_READ_COLUMNS = ["session_id", "ledger_row_index", "record_type", "event_type", "patient_id", "tool_id",
+                       "scenario_type", "is_practice", "user_tag_normalized", "reference_tag_normalized",
+                       "Time_to_Tag", "Error_Class"]
+
+BOOTSTRAP_REPLICATES = 2000
+CONFIDENCE = 0.95
+# Cells of the replicate-by-unit weight matrix built per chunk of replicates
+BOOTSTRAP_CHUNK_CELLS = 4_000_000
+
+# Rates are over all real encounters, as in the session_end row. Accuracy is
+# agreement with the reference tag (the confusion matrix diagonal); the others
+# count Error_Class values.
+RATE_CLASSES = {
+    "over_rate": ["Minor_Over", "Major_Over"],
+    "under_rate": ["Minor_Under", "Critical_Under"],
+    "critical_under_rate": ["Critical_Under"],
+}
+TIME_QUANTILES = [0.25, 0.5, 0.75, 0.9]
+
+
+def load_encounters(dataset_dir=None, ledgers_dir=None):
+    """
+    The real (non-practice) encounters, from the consolidated dataset
+    (step_aggregate.py) or, with ledgers_dir, straight from the ledger CSVs.
+    """
+    if ledgers_dir is not None:
+        from src.rescoring import load_ledgers
+
+        rows = load_ledgers(ledgers_dir).drop_duplicates(["session_id", "ledger_row_index"])
+        rows = rows[(rows["record_type"] == "encounter") | (rows["event_type"] == "decision")]
+    else:
+        from src.aggregation import AGGREGATE_DIR, read_dataset
+
+        rows = read_dataset(dataset_dir or AGGREGATE_DIR, columns=LEDGER_READ_COLUMNS, filters=[
+            [("record_type", "=", "encounter")], [("event_type", "=", "decision")]])
+    return attach_tags(rows.reindex(columns=LEDGER_READ_COLUMNS, fill_value=""))
+
+
+def attach_tags(rows):
+    """
+    Encounter rows with the User_Tag and Reference_Tag of their decision: the
+    last decision on the same patient before the encounter row in its session.
+    """
+    rows = rows.assign(_row=pd.to_numeric(rows["ledger_row_index"], errors="coerce")).dropna(subset=["_row"])
+    rows = rows.sort_values("_row", kind="stable")
+    encounters = rows[rows["record_type"] == "encounter"].drop(columns=[
+        "user_tag_normalized", "reference_tag_normalized"])
+    decisions = rows.loc[rows["event_type"] == "decision", [
+        "session_id", "patient_id", "_row", "user_tag_normalized", "reference_tag_normalized"]]
+    df = pd.merge_asof(encounters, decisions, on="_row", by=["session_id", "patient_id"], direction="backward")
+    df = df.rename(columns={"user_tag_normalized": "User_Tag", "reference_tag_normalized": "Reference_Tag"})
+    df = df[df["is_practice"].str.strip().str.lower() != "true"]
+    df = df[ENCOUNTER_COLUMNS].fillna({"User_Tag": "", "Reference_Tag": ""}).reset_index(drop=True)
+    df["Time_to_Tag"] = pd.to_numeric(df["Time_to_Tag"], errors="coerce")
+    return df
+
+
+def _tag_order(tags):
+    """Most to least urgent (by OUTCOME_LEVELS), then tags the app does not grade, then blank."""
+    return sorted(set(tags), key=lambda t: (t == "", -OUTCOME_LEVELS.get(t, -1), t))
+
+
+def confusion_matrices(encounters):
+    """Encounter counts per tool and scenario, by reference tag (rows) and user tag (columns), in long form."""
+    frames = []
+    for df in [encounters, encounters.assign(scenario_type=ALL_SCENARIOS)]:
+        counts = df.groupby(GROUP_COLUMNS + ["Reference_Tag", "User_Tag"]).size()
+        frames.append(counts.rename("count").reset_index())
+    return pd.concat(frames, ignore_index=True)
+
+
+def confusion_matrix(matrices, tool_id, scenario_type=ALL_SCENARIOS):
+    """One tool and scenario's matrix as a wide table (reference tag x user tag)."""
+    cells = matrices[(matrices["tool_id"] == tool_id) & (matrices["scenario_type"] == scenario_type)]
+    wide = cells.pivot(index="Reference_Tag", columns="User_Tag", values="count").fillna(0).astype(int)
+    order = _tag_order(list(wide.index) + list(wide.columns))
+    return wide.reindex(index=[t for t in order if t in wide.index], columns=order, fill_value=0)
+
+
+def _unit_sums(encounters, units):
+    """
+    Per resampling unit (an encounter or a session): the numerator and
+    denominator of each ratio statistic, as (names, numerators, denominators).
+    """
+    times = encounters["Time_to_Tag"].to_numpy(dtype=float)
+    timed = ~np.isnan(times)
+    classes = encounters["Error_Class"].to_numpy()
+    reference = encounters["Reference_Tag"].to_numpy()
+    names = ["accuracy"] + list(RATE_CLASSES) + ["mean_time_to_tag_ms"]
+    columns = [((encounters["User_Tag"].to_numpy() == reference) & (reference != "")).astype(float)]
+    columns += [np.isin(classes, values).astype(float) for values in RATE_CLASSES.values()]
+    columns.append(np.where(timed, times, 0.0))
+    counts = [np.ones(len(encounters))] * (len(names) - 1) + [timed.astype(float)]
+    numerators, denominators = np.column_stack(columns), np.column_stack(counts)
+    if units is None:
+        return names, numerators, denominators
+    codes, n_units = units
+    sums = np.zeros((n_units, len(names)))
+    np.add.at(sums, codes, numerators)
+    totals = np.zeros((n_units, len(names)))
+    np.add.at(totals, codes, denominators)
+    return names, sums, totals
+
+
+def bootstrap_ratios(numerators, denominators, replicates=BOOTSTRAP_REPLICATES, rng=None):
+    """
+    Bootstrap replicates of sum(numerators) / sum(denominators) for each column,
+    resampling rows with replacement. Each chunk of replicates draws a matrix of
+    how often each row is picked, so a replicate's sums are one matrix product.
+    Returns a (replicates, columns) array (NaN where a replicate's denominator is 0).
+    """
+    rng = rng or np.random.default_rng()
+    n = len(numerators)
+    out = np.empty((replicates, numerators.shape[1]))
+    chunk = max(1, BOOTSTRAP_CHUNK_CELLS // max(n, 1))
+    for start in range(0, replicates, chunk):
+        b = min(chunk, replicates - start)
+        picks = rng.integers(0, n, size=(b, n))
+        picks += np.arange(b)[:, None] * n
+        weights = np.bincount(picks.ravel(), minlength=b * n).reshape(b, n).astype(float)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            out[start:start + b] = (weights @ numerators) / (weights @ denominators)
+    return out
+
+
+def _interval(boot, confidence):
+    """Percentile bootstrap interval per column (NaN where no replicate has a value)."""
+    tails = [(1 - confidence) / 2 * 100, (1 + confidence) / 2 * 100]
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        return np.nanpercentile(boot, tails, axis=0)
+
+
+def _groups(encounters):
+    """(tool_id, scenario_type, rows) for each tool and scenario, and each tool over all scenarios."""
+    for (tool_id, scenario_type), df in encounters.groupby(GROUP_COLUMNS, sort=True):
+        yield tool_id, scenario_type, df
+    for tool_id, df in encounters.groupby("tool_id", sort=True):
+        yield tool_id, ALL_SCENARIOS, df
+
+
+def accuracy_statistics(encounters, replicates=BOOTSTRAP_REPLICATES, confidence=CONFIDENCE, cluster="encounter",
+                        seed=None):
+    """
+    Per tool and scenario: accuracy, over-, under- and critical under-triage
+    rates and mean Time_to_Tag, each with a percentile bootstrap confidence
+    interval, plus Time_to_Tag quantiles. cluster="session" resamples whole
+    sessions instead of encounters, for intervals that allow for a participant's
+    encounters being alike.
+
+    Returns (statistics, replicates): one row per group, and each group's
+    bootstrap replicates {(tool_id, scenario_type): (names, array)} for
+    comparing groups.
+    """
+    rng = np.random.default_rng(seed)
+    rows, draws = [], {}
+    for tool_id, scenario_type, df in _groups(encounters):
+        units = None
+        if cluster == "session":
+            codes, uniques = pd.factorize(df["session_id"])
+            units = (codes, len(uniques))
+        names, numerators, denominators = _unit_sums(df, units)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            estimates = numerators.sum(axis=0) / denominators.sum(axis=0)
+        boot = bootstrap_ratios(numerators, denominators, replicates, rng)
+        low, high = _interval(boot, confidence)
+        draws[(tool_id, scenario_type)] = (names, boot)
+
+        row = {"tool_id": tool_id, "scenario_type": scenario_type, "encounters": len(df),
+               "sessions": df["session_id"].nunique()}
+        for name, value, lo, hi in zip(names, estimates, low, high):
+            row.update({name: value, f"{name}_ci_low": lo, f"{name}_ci_high": hi})
+        times = df["Time_to_Tag"].dropna()
+        for q in TIME_QUANTILES:
+            row[f"time_to_tag_p{int(q * 100)}_ms"] = times.quantile(q) if len(times) else np.nan
+        rows.append(row)
+    return pd.DataFrame(rows), draws
+
+
+def compare_tools(statistics, draws, confidence=CONFIDENCE):
+    """
+    Differences between each pair of tools in every scenario they share (second
+    tool minus first, in sorted order), with bootstrap confidence intervals from
+    the two groups' independent replicates.
+    """
+    rows = []
+    tools = sorted(statistics["tool_id"].unique())
+    for scenario_type in statistics["scenario_type"].unique():
+        for i, tool_a in enumerate(tools):
+            for tool_b in tools[i + 1:]:
+                if (tool_a, scenario_type) not in draws or (tool_b, scenario_type) not in draws:
+                    continue
+                names, boot_a = draws[(tool_a, scenario_type)]
+                _, boot_b = draws[(tool_b, scenario_type)]
+                a = statistics[(statistics["tool_id"] == tool_a) & (statistics["scenario_type"] == scenario_type)]
+                b = statistics[(statistics["tool_id"] == tool_b) & (statistics["scenario_type"] == scenario_type)]
+                low, high = _interval(boot_b - boot_a, confidence)
+                for name, lo, hi in zip(names, low, high):
+                    rows.append({"scenario_type": scenario_type, "statistic": name, "tool_a": tool_a,
+                                 "tool_b": tool_b, "value_a": a[name].iloc[0], "value_b": b[name].iloc[0],
+                                 "difference": b[name].iloc[0] - a[name].iloc[0], "ci_low": lo, "ci_high": hi})
+    return pd.DataFrame(rows, columns=["scenario_type", "statistic", "tool_a", "tool_b", "value_a", "value_b",
+                                       "difference", "ci_low", "ci_high"])
+
+
+def analyze(encounters, replicates=BOOTSTRAP_REPLICATES, confidence=CONFIDENCE, cluster="encounter", seed=None):
+    """Every table: {"confusion": ..., "statistics": ..., "comparisons": ...}."""
+    statistics, draws = accuracy_statistics(encounters, replicates, confidence, cluster, seed)
+    return {
+        "confusion": confusion_matrices(encounters),
+        "statistics": statistics,
+        "comparisons": compare_tools(statistics, draws, confidence),
+    }
+
+
+def to_json(results, settings=None):
+    """The tables as one JSON-ready dict (NaN as null); confusion matrices nested by tool and scenario."""
+    def records(df):
+        return df.astype(object).where(df.notna(), None).to_dict("records")
+
+    matrices = {}
+    confusion = results["confusion"]
+    for (tool_id, scenario_type), _ in confusion.groupby(GROUP_COLUMNS, sort=True):
+        wide = confusion_matrix(confusion, tool_id, scenario_type)
+        matrices.setdefault(tool_id, {})[scenario_type] = {
+            "reference_tags": list(wide.index), "user_tags": list(wide.columns), "counts": wide.to_numpy().tolist(),
+        }
+    return {
+        "settings": settings or {},
+        "statistics": records(results["statistics"]),
+        "comparisons": records(results["comparisons"]),
+        "confusion_matrices": matrices,
+    }
@@ -0,0 +1,167 @@
+import streamlit as st
+import os
+import io
+import hashlib
+import threading
+from collections import OrderedDict
+from PIL import Image
+
+# The avatar column is ~240 CSS px wide in the wide layout; variants are 2x for HiDPI screens
+AVATAR_DISPLAY_PX = 480
+WEBP_QUALITY = 82
+JPEG_QUALITY = 85
+
+# Streamlit serves <app dir>/static/ at /app/static/ when server.enableStaticServing is on
+STATIC_AVATAR_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "static", "avatars")
+STATIC_AVATAR_URL = "/app/static/avatars"
+
+# Encoded bytes kept in memory for the media-file fallback, shared by all sessions
+AVATAR_CACHE_MAX_BYTES = 32 * 1024 * 1024
+
+
+def _file_digest(path):
+    sha256_hash = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(65536), b""):
+            sha256_hash.update(block)
+    return sha256_hash.hexdigest()
+
+
+def _has_alpha(image):
+    return image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+
+
+def encode_variant(source_path, fmt):
+    """
+    Resizes an avatar to AVATAR_DISPLAY_PX and encodes it.
+    fmt "webp" is for the static files; "media" picks JPEG (or PNG with alpha),
+    the formats st.image passes through without re-encoding.
+    """
+    with Image.open(source_path) as image:
+        image.load()
+        alpha = _has_alpha(image)
+        image = image.convert("RGBA" if alpha else "RGB")
+        image.thumbnail((AVATAR_DISPLAY_PX, AVATAR_DISPLAY_PX), Image.LANCZOS)
+
+        out = io.BytesIO()
+        if fmt == "webp":
+            image.save(out, format="WEBP", quality=WEBP_QUALITY, method=6)
+        elif alpha:
+            image.save(out, format="PNG", optimize=True)
+        else:
+            image.save(out, format="JPEG", quality=JPEG_QUALITY, optimize=True)
+        return out.getvalue()
+
+
+def variant_filename(source_path, digest):
+    """Content-addressed name, so the URL changes only when the source image does."""
+    stem = os.path.splitext(os.path.basename(source_path))[0]
+    return f"{stem}.{digest[:12]}.{AVATAR_DISPLAY_PX}.webp"
+
+
+def build_static_variant(source_path, digest=None, static_dir=STATIC_AVATAR_DIR):
+    """Writes the WebP variant for source_path (if missing) and removes outdated ones. Returns its path."""
+    digest = digest or _file_digest(source_path)
+    filename = variant_filename(source_path, digest)
+    path = os.path.join(static_dir, filename)
+    if os.path.exists(path):
+        return path
+
+    os.makedirs(static_dir, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(encode_variant(source_path, "webp"))
+    os.replace(tmp_path, path)
+
+    # Variants of an older version of the same image
+    stem = filename.split(".", 1)[0]
+    for name in os.listdir(static_dir):
+        if name != filename and name.split(".", 1)[0] == stem and name.endswith(f".{AVATAR_DISPLAY_PX}.webp"):
+            try:
+                os.remove(os.path.join(static_dir, name))
+            except OSError:
+                pass
+    return path
+
+
+class AvatarCache:
+    """
+    Resolves an avatar path to what st.image should be given: a stable
+    /app/static URL when static serving is on, otherwise display-sized JPEG/PNG
+    bytes from a byte-bounded LRU. Source images are read and resized once per
+    process, not on every rerun.
+    """
+
+    def __init__(self, max_bytes=AVATAR_CACHE_MAX_BYTES, static_serving=False):
+        self.max_bytes = max_bytes
+        self.static_serving = static_serving
+        self._lock = threading.Lock()
+        self._digests = {}
+        self._urls = {}
+        self._bytes = OrderedDict()
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _digest(self, source_path):
+        digest = self._digests.get(source_path)
+        if digest is None:
+            digest = _file_digest(source_path)
+            self._digests[source_path] = digest
+        return digest
+
+    def url(self, source_path):
+        """Static URL for the avatar's WebP variant (built on first use), or None."""
+        if not self.static_serving:
+            return None
+        url = self._urls.get(source_path)
+        if url is None:
+            with self._lock:
+                digest = self._digest(source_path)
+            path = build_static_variant(source_path, digest)
+            url = f"{STATIC_AVATAR_URL}/{os.path.basename(path)}"
+            self._urls[source_path] = url
+        return url
+
+    def get_bytes(self, source_path):
+        """Display-sized encoded bytes for the avatar."""
+        with self._lock:
+            key = (source_path, self._digest(source_path))
+            data = self._bytes.get(key)
+            if data is not None:
+                self._bytes.move_to_end(key)
+                self.hits += 1
+                return data
+            self.misses += 1
+
+        data = encode_variant(source_path, "media")
+        with self._lock:
+            if key not in self._bytes:
+                self._bytes[key] = data
+                self._size += len(data)
+                while self._size > self.max_bytes and len(self._bytes) > 1:
+                    _, evicted = self._bytes.popitem(last=False)
+                    self._size -= len(evicted)
+        return data
+
+    def is_warm(self, source_path):
+        """True when image() would return without reading or resizing the source."""
+        if self.static_serving:
+            return source_path in self._urls
+        with self._lock:
+            digest = self._digests.get(source_path)
+            return digest is not None and (source_path, digest) in self._bytes
+
+    def image(self, source_path):
+        """Argument for st.image: a static URL when available, else cached bytes."""
+        return self.url(source_path) or self.get_bytes(source_path)
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._bytes), "bytes": self._size, "hits": self.hits, "misses": self.misses}
+
+
+@st.cache_resource
+def get_avatar_cache():
+    """Returns the process-wide avatar cache."""
+    return AvatarCache(static_serving=bool(st.get_option("server.enableStaticServing")))
@@ -0,0 +1,168 @@
+import os
+import json
+import uuid
+from src.ledger import LEDGER_DURABILITY
+
+# Session fields that only ever grow between resets; the journal stores just the new items
+APPEND_FIELDS = ("encounter_events", "completed_encounters")
+
+# Compact once the journal is as large as the snapshot (amortised O(1) per delta byte)
+COMPACT_MIN_BYTES = 64 * 1024
+
+# Checkpoints follow the ledger's durability mode
+CHECKPOINT_FSYNC = LEDGER_DURABILITY == "group_commit"
+
+
+def snapshot_path(session_id):
+    return os.path.join("data_out", f"session_{session_id}.json")
+
+def journal_path(session_id):
+    return os.path.join("data_out", f"session_{session_id}.journal")
+
+
+def _new_tracker(payload, gen, snapshot_bytes):
+    return {
+        "gen": gen,
+        "seq": 0,
+        "journal_bytes": 0,
+        "snapshot_bytes": snapshot_bytes,
+        "scalars": {
+            k: json.dumps(v, sort_keys=True) for k, v in payload.items() if k not in APPEND_FIELDS
+        },
+        "lists": {
+            k: (len(payload.get(k) or []), (payload.get(k) or [None])[-1]) for k in APPEND_FIELDS
+        },
+    }
+
+
+def _snapshot_op(payload):
+    gen = uuid.uuid4().hex
+    text = json.dumps(dict(payload, checkpoint_gen=gen))
+    return ("snapshot", text), _new_tracker(payload, gen, len(text))
+
+
+def prepare(payload, tracker):
+    """
+    Turns a full session payload into the writes needed to persist it.
+    Returns (ops, tracker). ops is a list of ("snapshot", text) or
+    ("journal", line) tuples to hand to persist(); tracker is the caller's
+    record of what has already been written and must be passed back next time.
+    """
+    if not tracker:
+        op, tracker = _snapshot_op(payload)
+        return [op], tracker
+
+    changed = {}
+    appended = {}
+    scalars = dict(tracker["scalars"])
+    lists = dict(tracker["lists"])
+
+    for k, v in payload.items():
+        if k in APPEND_FIELDS:
+            continue
+        encoded = json.dumps(v, sort_keys=True)
+        if scalars.get(k) != encoded:
+            changed[k] = v
+            scalars[k] = encoded
+
+    for k in APPEND_FIELDS:
+        items = payload.get(k) or []
+        prev_len, prev_last = lists.get(k, (0, None))
+        if len(items) == prev_len and (prev_len == 0 or items[-1] == prev_last):
+            continue
+        # Grown from the same prefix -> append the tail; otherwise the list was reset
+        if len(items) > prev_len and (prev_len == 0 or items[prev_len - 1] == prev_last):
+            appended[k] = items[prev_len:]
+        else:
+            changed[k] = items
+        lists[k] = (len(items), items[-1] if items else None)
+
+    if not changed and not appended:
+        return [], tracker
+
+    seq = tracker["seq"] + 1
+    record = {"gen": tracker["gen"], "seq": seq}
+    if changed:
+        record["set"] = changed
+    if appended:
+        record["append"] = appended
+    line = json.dumps(record) + "\n"
+
+    journal_bytes = tracker["journal_bytes"] + len(line)
+    if journal_bytes >= max(COMPACT_MIN_BYTES, tracker["snapshot_bytes"]):
+        op, tracker = _snapshot_op(payload)
+        return [op], tracker
+
+    tracker = dict(tracker, seq=seq, journal_bytes=journal_bytes, scalars=scalars, lists=lists)
+    return [("journal", line)], tracker
+
+
+def persist(session_id, ops):
+    """Applies prepare() output to disk. Snapshots are written atomically."""
+    if not ops:
+        return
+    os.makedirs("data_out", exist_ok=True)
+    for kind, text in ops:
+        if kind == "snapshot":
+            path = snapshot_path(session_id)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(text)
+                f.flush()
+                if CHECKPOINT_FSYNC:
+                    os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+            # Records from older generations are ignored on replay, so a crash
+            # between the rename and this truncate is harmless
+            with open(journal_path(session_id), "w", encoding="utf-8"):
+                pass
+        else:
+            with open(journal_path(session_id), "a", encoding="utf-8") as f:
+                f.write(text)
+                f.flush()
+                if CHECKPOINT_FSYNC:
+                    os.fsync(f.fileno())
+
+
+def replay(payload, records):
+    """Applies journal records of the snapshot's generation on top of the snapshot."""
+    gen = payload.pop("checkpoint_gen", None)
+    if gen is None:
+        return payload
+    for record in records:
+        if record.get("gen") != gen:
+            continue
+        payload.update(record.get("set", {}))
+        for k, items in record.get("append", {}).items():
+            payload.setdefault(k, []).extend(items)
+    return payload
+
+
+def read_journal(jpath):
+    with open(jpath, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                # Torn final line from a crash mid-append
+                return
+
+
+def load(session_id):
+    """Rebuilds the latest payload from snapshot plus journal, or None."""
+    path = snapshot_path(session_id)
+    if not os.path.exists(path):
+        return None
+
+    with open(path, "r", encoding="utf-8") as f:
+        payload = json.load(f)
+
+    jpath = journal_path(session_id)
+    records = read_journal(jpath) if os.path.exists(jpath) else []
+    return replay(payload, records)
+
+
+def delete(session_id):
+    for path in (snapshot_path(session_id), journal_path(session_id)):
+        if os.path.exists(path):
+            os.remove(path)
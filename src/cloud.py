@@ -1,6 +1,14 @@
 import streamlit as st
 import gspread
 import pandas as pd
+import os
+import time
+import threading
+
+CONTENT_TABS = ["Config", "Tools", "Patients"]
+
+# A sheet's Drive modifiedTime is re-checked at most this often; edits show up within this window
+SHEET_REVISION_CHECK_SECONDS = float(os.environ.get("STEP_SHEETS_REVISION_CHECK_S", "15"))
 
 @st.cache_resource
 def get_gspread_client():
@@ -41,52 +49,143 @@ def get_spreadsheet(sheet_name):
         st.error(f"Could not open sheet '{sheet_name}'. Error: {e}")
         return None
 
-@st.cache_data(ttl=600)
+def records_frame(values):
+    """DataFrame of a tab's values (header row first), as worksheet.get_all_records() would build it."""
+    if not values:
+        return pd.DataFrame([])
+    values = gspread.utils.fill_gaps(values, cols=max(len(row) for row in values))
+    rows = [gspread.utils.numericise_all(row, empty2zero=False, default_blank="") for row in values[1:]]
+    return pd.DataFrame(gspread.utils.to_records(values[0], rows))
+
+def fetch_content_tabs(spreadsheet, sheet_name):
+    """Reads the Config, Tools and Patients tabs in a single values:batchGet request."""
+    try:
+        response = spreadsheet.values_batch_get([f"'{tab}'" for tab in CONTENT_TABS])
+    except gspread.exceptions.APIError as e:
+        # A missing tab fails the whole batch; name it the way the per-tab reads used to
+        try:
+            titles = {worksheet.title for worksheet in spreadsheet.worksheets()}
+        except Exception:
+            titles = set(CONTENT_TABS)
+        missing = [tab for tab in CONTENT_TABS if tab not in titles]
+        if missing:
+            st.error(f"Missing required tab '{missing[0]}' in '{sheet_name}'.")
+        else:
+            st.error(f"Error reading tabs from '{sheet_name}': {e}")
+        return None
+    except Exception as e:
+        st.error(f"Error reading tabs from '{sheet_name}': {e}")
+        return None
+
+    value_ranges = response.get("valueRanges", [])
+    return {tab: records_frame(value_range.get("values", [])) for tab, value_range in zip(CONTENT_TABS, value_ranges)}
+
+class SheetRevisionCache:
+    """
+    Content packs fetched from Google Sheets, keyed by sheet name and tagged with
+    the spreadsheet's Drive modifiedTime. A cached pack is served until a
+    revision check (one small Drive request, at most every check_interval
+    seconds per sheet) shows the sheet has been edited; only then are the tabs
+    downloaded again. Each sheet has its own lock, held across its Drive calls,
+    so concurrent sessions share one fetch without waiting on other sheets.
+    """
+
+    def __init__(self, check_interval=SHEET_REVISION_CHECK_SECONDS):
+        self.check_interval = check_interval
+        # Guards the entries, per-sheet locks and counters only; never held over network I/O
+        self._lock = threading.Lock()
+        self._sheet_locks = {}
+        self._entries = {}
+        self.fetches = 0
+        self.revision_checks = 0
+        self.not_modified = 0
+
+    def _fresh(self, sheet_name):
+        """The cached sheets if checked within the interval, else None."""
+        with self._lock:
+            entry = self._entries.get(sheet_name)
+            if entry and time.monotonic() - entry["checked_at"] < self.check_interval:
+                return entry["sheets"]
+        return None
+
+    def get(self, sheet_name, spreadsheet, fetch_tabs=fetch_content_tabs):
+        """Returns {tab: DataFrame} for sheet_name (a fresh copy per call), or None."""
+        sheets = self._fresh(sheet_name)
+        if sheets is not None:
+            return self._copy(sheets)
+
+        with self._lock:
+            sheet_lock = self._sheet_locks.setdefault(sheet_name, threading.Lock())
+        with sheet_lock:
+            # Another session may have refreshed it while we waited
+            sheets = self._fresh(sheet_name)
+            if sheets is not None:
+                return self._copy(sheets)
+            with self._lock:
+                entry = self._entries.get(sheet_name)
+                self.revision_checks += 1
+            now = time.monotonic()
+
+            modified_time = None
+            try:
+                modified_time = spreadsheet.get_lastUpdateTime()
+            except Exception as e:
+                print(f"Revision check for '{sheet_name}' failed: {e}")
+                if entry:
+                    # Keep serving the last good copy while Drive is unreachable
+                    return self._copy(entry["sheets"])
+
+            if entry and modified_time is not None and modified_time == entry["modified_time"]:
+                with self._lock:
+                    self.not_modified += 1
+                    entry["checked_at"] = now
+                return self._copy(entry["sheets"])
+
+            sheets = fetch_tabs(spreadsheet, sheet_name)
+            if sheets is None:
+                return None
+            with self._lock:
+                self.fetches += 1
+                self._entries[sheet_name] = {"modified_time": modified_time, "sheets": sheets, "checked_at": now}
+            return self._copy(sheets)
+
+    def _copy(self, sheets):
+        # Callers normalise the frames in place
+        return {tab: df.copy() for tab, df in sheets.items()}
+
+    def stats(self):
+        with self._lock:
+            return {
+                "sheets": len(self._entries),
+                "fetches": self.fetches,
+                "revision_checks": self.revision_checks,
+                "not_modified": self.not_modified,
+            }
+
+@st.cache_resource
+def get_sheet_cache():
+    """Returns the process-wide Google Sheets content pack cache."""
+    return SheetRevisionCache()
+
 def fetch_gsheet_data(sheet_name):
-    """Fetches Config, Tools, and Patients tabs from a Google Sheet."""
+    """Fetches Config, Tools, and Patients tabs from a Google Sheet (re-downloaded only when it changes)."""
     spreadsheet = get_spreadsheet(sheet_name)
     if not spreadsheet:
         return None
+    return get_sheet_cache().get(sheet_name, spreadsheet)
 
-    sheets_data = {}
-    required_tabs = ["Config", "Tools", "Patients"]
-    
-    for tab in required_tabs:
-        try:
-            worksheet = spreadsheet.worksheet(tab)
-            data = worksheet.get_all_records()
-            sheets_data[tab] = pd.DataFrame(data)
-        except gspread.exceptions.WorksheetNotFound:
-            st.error(f"Missing required tab '{tab}' in '{sheet_name}'.")
-            return None
-        except Exception as e:
-            st.error(f"Error reading tab '{tab}': {e}")
-            return None
-
-    return sheets_data
-
-def append_triage_log(sheet_name, data_row):
+def open_log_worksheet(sheet_name, title, header):
     """
-    Appends a log row to the 'Triage_Logs' worksheet.
-    data_row should be formatted like: [Timestamp, PatientID, TriageCategory, ClinicianNotes]
+    Returns the worksheet `title`, creating it with `header` if it does not exist.
+    Raises on failure so the outbox can retry.
     """
     spreadsheet = get_spreadsheet(sheet_name)
     if not spreadsheet:
-        return
+        raise RuntimeError(f"Could not open sheet '{sheet_name}'")
 
     try:
-        worksheet = spreadsheet.worksheet("Triage_Logs")
+        return spreadsheet.worksheet(title)
     except gspread.exceptions.WorksheetNotFound:
-        # Create it if it doesn't exist
-        try:
-            worksheet = spreadsheet.add_worksheet(title="Triage_Logs", rows="1000", cols="3")
-            header = ["Timestamp", "PatientID", "TriageCategory"]
-            worksheet.append_row(header)
-        except Exception as create_err:
-            print(f"Failed to create Triage_Logs tab: {create_err}")
-            return
-
-    try:
-        worksheet.append_row(data_row)
-    except Exception as e:
-        print(f"Failed to append log row: {e}")
+        worksheet = spreadsheet.add_worksheet(title=title, rows="1000", cols=str(len(header)))
+        worksheet.append_row(header)
+        return worksheet
@@ -0,0 +1,372 @@
+import os
+import json
+import glob
+import time
+import threading
+from datetime import datetime
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc as ipc
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# Written by the files backend when STEP_LEDGER_COLUMNAR=1 (see storage.FileStore):
+# data_out/columnar/<record_type>/part-*.parquet, one typed table per record type
+COLUMNAR_DIR = os.path.join("data_out", "columnar")
+# At a phase boundary, a record type's queued rows (from every session) are written
+# as one record batch once there are this many, or the oldest has waited this long
+COLUMNAR_BATCH_ROWS = 2000
+COLUMNAR_FLUSH_SECONDS = 30.0
+# A stream is compacted into a Parquet part at this many rows, and at shutdown
+COLUMNAR_ROLL_ROWS = 250_000
+
+# How each ledger column is typed. Anything else is a string.
+INT_COLUMNS = {
+    "t_run_ms", "ledger_row_index", "t_real_ms", "patient_sequence_order", "Time_to_First_Action", "Time_to_Tag",
+    "Time_to_Hemorrhage_Ctrl", "Time_to_Airway_Ctrl", "Dwell_rr", "Dwell_pulse_rad", "Seq_Error_Count",
+    "nasa_mental", "nasa_temporal", "nasa_effort", "nasa_frustration", "nasa_performance", "nasa_physical",
+    "post_understanding", "post_preparedness", "post_tool_effective",
+    "n_encounters_total", "n_practice_encounters", "n_real_encounters", "n_decisions_made",
+    "total_ledger_rows", "total_event_rows", "total_encounter_rows", "total_tlx_rows", "total_post_rows",
+    "server_latency_ms", "t_client_ms",
+}
+# Whole milliseconds unless an action's cost is fractional
+NUMBER_COLUMNS = {"t_sim_ms"}
+FLOAT_COLUMNS = {"mean_time_to_tag_ms", "critical_under_rate"}
+BOOL_COLUMNS = {"is_practice", "Dwell_Measurable", "Seq_Error_Measurable", "LSI_Applicable", "Missed_LSI_Flag"}
+ARROW_TYPES = {"int": pa.int64(), "number": pa.float64(), "float": pa.float64(), "bool": pa.bool_(),
+               "string": pa.string()}
+
+_BASE = ["t_run_ms", "ledger_row_index", "session_id", "completion_code", "record_type", "schema_version",
+         "app_version", "content_pack_hash", "participant_role", "fatigue_status", "prior_triage_training",
+         "clock_source"]
+_PATIENT = ["patient_id", "tool_id", "scenario_type", "is_practice"]
+# The columns each record type fills (see the log_* functions in engine.py)
+RECORD_COLUMNS = {
+    "event": _BASE + _PATIENT + [
+        "event_type", "action_key", "decision_raw", "user_tag_normalized", "reference_tag_normalized",
+        "deviation", "t_real_ms", "t_sim_ms", "server_latency_ms"],
+    "encounter": _BASE + _PATIENT + [
+        "patient_sequence_order", "Time_to_First_Action", "Time_to_Tag", "Time_to_Hemorrhage_Ctrl",
+        "Time_to_Airway_Ctrl", "Dwell_rr", "Dwell_pulse_rad", "Dwell_Measurable", "Seq_Error_Count",
+        "Seq_Error_Measurable", "LSI_Applicable", "Required_LSI", "Missed_LSI_Flag", "Missing_LSI_List",
+        "Error_Class"],
+    "client_timing": _BASE + _PATIENT + ["event_type", "action_key", "patient_sequence_order", "t_client_ms"],
+    "tlx": _BASE + ["tool_id", "scenario_type", "nasa_mental", "nasa_temporal", "nasa_effort",
+                    "nasa_frustration", "nasa_performance", "nasa_physical"],
+    "post": _BASE + ["tool_id", "post_understanding", "post_preparedness", "post_tool_effective"],
+    "session_end": _BASE + [
+        "n_encounters_total", "n_practice_encounters", "n_real_encounters", "n_decisions_made",
+        "mean_time_to_tag_ms", "critical_under_rate", "total_ledger_rows", "total_event_rows",
+        "total_encounter_rows", "total_tlx_rows", "total_post_rows"],
+}
+# Rows of any other record_type keep every column, as strings
+OTHER_RECORD_TYPE = "other"
+# JSON {column: ledger text} for the rare values the typed columns cannot give back
+# exactly, and for values in columns outside the record type's own
+VERBATIM_COLUMN = "_verbatim"
+
+
+def column_kind(column):
+    if column in INT_COLUMNS:
+        return "int"
+    if column in NUMBER_COLUMNS:
+        return "number"
+    if column in FLOAT_COLUMNS:
+        return "float"
+    if column in BOOL_COLUMNS:
+        return "bool"
+    return "string"
+
+
+def format_value(kind, value):
+    """A typed value as the ledger CSV writes it (safe_str of the logged value)."""
+    if value is None:
+        return ""
+    if kind == "number" and float(value).is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def parse_value(kind, text):
+    """(typed value, exact) for ledger text; exact is False if format_value would not give the text back."""
+    if kind == "string":
+        return text, True
+    if text == "":
+        return None, True
+    try:
+        if kind == "int":
+            value = int(text)
+        elif kind == "bool":
+            value = {"True": True, "False": False}[text]
+        else:
+            value = float(text)
+    except (ValueError, KeyError):
+        return None, False
+    return value, format_value(kind, value) == text
+
+
+def record_schema(record_type, fieldnames):
+    """Arrow schema of a record type's table; the ledger's full column list rides along as metadata."""
+    columns = RECORD_COLUMNS.get(record_type, fieldnames)
+    fields = [pa.field(c, pa.string() if record_type not in RECORD_COLUMNS else ARROW_TYPES[column_kind(c)])
+              for c in columns]
+    fields.append(pa.field(VERBATIM_COLUMN, pa.string()))
+    return pa.schema(fields, metadata={"ledger_columns": json.dumps(list(fieldnames))})
+
+
+def record_table(rows, schema):
+    """Ledger rows (dicts of strings) as a typed table."""
+    columns = [f.name for f in schema if f.name != VERBATIM_COLUMN]
+    typed = {f.name: f.type != pa.string() for f in schema}
+    own = set(columns)
+    values = {c: [] for c in columns}
+    verbatim = []
+    for row in rows:
+        extra = {}
+        for c in columns:
+            text = row.get(c, "")
+            value, exact = parse_value(column_kind(c), text) if typed[c] else (text, True)
+            if not exact:
+                extra[c] = text
+            values[c].append(value)
+        for c, text in row.items():
+            if c not in own and text != "":
+                extra[c] = text
+        verbatim.append(json.dumps(extra) if extra else None)
+    return pa.table([pa.array(values[c], schema.field(c).type) for c in columns] + [pa.array(verbatim, pa.string())],
+                    schema=schema)
+
+
+def _try_lock(f):
+    """Takes the exclusive lock on f if no other process holds it."""
+    try:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        return True
+    except OSError:
+        return False
+
+
+def _read_stream(path):
+    """The complete batches of an Arrow IPC stream; a batch cut off mid-write ends it."""
+    batches, schema = [], None
+    try:
+        with pa.OSFile(path) as source:
+            reader = ipc.open_stream(source)
+            schema = reader.schema
+            for batch in reader:
+                batches.append(batch)
+    except (pa.ArrowInvalid, OSError):
+        pass
+    return pa.Table.from_batches(batches, schema=schema) if schema is not None else None
+
+
+def compact_stream(path):
+    """Rewrites a finished stream as a Parquet part (one row group) and removes the stream."""
+    table = _read_stream(path)
+    if table is not None and table.num_rows:
+        target = path[:-len(".arrows")] + ".parquet"
+        pq.write_table(table, f"{target}.tmp", compression="zstd", row_group_size=max(table.num_rows, 1))
+        os.replace(f"{target}.tmp", target)
+    os.remove(path)
+
+
+def compact_orphans(directory=COLUMNAR_DIR):
+    """
+    Compacts the streams of server processes that died without closing them: a
+    stream whose writer is alive holds the lock on its .lock file.
+    """
+    for path in glob.glob(os.path.join(directory, "*", "*.arrows")):
+        with open(f"{path}.lock", "ab") as lock:
+            if not _try_lock(lock):
+                continue
+            compact_stream(path)
+        os.remove(f"{path}.lock")
+
+
+class ColumnarLedger:
+    """
+    A typed, columnar copy of every session ledger this process writes, kept
+    alongside the CSV ledgers: one table per record type, with proper dtypes
+    instead of one wide table of strings. Rows from all sessions are queued per
+    record type and written at phase boundaries (flush) as Arrow record batches,
+    to one Arrow IPC stream per record type and process. A stream is compacted
+    into a Parquet part when it reaches COLUMNAR_ROLL_ROWS and at shutdown; the
+    streams of a process that died are compacted by the next one to start.
+    """
+
+    def __init__(self, fieldnames, directory=COLUMNAR_DIR, batch_rows=COLUMNAR_BATCH_ROWS,
+                 flush_seconds=COLUMNAR_FLUSH_SECONDS, roll_rows=COLUMNAR_ROLL_ROWS):
+        self.fieldnames = list(fieldnames)
+        self.directory = directory
+        self.batch_rows = batch_rows
+        self.flush_seconds = flush_seconds
+        self.roll_rows = roll_rows
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._oldest_pending = {}
+        self._streams = {}
+        self._part_no = 0
+        compact_orphans(directory)
+
+    def append(self, row):
+        record_type = row.get("record_type", "")
+        if record_type not in RECORD_COLUMNS:
+            record_type = OTHER_RECORD_TYPE
+        with self._lock:
+            if not self._pending.get(record_type):
+                self._oldest_pending[record_type] = time.monotonic()
+            self._pending.setdefault(record_type, []).append(row)
+
+    def flush(self, force=False):
+        """Phase boundary: writes each record type's queued rows if there are enough, or they are old enough."""
+        with self._lock:
+            for record_type, rows in self._pending.items():
+                if rows and (force or len(rows) >= self.batch_rows
+                             or time.monotonic() - self._oldest_pending[record_type] >= self.flush_seconds):
+                    self._write_locked(record_type, rows)
+                    self._pending[record_type] = []
+
+    def close_all(self):
+        """Writes everything queued and compacts this process's streams (at shutdown)."""
+        self.flush(force=True)
+        with self._lock:
+            for record_type in list(self._streams):
+                self._roll_locked(record_type)
+
+    def delete_session(self, session_id):
+        """Removes a withdrawn session's rows, queued or written."""
+        with self._lock:
+            for record_type, rows in self._pending.items():
+                self._pending[record_type] = [r for r in rows if r.get("session_id") != session_id]
+            # Written rows are rewritten out of Parquet parts, so this process's streams are compacted first
+            for record_type in list(self._streams):
+                self._roll_locked(record_type)
+            for path in glob.glob(os.path.join(self.directory, "*", "*.parquet")):
+                table = pq.read_table(path)
+                keep = pc.not_equal(table["session_id"], session_id)
+                if pc.all(keep).as_py() is False:
+                    table = table.filter(keep)
+                    if table.num_rows:
+                        pq.write_table(table, f"{path}.tmp", compression="zstd")
+                        os.replace(f"{path}.tmp", path)
+                    else:
+                        os.remove(path)
+
+    @property
+    def pending_rows(self):
+        return sum(len(rows) for rows in self._pending.values())
+
+    def _write_locked(self, record_type, rows):
+        stream = self._streams.get(record_type)
+        if stream is None:
+            directory = os.path.join(self.directory, record_type)
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f"part-{datetime.now():%Y%m%dT%H%M%S}-{os.getpid()}-{self._part_no}.arrows")
+            self._part_no += 1
+            # Held while the stream is open, so compact_orphans in another process leaves it alone
+            lock = open(f"{path}.lock", "ab")
+            _try_lock(lock)
+            schema = record_schema(record_type, self.fieldnames)
+            sink = pa.OSFile(path, "wb")
+            stream = self._streams[record_type] = {"path": path, "lock": lock, "sink": sink, "schema": schema,
+                                                   "writer": ipc.new_stream(sink, schema), "rows": 0}
+        stream["writer"].write_table(record_table(rows, stream["schema"]))
+        stream["sink"].flush()
+        stream["rows"] += len(rows)
+        if stream["rows"] >= self.roll_rows:
+            self._roll_locked(record_type)
+
+    def _roll_locked(self, record_type):
+        stream = self._streams.pop(record_type)
+        stream["writer"].close()
+        stream["sink"].close()
+        compact_stream(stream["path"])
+        stream["lock"].close()
+        os.remove(f"{stream['path']}.lock")
+
+
+# --- Reading ---
+
+def read_record_type(record_type, directory=COLUMNAR_DIR, session_id=None):
+    """A record type's rows (optionally one session's) as an Arrow table, or None if there are none."""
+    tables = []
+    folder = os.path.join(directory, record_type)
+    filters = [("session_id", "=", session_id)] if session_id else None
+    for path in sorted(glob.glob(os.path.join(folder, "*.parquet"))):
+        tables.append(pq.read_table(path, filters=filters))
+    # Streams still being written (or left by a process that died): complete batches only
+    for path in sorted(glob.glob(os.path.join(folder, "*.arrows"))):
+        table = _read_stream(path)
+        if table is not None:
+            tables.append(table.filter(pc.equal(table["session_id"], session_id)) if session_id else table)
+    tables = [t for t in tables if t.num_rows]
+    if not tables:
+        return None
+    # Parts written by other app versions may differ in columns: missing ones are null
+    return pa.concat_tables(tables, promote_options="default")
+
+
+def record_types(directory=COLUMNAR_DIR):
+    return sorted(name for name in os.listdir(directory)
+                  if os.path.isdir(os.path.join(directory, name))) if os.path.isdir(directory) else []
+
+
+def read_columnar(record_type, directory=COLUMNAR_DIR, session_id=None):
+    """A record type's rows as a typed DataFrame (the analyst's view)."""
+    table = read_record_type(record_type, directory, session_id)
+    if table is None:
+        return pd.DataFrame(columns=RECORD_COLUMNS.get(record_type, []))
+    return table.drop_columns([VERBATIM_COLUMN]).to_pandas()
+
+
+def _as_text(column, kind):
+    if kind == "int":
+        return pc.fill_null(pc.cast(column, pa.string()), "").to_pylist()
+    if kind == "bool":
+        return pc.fill_null(pc.if_else(column, "True", "False"), "").to_pylist()
+    if kind == "string":
+        return column.to_pylist()
+    return [format_value(kind, v) for v in column.to_pylist()]
+
+
+def read_wide(directory=COLUMNAR_DIR, session_id=None):
+    """
+    The legacy wide view: a DataFrame of strings with every ledger column, in
+    ledger order per session, equal to what the CSV ledgers hold.
+    """
+    columns, parts = [], []
+    for record_type in record_types(directory):
+        table = read_record_type(record_type, directory, session_id)
+        if table is None:
+            continue
+        for c in json.loads(table.schema.metadata[b"ledger_columns"]):
+            if c not in columns:
+                columns.append(c)
+        typed = record_type in RECORD_COLUMNS
+        part = pd.DataFrame({c: _as_text(table[c], column_kind(c) if typed else "string")
+                             for c in table.column_names if c != VERBATIM_COLUMN}, dtype=str)
+        for i, extra in enumerate(table[VERBATIM_COLUMN].to_pylist()):
+            if extra:
+                for c, text in json.loads(extra).items():
+                    if c not in part.columns:
+                        part[c] = ""
+                    part.at[i, c] = text
+        parts.append(part)
+    if not parts:
+        return pd.DataFrame(columns=columns, dtype=str)
+    wide = pd.concat(parts, ignore_index=True).reindex(columns=columns).fillna("")
+    wide["_order"] = pd.to_numeric(wide["ledger_row_index"], errors="coerce")
+    wide = wide.sort_values(["session_id", "_order"], kind="stable")
+    return wide.drop(columns="_order").reset_index(drop=True)
@@ -1,256 +1,147 @@
 import streamlit as st
 import os
-import pandas as pd
-from PIL import Image
-import time
-from src.engine import log_event, save_session_state, get_investigation_result, log_nasa_tlx, start_new_patient, INCLUDE_TLX_PHYSICAL
-
-def load_image(filename):
-    """Loads an image from assets/img, falling back to default.png."""
-    path = os.path.join("assets/img", filename)
-    if not os.path.exists(path) or not filename:
-        path = "assets/img/default.png"
-    return Image.open(path)
-
-def inject_custom_css():
-    """Injects core CSS for the application, handling basic visual polish."""
-    
-    css_content = """
-        <style>
-        /* ===== Visual Polish ===== */
-
-        /* Rounded Avatars in Header */
-        /* Target the avatar image specific container if possible, or just general images in top block */
-        /* Since we removed the specific ID, we'll assume general styling or target via layout context if needed. */
-        /* For now, let's just make sure ALL images in the app have a slight radius for consistency, or target broadly. */
-        img {
-            border-radius: 8px;
-        }
-
-        /* Common Button Styling for Triage Tools */
-        div[data-testid="column"] button {
-             width: 100%;
-             border-radius: 6px;
-             font-weight: 600;
-        }
-        
-        /* NASA-TLX Slider Styling */
-        div[data-testid="stSlider"] label {
-            font-weight: 600 !important;
-            font-size: 1rem !important;
-        }
-        </style>
+from src import prefetch, timing
+from src.engine import log_event, save_session_state, log_nasa_tlx, start_new_patient, get_pack_index, INCLUDE_TLX_PHYSICAL
+
+# 40 seconds total: 2 rounds of box breathing
+WASHOUT_PHASES = [
+    ("Breathe in...", 5),
+    ("Hold...", 5),
+    ("Breathe out...", 5),
+    ("Hold...", 5),
+    ("Breathe in...", 5),
+    ("Hold...", 5),
+    ("Breathe out...", 5),
+    ("Hold...", 5)
+]
+WASHOUT_MS = sum(seconds for _, seconds in WASHOUT_PHASES) * 1000
+# Slack for the browser's countdown finishing just before the server's clock agrees
+WASHOUT_TOLERANCE_MS = 500
+
+_washout_timer = st.components.v1.declare_component(
+    "step_washout_timer", path=os.path.join(os.path.dirname(os.path.abspath(__file__)), "frontend", "washout_timer")
+)
+
+# Set STEP_FRAGMENTS=0 to rerun the whole script on every reveal and decision (for comparison)
+FRAGMENTS_ENABLED = os.environ.get("STEP_FRAGMENTS", "1") != "0"
+
+_theme = st.components.v1.declare_component(
+    "step_theme", path=os.path.join(os.path.dirname(os.path.abspath(__file__)), "frontend", "theme")
+)
+
+# Outline colour of each triage decision button, by its normalized colour
+DECISION_COLOURS = {
+    "Red": "#e74c3c", "Yellow": "#f1c40f", "Green": "#2ecc71",
+    "Black": "#2c3e50", "White": "#bdc3c7", "Blue": "#3498db", "Orange": "#e67e22",
+    "Silver": "#bdc3c7", "Grey": "#bdc3c7"
+}
+
+def _fragment(func):
+    """st.fragment, unless switched off with STEP_FRAGMENTS=0."""
+    return st.fragment(func) if FRAGMENTS_ENABLED else func
+
+def inject_custom_css(tool_id):
     """
-    
-    st.markdown(css_content, unsafe_allow_html=True)
+    Styles the patient screen: the app-wide polish, the action grid and the
+    tool's decision button outlines. The stylesheet lives in a static component
+    (src/frontend/theme/) that the browser loads once; each rerun only sends
+    the decision colours, keyed by the buttons' widget keys.
+    """
+    decision_colours = {
+        f"decision_{i}": DECISION_COLOURS.get(tool_button.colour, "#cccccc")
+        for i, tool_button in enumerate(get_pack_index().tool_buttons(tool_id))
+    }
+    _theme(decision_colours=decision_colours, key="step_theme", default=None)
 
-def render_patient_info(patient):
+def render_patient_info(model):
     """Renders just the text info for the patient (Name, Scenario, Info)."""
     # 1. Name (Top, Large)
-    st.markdown(f"## {patient.get('Patient_Name', 'Unknown')}")
+    st.markdown(f"## {model.name}")
     
     # 2. Scenario (Bottom) - Removed ID
-    st.markdown(f"**Scenario:** {patient['Scenario']}")
+    st.markdown(f"**Scenario:** {model.scenario}")
     
-    visible_text = patient.get("Visible_Text")
-    if pd.isna(visible_text) or visible_text is None:
-        visible_text = "No visible findings recorded."
-    st.info(visible_text)
+    st.info(model.visible_text)
 
-def render_patient_avatar(patient):
-    """Renders just the patient avatar image."""
-    avatar_file = patient.get("Avatar_File", "default.png")
-    if pd.isna(avatar_file):
-        avatar_file = "default.png"
-    image = load_image(avatar_file)
-    st.image(image, use_container_width=True)
+def render_patient_avatar(model):
+    """Renders just the patient avatar image (pre-resized, cached across sessions)."""
+    st.image(prefetch.avatar_image(model), use_container_width=True)
 
 # render_patient_header was refactored into render_patient_info and render_patient_avatar
 
 
 
-def render_action_buttons(patient, config_df):
-    """Renders the investigation buttons in a 2-column grid with inline findings."""
-    
-    # 1. Component-Specific CSS
-    st.markdown("""
-        <style>
-        /* Tighten vertical spacing */
-        div[data-testid="stVerticalBlock"] {
-            gap: 0.5rem !important;
-        }
-        
-        /* Category Header Base */
-        .category-header {
-            font-weight: 800;
-            font-size: 1.1rem;
-            color: #2c3e50;
-            background-color: #f8f9fa;
-            padding: 8px 12px;
-            border-radius: 6px;
-            margin-top: 1.5rem;
-            margin-bottom: 0.5rem;
-            text-transform: uppercase;
-            letter-spacing: 0.05em;
-            box-shadow: 0 1px 2px rgba(0,0,0,0.05);
-            border-left: 6px solid #ccc; /* Default */
-        }
-        
-        /* Color Accents */
-        .cat-header-A { border-left-color: #3498db !important; background-color: #ebf5fb !important; } /* Blue */
-        .cat-header-B { border-left-color: #00bcd4 !important; background-color: #e0f7fa !important; } /* Cyan */
-        .cat-header-C { border-left-color: #e74c3c !important; background-color: #fdedec !important; } /* Red */
-        .cat-header-D { border-left-color: #e67e22 !important; background-color: #fdf2e9 !important; } /* Orange */
-        .cat-header-E { border-left-color: #f1c40f !important; background-color: #fef9e7 !important; } /* Yellow */
-
-        /* First header in a column shouldn't have huge top margin */
-        div[data-testid="column"] > div > div:first-child .category-header {
-            margin-top: 0rem;
-        }
-
-        /* Button Spacing */
-        div.row-widget.stButton {
-            margin-bottom: 0.2rem !important;
-            padding-bottom: 0.0rem !important;
-        }
-        
-        /* Inline Finding Box */
-        .inline-finding {
-            background-color: #f8f9fa;
-            padding: 8px 12px;
-            border-radius: 4px;
-            border-left: 5px solid #2ecc71; /* Green success */
-            margin-bottom: 0.4rem;
-            font-size: 0.95rem;
-            color: #1f1f1f;
-            line-height: 1.3;
-            box-shadow: 0 1px 2px rgba(0,0,0,0.05);
-            font-weight: 500;
-        }
-        </style>
-    """, unsafe_allow_html=True)
-
-    # Get current tool to filter actions
+@_fragment
+def render_action_buttons(model):
+    """
+    Renders the investigation buttons in a 2-column grid with inline findings.
+    A fragment: a reveal reruns only this grid, not the rest of the page.
+    """
+    # Get current tool; the patient's render model already holds its visible actions
     tool_id = st.session_state.get("tool_id", "SMART")
-    valid_actions = config_df[config_df['Valid_Tools'].str.contains(tool_id, na=False)]
-
-    tst_mapping = {
-        "WALKING": ["walk"],
-        "SEVERE BLEEDING": ["hemorrhage", "hemorrhage_ctrl"],
-        "TALKING": ["talking"],
-        "AIRWAY/BREATHING": ["airway_obs", "airway_man", "recovery_pos"],
-        "PENETRATING INJURY": ["deadly_box"]
-    }
-    
-    smart_mapping = {
-        "WALKING": ["walk"],
-        "INJURED": ["injured"],
-        "BREATHING": ["airway_obs"],
-        "OPEN AIRWAY": ["airway_man"],
-        "RESPIRATORY RATE": ["rr"],
-        "PULSE": ["pulse_rad", "pulse_rate"]
-    }
-
-    mapping = tst_mapping if tool_id == "TST" else smart_mapping
 
     with st.container():
         col1, col2, col3 = st.columns(3, gap="small")
-        headers = list(mapping.keys())
         
-        for i, header_name in enumerate(headers):
+        for i, header_name, visible_actions in model.layout(tool_id):
             if i % 3 == 0:
                 col = col1
             elif i % 3 == 1:
                 col = col2
             else:
                 col = col3
-                
-            action_keys = mapping[header_name]
-            
-            cat_actions = pd.DataFrame()
-            for key in action_keys:
-                match = valid_actions[valid_actions['Action_Key'] == key]
-                if not match.empty:
-                    cat_actions = pd.concat([cat_actions, match])
-            
-            if cat_actions.empty:
-                continue
-
-            visible_buttons = []
-            for _, row in cat_actions.iterrows():
-                key = row['Action_Key']
-                text_col = f"{key}_Text"
-                raw_result = str(patient.get(text_col, ""))
-                
-                if key not in ["airway_man", "hemorrhage_ctrl", "recovery_pos"]:
-                    if "not applicable" in raw_result.lower():
-                        continue
-                visible_buttons.append(row)
-
-            if not visible_buttons:
-                continue
 
             with col:
                 st.markdown(f"<div class='category-header cat-header-{['A','B','C','D','E','A'][i % 6]}'>{header_name}</div>", unsafe_allow_html=True)
-                for _, row in pd.DataFrame(visible_buttons).iterrows():
-                    _render_inline_action(row, patient)
+                for action in visible_actions:
+                    _render_inline_action(action, model)
 
-def _render_inline_action(row, patient):
+def _render_inline_action(action, model):
     """Renders button OR inline text if revealed."""
-    key = row['Action_Key']
-    label = row['Button_Label']
-    cost = row['Cost_ms']
-    
-    # Label cleanup
-    for prefix in ["Airway:", "Breathing:", "Circulation:", "Disability:"]:
-        if label.startswith(prefix):
-            label = label[len(prefix):].strip()
-    label = label.strip()
+    key = action.key
+    label = action.label
     
     is_revealed = key in st.session_state.revealed_actions
     
     if is_revealed:
         # Render Text Result IN PLACE
-        text = get_investigation_result(patient, key)
+        text = model.results[key]
         st.markdown(f"<div class='inline-finding'><strong>{label}:</strong> {text}</div>", unsafe_allow_html=True)
     else:
-        # Render Button
-        if st.button(label, key=f"btn_{key}", use_container_width=True):
-            st.session_state.revealed_actions.add(key)
-            st.session_state.accumulated_cost_ms += cost
-            log_event(event_type="reveal", action_key=key)
-            save_session_state()
-            st.rerun()
-
-def render_triage_tools(tools_df, tool_id):
-    """Renders the triage decision buttons in a compact grid."""
+        # Render Button; the reveal is recorded before the rerun, which then shows the finding
+        st.button(label, key=f"btn_{key}", use_container_width=True, on_click=_reveal, args=(action,))
+
+def _reveal(action):
+    """Button callback: runs first thing in the click's rerun."""
+    timing.mark_rerun()
+    st.session_state.revealed_actions.add(action.key)
+    st.session_state.accumulated_cost_ms += action.cost_ms
+    log_event(event_type="reveal", action_key=action.key)
+    save_session_state()
+
+@_fragment
+def render_triage_tools(tool_id):
+    """
+    Renders the triage decision buttons in a compact grid. A fragment, so a
+    decision is logged without first rerunning the page; the page then
+    reruns once for the next patient.
+    """
+    timing.mark_fragment_rerun()
 
-    # Filter tools by the selected Tool_ID
-    my_tools = tools_df[tools_df["Tool_ID"] == tool_id]
+    # Decision buttons for the selected Tool_ID, from the compiled pack index
+    my_tools = get_pack_index().tool_buttons(tool_id)
 
     # Grid Layout (2 cols)
     cols = st.columns(2, gap="small")
     
-    color_map = {
-        "Red": "#e74c3c", "Yellow": "#f1c40f", "Green": "#2ecc71",
-        "Black": "#2c3e50", "White": "#bdc3c7", "Blue": "#3498db", "Orange": "#e67e22",
-        "Silver": "#bdc3c7", "Grey": "#bdc3c7"
-    }
-
-    button_colors = {}
-
-    for i, (_, row) in enumerate(my_tools.iterrows()):
-        label = row['Button_Label']
-        normalized = row['Colour']
+    for i, tool_button in enumerate(my_tools):
+        label = tool_button.label
+        normalized = tool_button.colour
         
         # Remove emojis, use simple label string
         btn_label = str(label).strip()
-        
-        # Save mapping for javascript injection
-        border_color = color_map.get(normalized, "#cccccc")
-        button_colors[btn_label] = border_color
-        
-        # Alternate columns
+
+        # Alternate columns; inject_custom_css outlines each decision_<i> in its colour
         with cols[i % 2]:
             if st.button(btn_label, key=f"decision_{i}", use_container_width=True):
                 # Log decision
@@ -261,41 +152,6 @@ def render_triage_tools(tools_df, tool_id):
                 save_session_state()
                 st.rerun()
 
-    # Inject JavaScript to cleanly outline these specific buttons
-    js_colors = str(button_colors).replace("'", '"')
-    
-    js_code = f"""
-    <script>
-      const btnColors = {js_colors};
-      const doc = window.parent.document;
-      
-      function styleButtons() {{
-          const buttons = doc.querySelectorAll('button p');
-          buttons.forEach(p => {{
-              const text = p.innerText.trim();
-              if (btnColors[text]) {{
-                  // Apply colored outline to the parent button
-                  const btn = p.closest('button');
-                  if (btn) {{
-                      btn.style.border = '2px solid ' + btnColors[text];
-                      btn.style.transition = 'all 0.2s ease-in-out';
-                      
-                      // Also give a subtle background tint
-                      // btn.style.backgroundColor = btnColors[text] + '11';
-                  }}
-              }}
-          }});
-      }}
-      
-      // Run immediately and on slight delay to catch Streamlit re-renders
-      styleButtons();
-      setTimeout(styleButtons, 50);
-      setTimeout(styleButtons, 200);
-      setTimeout(styleButtons, 500);
-    </script>
-    """
-    st.components.v1.html(js_code, height=0)
-
 def render_washout():
     """Renders a mandatory washout period between scenarios with breathing animation."""
     st.markdown("### 🛑 WASHOUT PERIOD")
@@ -303,6 +159,8 @@ def render_washout():
     st.markdown("<br>", unsafe_allow_html=True)
 
     if not st.session_state.get("washout_logged", False):
+        # Authoritative start: the washout is timed from here on the server's clock
+        st.session_state.washout_start_time = timing.anchor()
         log_event(event_type="washout_start")
         st.session_state.washout_logged = True
         save_session_state()
@@ -345,27 +203,10 @@ def render_washout():
 
     # Only run the animation once per washout
     if not st.session_state.get("washout_animation_done", False):
-        # 40 seconds total: 2 rounds of box breathing
-        phases = [
-            ("Breathe in...", 5),
-            ("Hold...", 5),
-            ("Breathe out...", 5),
-            ("Hold...", 5),
-            ("Breathe in...", 5),
-            ("Hold...", 5),
-            ("Breathe out...", 5),
-            ("Hold...", 5)
-        ]
-        
-        total_time = sum(p[1] for p in phases)
-        current_time = 0
-        progress_bar = st.empty()
-        
-        # Add a skip button container above the progress bar
+        # Add a skip button container above the animation
         skip_col1, skip_col2, skip_col3 = st.columns([1, 1, 1])
         with skip_col2:
-            skip_placeholder = st.empty()
-            if skip_placeholder.button("Skip Washout", type="secondary", use_container_width=True, key="washout_skip_btn"):
+            if st.button("Skip Washout", type="secondary", use_container_width=True, key="washout_skip_btn"):
                 st.session_state.washout_logged = False
                 st.session_state.washout_animation_done = False
                 st.session_state.washout_active = False
@@ -373,27 +214,23 @@ def render_washout():
                 start_new_patient()
                 st.rerun()
 
-        for phase_text, duration in phases:
-            for i in range(duration, 0, -1):
-                placeholder.markdown(f"""
-                <div class="washout-container">
-                    <div class="washout-timer">{i}</div>
-                    <div class="washout-text">{phase_text}</div>
-                </div>
-                """, unsafe_allow_html=True)
-                current_time += 1
-                progress_bar.progress(current_time / total_time)
-                time.sleep(1)
-        
-        # Clear the skip button once done
-        skip_placeholder.empty()
-        
-        log_event(event_type="washout_complete")
-        st.session_state.washout_animation_done = True
-        placeholder.empty()
-        progress_bar.empty()
-        save_session_state()
-        st.rerun()
+        # The breathing animation and countdown run in the browser; this rerun returns at once
+        if not st.session_state.get("washout_start_time"):
+            st.session_state.washout_start_time = timing.anchor()
+        elapsed_ms, _ = timing.elapsed_ms(st.session_state.washout_start_time)
+        washout_id = st.session_state.washout_start_time["wall"]
+        with placeholder:
+            report = _washout_timer(
+                phases=WASHOUT_PHASES, elapsed_ms=elapsed_ms, washout_id=washout_id,
+                key=f"washout_timer_{washout_id}", default=None
+            )
+
+        # The browser only says its countdown ended; the server's clock decides
+        if report and report.get("washout_id") == washout_id and elapsed_ms >= WASHOUT_MS - WASHOUT_TOLERANCE_MS:
+            log_event(event_type="washout_complete")
+            st.session_state.washout_animation_done = True
+            save_session_state()
+            st.rerun()
     else:
         # After animation is done, show the ready button
         placeholder.markdown("""
@@ -411,8 +248,7 @@ def render_washout():
                 
                 # Turn off washout and start next block
                 st.session_state.washout_active = False
-                from datetime import datetime
-                st.session_state.block_start_time = datetime.now()
+                st.session_state.block_start_time = timing.anchor()
                 save_session_state()
                 start_new_patient()
                 st.rerun()
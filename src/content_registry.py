@@ -0,0 +1,88 @@
+import streamlit as st
+import os
+import threading
+from collections import OrderedDict
+from types import MappingProxyType
+from src.pack_index import ContentPackIndex
+
+# Packs held per server process; registering one more drops the least recently used
+CONTENT_PACK_CACHE_SIZE = int(os.environ.get("STEP_CONTENT_PACK_CACHE", "4"))
+
+
+class ContentPack:
+    """
+    One validated content pack, shared read-only by every session using it.
+    Sessions keep only the content hash and their queue of patient IDs; the
+    DataFrames, patient records and compiled index live here once per process.
+    The DataFrames must be treated as read-only (filter/copy, never assign).
+    """
+
+    __slots__ = ("content_hash", "sheets", "patients", "index")
+
+    def __init__(self, content_hash, sheets):
+        records = sheets["Patients"].to_dict("records")
+        object.__setattr__(self, "content_hash", content_hash)
+        object.__setattr__(self, "sheets", MappingProxyType(dict(sheets)))
+        object.__setattr__(self, "patients", MappingProxyType({
+            record["ID"]: MappingProxyType(record) for record in records
+        }))
+        object.__setattr__(self, "index", ContentPackIndex(sheets))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ContentPack is read-only")
+
+    def patient(self, patient_id):
+        """Read-only patient record for patient_id, or None."""
+        return self.patients.get(patient_id)
+
+
+class ContentPackRegistry:
+    """
+    Process-wide map of content hash -> ContentPack, holding at most max_packs.
+    Every lookup marks a pack as used, and registering a new one evicts the
+    least recently used. Live sessions look their pack up on every rerun, so
+    only packs nobody has used lately are dropped (old Mode B uploads, edited
+    Mode C sheets); a session whose pack was dropped loads it again on its
+    next rerun.
+    """
+
+    def __init__(self, max_packs=CONTENT_PACK_CACHE_SIZE):
+        self.max_packs = max(1, max_packs)
+        self._lock = threading.Lock()
+        self._packs = OrderedDict()
+
+    def register(self, content_hash, sheets):
+        """Returns the shared pack for content_hash, compiling sheets only the first time."""
+        with self._lock:
+            pack = self._packs.get(content_hash)
+            if pack is None:
+                pack = ContentPack(content_hash, sheets)
+                self._packs[content_hash] = pack
+            self._packs.move_to_end(content_hash)
+            while len(self._packs) > self.max_packs:
+                self._packs.popitem(last=False)
+            return pack
+
+    def get(self, content_hash):
+        """The registered pack for content_hash, or None."""
+        with self._lock:
+            pack = self._packs.get(content_hash)
+            if pack is not None:
+                self._packs.move_to_end(content_hash)
+            return pack
+
+    def get_or_load(self, content_hash, load):
+        """The pack for content_hash; load() (returning prepared sheets) runs only when it is not registered."""
+        pack = self.get(content_hash)
+        if pack is None:
+            pack = self.register(content_hash, load())
+        return pack
+
+    def __len__(self):
+        return len(self._packs)
+
+
+@st.cache_resource
+def get_registry():
+    """Returns the process-wide content pack registry."""
+    return ContentPackRegistry()
@@ -7,9 +7,11 @@ import random
 import time
 import json
 import csv
+import atexit
+from src import writebehind, checkpoint, storage, content_registry, prefetch, outbox, replication, timing
 
 APP_VERSION = "v1.0.0"
-SCHEMA_VERSION = "2.1"
+SCHEMA_VERSION = "2.2"
 SESSION_STATE_VERSION = 2
 INCLUDE_TLX_PHYSICAL = False
 
@@ -38,7 +40,9 @@ LEDGER_COLUMNS = [
     "n_decisions_made", "mean_time_to_tag_ms", "critical_under_rate",
     # Health Counters
     "total_ledger_rows", "total_event_rows", "total_encounter_rows", 
-    "total_tlx_rows", "total_post_rows"
+    "total_tlx_rows", "total_post_rows",
+    # Timing (schema 2.2): server share of t_real_ms, clock behind the timings, browser-measured time
+    "server_latency_ms", "clock_source", "t_client_ms"
 ]
 
 def safe_str(x):
@@ -48,7 +52,7 @@ def safe_str(x):
     return str(x)
 
 def append_ledger_row(row_data):
-    """Writes a single row to the session's ledger CSV."""
+    """Writes a single row to the session's ledger."""
     if "log_filepath" not in st.session_state or not st.session_state.log_filepath:
         return
         
@@ -81,23 +85,56 @@ def append_ledger_row(row_data):
     if st.session_state.get("completion_code"):
         fresh_row["completion_code"] = safe_str(st.session_state.completion_code)
     
-    filepath = st.session_state.log_filepath
-    header = not os.path.exists(filepath)
-    with open(filepath, "a", newline="", encoding="utf-8") as f:
-        writer = csv.DictWriter(f, fieldnames=LEDGER_COLUMNS)
-        if header:
-            writer.writeheader()
-        writer.writerow(fresh_row)
-        f.flush()
+    # Rows are batched by the session store; see flush_ledger() for phase boundaries
+    writebehind.submit(_io_key(), get_store().append_ledger_row, st.session_state.log_filepath, fresh_row)
 
-def _session_state_path(session_id):
-    return os.path.join("data_out", f"session_{session_id}.json")
+def get_store():
+    """The configured session store (files or SQLite), shared by all sessions."""
+    return storage.get_store(LEDGER_COLUMNS)
 
-def _dt_to_iso(dt):
-    return dt.isoformat() if dt else None
+def _io_key():
+    """Write-behind ordering key: all I/O for one session runs in submission order."""
+    return st.session_state.get("session_id") or st.session_state.get("log_filepath")
 
-def _dt_from_iso(value):
-    return datetime.fromisoformat(value) if value else None
+def flush_ledger():
+    """
+    Flushes the session's buffered ledger rows (called at phase boundaries).
+    Raises WriteBehindError if any of the session's earlier writes failed.
+    """
+    if st.session_state.get("log_filepath"):
+        writebehind.check(_io_key())
+        writebehind.submit(_io_key(), get_store().flush_ledger, st.session_state.log_filepath)
+
+def close_ledger():
+    """Flushes and releases the session's ledger file handle."""
+    if st.session_state.get("log_filepath"):
+        writebehind.submit(_io_key(), get_store().close_ledger, st.session_state.log_filepath)
+
+def delete_ledger():
+    """Removes the session's ledger once its queued writes have landed."""
+    if st.session_state.get("log_filepath"):
+        writebehind.submit(
+            _io_key(), get_store().delete_ledger, st.session_state.log_filepath, st.session_state.session_id
+        )
+        writebehind.sync(_io_key())
+
+def lookup_completion_code(completion_code):
+    """Returns the session index row for a participant's completion code, or None."""
+    return get_store().find_completion_code(completion_code)
+
+def shutdown_io():
+    """
+    Drains background writes, then closes the session store (runs at interpreter
+    exit). Only what this process created is shut down, so scripts that merely
+    import engine start nothing at exit.
+    """
+    writebehind.shutdown()
+    storage.close_stores()
+    # Final replication pass over the now-complete ledgers, then the Sheets rows it queued
+    replication.stop_all()
+    outbox.close_all()
+
+atexit.register(shutdown_io)
 
 def get_investigation_result(patient_row, action_key):
     """
@@ -129,10 +166,44 @@ def get_investigation_result(patient_row, action_key):
     
     return defaults.get(action_key, "No specific abnormality detected.")
 
-def build_patient_map():
-    df_patients = st.session_state.content_pack["Patients"]
-    records = df_patients.to_dict("records")
-    return {record["ID"]: record for record in records}
+def register_content_pack(content_hash, sheets):
+    """Shares a validated content pack process-wide; sessions keep only its hash."""
+    return content_registry.get_registry().register(content_hash, sheets)
+
+def load_content_pack(content_hash, load):
+    """The shared pack for content_hash; load() (the prepared sheets) runs only if it is not registered yet."""
+    return content_registry.get_registry().get_or_load(content_hash, load)
+
+def content_pack_loaded():
+    content_hash = st.session_state.get("content_pack_hash")
+    return content_hash is not None and content_registry.get_registry().get(content_hash) is not None
+
+def get_content_pack():
+    """The session's shared, read-only ContentPack."""
+    pack = content_registry.get_registry().get(st.session_state.get("content_pack_hash"))
+    if pack is None:
+        st.error("The content pack for this session is no longer loaded. Please refresh the page.")
+        st.stop()
+    return pack
+
+def get_pack_index():
+    """Compiled lookups for the session's content pack (shared across sessions)."""
+    return get_content_pack().index
+
+def get_patient(patient_id):
+    """Read-only patient record for patient_id, or None."""
+    return get_content_pack().patient(patient_id)
+
+def get_render_model(patient):
+    """Precompiled PatientRenderModel for a patient record."""
+    return get_pack_index().patient_model(patient["ID"])
+
+def prefetch_next_patient():
+    """Warms the next queued patient's card while the current one is on screen."""
+    next_idx = st.session_state.current_patient_index + 1
+    queue_ids = st.session_state.patient_queue_ids
+    if next_idx < len(queue_ids):
+        prefetch.prefetch(get_pack_index().patient_model(queue_ids[next_idx]))
 
 def save_session_state():
     if "session_id" not in st.session_state:
@@ -142,7 +213,7 @@ def save_session_state():
         "version": SESSION_STATE_VERSION,
         "session_id": st.session_state.session_id,
         "session_timestamp": st.session_state.get("session_timestamp"),
-        "block_start_time": _dt_to_iso(st.session_state.get("block_start_time")),
+        "block_start_time": st.session_state.get("block_start_time"),
         "content_pack_hash": st.session_state.get("content_pack_hash"),
         "app_version": st.session_state.get("app_version"),
         "participant_role": st.session_state.get("participant_role"),
@@ -156,11 +227,11 @@ def save_session_state():
         "onboarding_complete": st.session_state.get("onboarding_complete", False),
         "patient_queue_ids": st.session_state.get("patient_queue_ids", []),
         "current_patient_index": st.session_state.get("current_patient_index", 0),
-        "card_start_time": _dt_to_iso(st.session_state.get("card_start_time")),
+        "card_start_time": st.session_state.get("card_start_time"),
         "revealed_actions": list(st.session_state.get("revealed_actions", set())),
         "accumulated_cost_ms": st.session_state.get("accumulated_cost_ms", 0),
         "washout_active": st.session_state.get("washout_active", False),
-        "washout_start_time": _dt_to_iso(st.session_state.get("washout_start_time")),
+        "washout_start_time": st.session_state.get("washout_start_time"),
         "last_decision": st.session_state.get("last_decision"),
         "pending_triage": st.session_state.get("pending_triage"),
         "pre_practice_active": st.session_state.get("pre_practice_active", False),
@@ -180,44 +251,44 @@ def save_session_state():
         "total_post_rows": st.session_state.get("total_post_rows", 0),
     }
 
-    os.makedirs("data_out", exist_ok=True)
-    path = _session_state_path(st.session_state.session_id)
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(payload, f)
+    # Only the fields that changed since the last checkpoint are journaled; the
+    # encoding happens here so the background write sees this exact snapshot
+    ops, st.session_state.checkpoint_tracker = checkpoint.prepare(
+        payload, st.session_state.get("checkpoint_tracker")
+    )
+    writebehind.submit(st.session_state.session_id, get_store().persist_checkpoint, st.session_state.session_id, ops)
 
 def delete_session_state():
     if "session_id" not in st.session_state:
         return
-    path = _session_state_path(st.session_state.session_id)
-    if os.path.exists(path):
-        os.remove(path)
+    writebehind.sync(st.session_state.session_id)
+    get_store().delete_checkpoint(st.session_state.session_id)
 
-def try_resume_session(content_pack, content_hash):
+def try_resume_session(content_hash):
     params = st.query_params
     session_id = None
     if "sid" in params and params["sid"]:
-        session_id = params["sid"][0]
+        # st.query_params returns the value as a str (not a list as in the old experimental API)
+        session_id = params["sid"]
 
     if not session_id:
         return False
 
-    path = _session_state_path(session_id)
-    if not os.path.exists(path):
+    # A checkpoint for this session may still be queued in this process
+    writebehind.sync(session_id)
+    payload = get_store().load_checkpoint(session_id)
+    if payload is None:
         return False
 
-    with open(path, "r", encoding="utf-8") as f:
-        payload = json.load(f)
-
     if payload.get("content_pack_hash") != content_hash:
         st.warning("Content pack changed since this session started. Starting a new session.")
         return False
 
     st.session_state.session_id = payload.get("session_id", session_id)
     st.session_state.session_timestamp = payload.get("session_timestamp")
-    st.session_state.block_start_time = _dt_from_iso(payload.get("block_start_time"))
+    st.session_state.block_start_time = timing.from_checkpoint(payload.get("block_start_time"))
     st.session_state.content_pack_hash = content_hash
     st.session_state.app_version = payload.get("app_version", APP_VERSION)
-    st.session_state.content_pack = content_pack
 
     st.session_state.participant_role = payload.get("participant_role")
     st.session_state.years_exp = payload.get("years_exp")
@@ -229,23 +300,19 @@ def try_resume_session(content_pack, content_hash):
     st.session_state.tool_id = payload.get("tool_id")
     st.session_state.onboarding_complete = payload.get("onboarding_complete", False)
 
-    st.session_state.patient_map = build_patient_map()
-    st.session_state.patient_queue_ids = payload.get("patient_queue_ids", [])
-    st.session_state.patient_queue = [
-        st.session_state.patient_map[pid]
-        for pid in st.session_state.patient_queue_ids
-        if pid in st.session_state.patient_map
-    ]
-    if len(st.session_state.patient_queue) != len(st.session_state.patient_queue_ids):
+    saved_queue_ids = payload.get("patient_queue_ids", [])
+    patients = get_content_pack().patients
+    st.session_state.patient_queue_ids = [pid for pid in saved_queue_ids if pid in patients]
+    if len(st.session_state.patient_queue_ids) != len(saved_queue_ids):
         st.warning("Some patients from the saved session were missing in the current content pack.")
     st.session_state.current_patient_index = payload.get("current_patient_index", 0)
 
-    st.session_state.card_start_time = _dt_from_iso(payload.get("card_start_time"))
+    st.session_state.card_start_time = timing.from_checkpoint(payload.get("card_start_time"))
     st.session_state.revealed_actions = set(payload.get("revealed_actions", []))
     st.session_state.accumulated_cost_ms = payload.get("accumulated_cost_ms", 0)
 
     st.session_state.washout_active = payload.get("washout_active", False)
-    st.session_state.washout_start_time = _dt_from_iso(payload.get("washout_start_time"))
+    st.session_state.washout_start_time = timing.from_checkpoint(payload.get("washout_start_time"))
     st.session_state.last_decision = payload.get("last_decision")
     st.session_state.pending_triage = payload.get("pending_triage")
     st.session_state.pre_practice_active = payload.get("pre_practice_active", False)
@@ -266,28 +333,32 @@ def try_resume_session(content_pack, content_hash):
     st.session_state.log_filepath = payload.get("log_filepath")
     if not st.session_state.log_filepath:
         timestamp = st.session_state.session_timestamp or datetime.now().strftime("%Y%m%d_%H%M%S")
-        st.session_state.log_filepath = f"data_out/logs_{st.session_state.session_id}_{timestamp}.csv"
+        st.session_state.log_filepath = storage.ledger_filepath(st.session_state.session_id, timestamp)
     return True
 
+def start_replication(content_hash):
+    """Starts ledger replication; in Mode C this pack's rows also go to its Google Sheet."""
+    service = replication.get_replication(LEDGER_COLUMNS)
+    active_sheet = st.session_state.get("active_google_sheet")
+    if st.session_state.get("data_mode") == "Mode C" and active_sheet:
+        service.route_to_sheet(content_hash, active_sheet)
+
 def ensure_query_param():
     if "session_id" in st.session_state:
         st.query_params["sid"] = st.session_state.session_id
 
-def initialize_session(content_pack, content_hash):
+def initialize_session(content_hash):
     """Initializes the session state if not already present."""
     if "session_id" not in st.session_state:
         st.session_state.session_id = str(uuid.uuid4())
         st.session_state.content_pack_hash = content_hash
         st.session_state.app_version = APP_VERSION
-        st.session_state.block_start_time = datetime.now()
-        st.session_state.content_pack = content_pack
-        st.session_state.patient_map = build_patient_map()
+        st.session_state.block_start_time = timing.anchor()
 
         # Onboarding flags
         st.session_state.onboarding_complete = False
 
-        # Patient State
-        st.session_state.patient_queue = []
+        # Patient State (IDs into the shared content pack)
         st.session_state.patient_queue_ids = []
         st.session_state.current_patient_index = 0
 
@@ -317,19 +388,36 @@ def initialize_session(content_pack, content_hash):
         # Ensure data_out directory exists
         os.makedirs("data_out", exist_ok=True)
 
-        st.session_state.log_filepath = f"data_out/session_{st.session_state.session_id}_{timestamp}.csv"
+        st.session_state.log_filepath = storage.ledger_filepath(st.session_state.session_id, timestamp)
         save_session_state()
 
+# Tag -> ordinal level for calculate_deviation and evaluate_outcome_class (see their docstrings)
+DEVIATION_LEVELS = {
+    "Black": 0, "Dead": 0, "White": 0,
+    "Green": 1,
+    "Yellow": 2,
+    "Red": 3,
+    "Blue": 1
+}
+OUTCOME_LEVELS = {
+    "Green": 1, "Yellow": 2, "Red": 3, "P1": 3, "P2": 2, "P3": 1, "Blue": 1, "White": 0
+}
+# Decisions or references involving these tags are not graded for over/under triage
+OUTCOME_NA_TAGS = ["Black", "Dead", "Expectant", "White"]
+
+def gold_standard_column(tool_id):
+    """The Patients column holding the consensus reference for a tool."""
+    if tool_id == "SMART":
+        return "Ref_SMART"
+    elif tool_id == "TST":
+        return "Ref_Standard_TST"
+    return f"Ref_{tool_id}"
+
 def get_gold_standard(patient, tool_id):
     """
     Retrieves the specific consensus reference for the tool.
     """
-    if tool_id == "SMART":
-        col_name = "Ref_SMART"
-    elif tool_id == "TST":
-        col_name = "Ref_Standard_TST"
-    else:
-        col_name = f"Ref_{tool_id}"
+    col_name = gold_standard_column(tool_id)
     
     # 1. Try specific column
     val = patient.get(col_name)
@@ -387,13 +475,7 @@ def calculate_deviation(gold_std, selected):
      Perfect.
     """
     
-    mapping = {
-        "Black": 0, "Dead": 0, "White": 0,
-        "Green": 1, 
-        "Yellow": 2,
-        "Red": 3,
-        "Blue": 1
-    }
+    mapping = DEVIATION_LEVELS
     
     val_gold = mapping.get(gold_std, -100)
     val_sel = mapping.get(selected, -100)
@@ -404,12 +486,10 @@ def calculate_deviation(gold_std, selected):
     return val_sel - val_gold
 
 def evaluate_outcome_class(user_tag, gold_tag):
-    if user_tag in ["Black", "Dead", "Expectant", "White"] or gold_tag in ["Black", "Dead", "Expectant", "White"]:
+    if user_tag in OUTCOME_NA_TAGS or gold_tag in OUTCOME_NA_TAGS:
         return "NA_Black"
     
-    mapping = {
-        "Green": 1, "Yellow": 2, "Red": 3, "P1": 3, "P2": 2, "P3": 1, "Blue": 1, "White": 0
-    }
+    mapping = OUTCOME_LEVELS
     val_user = mapping.get(user_tag, None)
     val_gold = mapping.get(gold_tag, None)
     
@@ -466,20 +546,9 @@ def finalize_encounter_log(patient, tool_id):
     seq_error_measurable = True
     max_order_seen = 0
     
-    order_col = f"{tool_id}_Order"
-    config_df = st.session_state.content_pack.get("Config")
-    
-    if config_df is not None and order_col in config_df.columns:
-        order_map = {}
-        for _, row in config_df.iterrows():
-            key = row.get("Action_Key")
-            order_val = row.get(order_col)
-            if pd.notna(key) and pd.notna(order_val):
-                try:
-                    order_map[key] = int(float(order_val))
-                except (ValueError, TypeError):
-                    pass
-        
+    order_map = get_pack_index().order_map(tool_id)
+    
+    if order_map is not None:
         for e in target_events:
             k = e.get("action_key")
             o = order_map.get(k, 0)
@@ -525,14 +594,11 @@ def finalize_encounter_log(patient, tool_id):
         else:
             missed_lsi_flag = ""
 
-    now = datetime.now()
-    if st.session_state.get("block_start_time"):
-        t_run_ms = int((now - st.session_state.block_start_time).total_seconds() * 1000)
-    else:
-        t_run_ms = 0
+    t_run_ms, clock_source = timing.elapsed_ms(st.session_state.get("block_start_time"))
 
     row = {
         "t_run_ms": t_run_ms,
+        "clock_source": clock_source,
         "session_id": st.session_state.session_id,
         "completion_code": st.session_state.get("completion_code", ""),
         "record_type": "encounter",
@@ -602,16 +668,15 @@ def log_event(event_type, action_key=None, decision_raw=None, decision_normalize
     if patient and tool_id != "NA":
         gold_standard = get_gold_standard(patient, tool_id)
 
-    # Timing
-    now = datetime.now()
+    # Timing (monotonic within a server process)
+    now = timing.anchor()
+    t_run_ms, clock_source = timing.elapsed_ms(st.session_state.get("block_start_time"), now)
     if event_type in {"washout_start", "washout_complete"}:
         t_real_ms = 0
         t_sim_ms = 0
     else:
-        if st.session_state.card_start_time:
-            t_real_ms = int((now - st.session_state.card_start_time).total_seconds() * 1000)
-        else:
-            t_real_ms = 0
+        t_real_ms, card_clock = timing.elapsed_ms(st.session_state.card_start_time, now)
+        clock_source = card_clock or clock_source
         t_sim_ms = t_real_ms + st.session_state.accumulated_cost_ms
 
     # Grading & Metrics
@@ -622,11 +687,6 @@ def log_event(event_type, action_key=None, decision_raw=None, decision_normalize
         dev_val = calculate_deviation(gold_standard, decision_normalized)
         deviation = dev_val if dev_val is not None else "ERR"
 
-    if st.session_state.get("block_start_time"):
-        t_run_ms = int((now - st.session_state.block_start_time).total_seconds() * 1000)
-    else:
-        t_run_ms = 0
-
     row = {
         "t_run_ms": t_run_ms,
         "session_id": st.session_state.session_id,
@@ -652,6 +712,8 @@ def log_event(event_type, action_key=None, decision_raw=None, decision_normalize
         "deviation": deviation, 
         "t_real_ms": t_real_ms,
         "t_sim_ms": t_sim_ms,
+        "server_latency_ms": timing.server_latency_ms(now),
+        "clock_source": clock_source,
     }
 
     if "encounter_events" not in st.session_state:
@@ -667,29 +729,74 @@ def log_event(event_type, action_key=None, decision_raw=None, decision_normalize
     if event_type == "decision" and patient:
         finalize_encounter_log(patient, tool_id)
 
-    # Log to Google Sheets if in Mode C and this is a triage decision
-    if event_type == "decision" and st.session_state.get("data_mode") == "Mode C":
-        active_sheet = st.session_state.get("active_google_sheet")
-        if active_sheet:
-            from src import cloud
-            triage_cat = decision_normalized if decision_normalized else decision_raw
-            cloud.append_triage_log(
-                active_sheet,
-                [now.isoformat(), patient_id, triage_cat]
-            )
+    if event_type == "decision":
+        flush_ledger()
+
+
+def card_key():
+    """Identifies the card on screen for client-side timing: queue position and patient ID."""
+    patient = get_current_patient()
+    if patient is None:
+        return None
+    return f"{st.session_state.current_patient_index}:{patient['ID']}"
+
+def log_client_timing(report):
+    """
+    Logs browser-measured click times for a finished card (see timing.click_timer):
+    one client_timing row per reveal or decision click, matching the card's event rows
+    by patient_sequence_order, action_key and event_type.
+    """
+    if not report or report.get("report") == st.session_state.get("client_timing_report"):
+        return
+    st.session_state.client_timing_report = report.get("report")
+
+    index, _, patient_id = str(report.get("card", "")).partition(":")
+    patient = get_patient(patient_id)
+    # Practice cases are not logged
+    if patient is None or patient.get("Is_Practice") == True or not index.isdigit():
+        return
+
+    t_run_ms, _ = timing.elapsed_ms(st.session_state.get("block_start_time"))
+    for click in report.get("clicks", []):
+        widget_key = str(click.get("key", ""))
+        if widget_key.startswith("btn_"):
+            event_type, action_key = "reveal", widget_key[len("btn_"):]
+        elif widget_key.startswith("decision_"):
+            event_type, action_key = "decision", "triage_decision"
+        else:
+            continue
+        append_ledger_row({
+            "t_run_ms": t_run_ms,
+            "session_id": st.session_state.session_id,
+            "completion_code": st.session_state.get("completion_code", ""),
+            "record_type": "client_timing",
+            "schema_version": SCHEMA_VERSION,
+            "app_version": st.session_state.app_version,
+            "content_pack_hash": st.session_state.content_pack_hash,
+            "participant_role": st.session_state.get("participant_role", "NA"),
+            "fatigue_status": st.session_state.get("fatigue_status", "NA"),
+            "prior_triage_training": st.session_state.get("prior_triage_training", "NA"),
+            "patient_id": patient_id,
+            "tool_id": st.session_state.get("tool_id", "NA"),
+            "scenario_type": patient["Scenario"],
+            "is_practice": patient.get("Is_Practice", False),
+            "event_type": event_type,
+            "action_key": action_key,
+            "patient_sequence_order": int(index) + 1,
+            "t_client_ms": click.get("t_client_ms", ""),
+            "clock_source": "client",
+        })
+    flush_ledger()
 
 def log_nasa_tlx(data):
     """Logs NASA-TLX results to the session ledger."""
     scenario = st.session_state.get('last_finished_scenario', 'Unknown')
     
-    now = datetime.now()
-    if st.session_state.get("block_start_time"):
-        t_run_ms = int((now - st.session_state.block_start_time).total_seconds() * 1000)
-    else:
-        t_run_ms = 0
+    t_run_ms, clock_source = timing.elapsed_ms(st.session_state.get("block_start_time"))
 
     row = {
         "t_run_ms": t_run_ms,
+        "clock_source": clock_source,
         "session_id": st.session_state.session_id,
         "completion_code": st.session_state.get("completion_code", ""),
         "record_type": "tlx",
@@ -705,17 +812,15 @@ def log_nasa_tlx(data):
     }
     
     append_ledger_row(row)
+    flush_ledger()
 
 def log_post_perception(data):
     """Logs post-simulation perception results to the session ledger."""
-    now = datetime.now()
-    if st.session_state.get("block_start_time"):
-        t_run_ms = int((now - st.session_state.block_start_time).total_seconds() * 1000)
-    else:
-        t_run_ms = 0
+    t_run_ms, clock_source = timing.elapsed_ms(st.session_state.get("block_start_time"))
 
     row = {
         "t_run_ms": t_run_ms,
+        "clock_source": clock_source,
         "session_id": st.session_state.session_id,
         "completion_code": st.session_state.get("completion_code", ""),
         "record_type": "post",
@@ -732,7 +837,10 @@ def log_post_perception(data):
     append_ledger_row(row)
 
 def log_session_end():
-    """Calculates final session metrics, generates completion code, and writes session index."""
+    """
+    Calculates final session metrics, generates completion code, and writes session index.
+    Waits for the session's writes; raises WriteBehindError if any of them failed.
+    """
     encounters = st.session_state.get("completed_encounters", [])
     n_total = len(encounters)
     practice_encs = [e for e in encounters if str(e.get("is_practice")).strip().lower() == "true"]
@@ -759,13 +867,11 @@ def log_session_end():
     comp_code = f"{st.session_state.session_id[-6:]}_{timestamp_str[-4:]}"
     st.session_state.completion_code = comp_code
 
-    if st.session_state.get("block_start_time"):
-        t_run_ms = int((timestamp_end - st.session_state.block_start_time).total_seconds() * 1000)
-    else:
-        t_run_ms = 0
+    t_run_ms, clock_source = timing.elapsed_ms(st.session_state.get("block_start_time"))
 
     row = {
         "t_run_ms": t_run_ms,
+        "clock_source": clock_source,
         "session_id": st.session_state.session_id,
         "completion_code": comp_code,
         "record_type": "session_end",
@@ -790,6 +896,7 @@ def log_session_end():
         "total_post_rows": st.session_state.get("total_post_rows", 0)
     }
     append_ledger_row(row)
+    close_ledger()
     
     idx_row = {
         "timestamp_utc": timestamp_end.isoformat(),
@@ -805,21 +912,16 @@ def log_session_end():
         "critical_under_rate": safe_str(cu_rate)
     }
     
-    idx_path = "data_out/session_index.csv"
-    idx_cols = list(idx_row.keys())
-    header = not os.path.exists(idx_path)
-    with open(idx_path, "a", newline="", encoding="utf-8") as f:
-        writer = csv.DictWriter(f, fieldnames=idx_cols)
-        if header:
-            writer.writeheader()
-        writer.writerow(idx_row)
-        f.flush()
+    # Under the session's own key, so a failed index append is raised to this
+    # session below (the index's own file lock keeps sessions' rows from interleaving)
+    writebehind.submit(_io_key(), get_store().append_session_index, idx_row)
 
     save_session_state()
+    writebehind.sync(_io_key())
 
 def generate_patient_queue():
-    """Generates the patient queue from the content pack."""
-    df_patients = st.session_state.content_pack["Patients"]
+    """Generates the patient queue (a list of patient IDs) from the content pack."""
+    df_patients = get_content_pack().sheets["Patients"]
     
     # Check if 'ID' exists?
     if "ID" not in df_patients.columns:
@@ -832,7 +934,7 @@ def generate_patient_queue():
     # Usually: Randomized Scenarios, or Set Order.
     # README says: "Scenarios: Blocks of patients presented in randomized order."
     
-    tutorials = df_patients[df_patients["Is_Practice"] == True].to_dict("records")
+    tutorials = df_patients[df_patients["Is_Practice"] == True]["ID"].tolist()
     
     # Get Scenarios
     scenarios = df_patients[df_patients["Is_Practice"] != True]
@@ -853,7 +955,7 @@ def generate_patient_queue():
     
     study_queue = []
     for sc_name in scenario_list:
-        block_patients = scenarios[scenarios["Scenario"] == sc_name].to_dict("records")
+        block_patients = scenarios[scenarios["Scenario"] == sc_name]["ID"].tolist()
         # Shuffle within block? Let's do it to be safe for "randomized order".
         random.shuffle(block_patients)
         study_queue.extend(block_patients)
@@ -862,22 +964,21 @@ def generate_patient_queue():
     full_queue = tutorials + study_queue
     
     # Store IDs in session state
-    st.session_state.patient_queue = full_queue
-    st.session_state.patient_queue_ids = [p["ID"] for p in full_queue]
+    st.session_state.patient_queue_ids = full_queue
 
 
 def get_current_patient():
-    """Returns the current patient dictionary or None."""
+    """Returns the current patient record (read-only mapping) or None."""
     idx = st.session_state.current_patient_index
-    queue = st.session_state.patient_queue
-    if 0 <= idx < len(queue):
-        return queue[idx]
+    queue_ids = st.session_state.patient_queue_ids
+    if 0 <= idx < len(queue_ids):
+        return get_patient(queue_ids[idx])
     return None
 
 
 def start_new_patient():
     """Resets state for the new patient card."""
-    st.session_state.card_start_time = datetime.now()
+    st.session_state.card_start_time = timing.anchor()
     st.session_state.revealed_actions = set() # Reset revealed actions
     st.session_state.accumulated_cost_ms = 0
     st.session_state.encounter_events = []
@@ -0,0 +1,240 @@
+import os
+import csv
+import time
+import threading
+
+# Flush thresholds for the buffered ledger writer
+LEDGER_FLUSH_ROWS = 25
+LEDGER_FLUSH_SECONDS = 2.0
+# How often a background thread flushes batches that have reached the age threshold
+LEDGER_TICK_SECONDS = 0.5
+# A session's ledger file is closed after this long without appends (e.g. a closed tab)
+LEDGER_IDLE_SECONDS = float(os.environ.get("STEP_LEDGER_IDLE_S", "300"))
+
+# "group_commit": every batch flush is followed by an fsync (default, crash-safe once flushed)
+# "buffered": batches are handed to the OS without fsync (fastest, relies on the OS page cache)
+LEDGER_DURABILITY = os.environ.get("STEP_LEDGER_DURABILITY", "group_commit")
+DURABILITY_MODES = {"group_commit", "buffered"}
+
+
+class LedgerWriter:
+    """
+    Keeps one session ledger CSV open and writes rows in batches.
+    Rows are queued in memory and flushed when the batch size or age threshold
+    is reached, or explicitly at phase boundaries (decision, TLX, session end).
+    Writes are safe to retry: a batch that fails to write is cut back off the
+    file and stays queued, and re-appending the last row queued is a no-op.
+    """
+
+    def __init__(self, filepath, fieldnames, durability=None,
+                 flush_rows=LEDGER_FLUSH_ROWS, flush_seconds=LEDGER_FLUSH_SECONDS):
+        durability = durability or LEDGER_DURABILITY
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"Unknown ledger durability mode: {durability}")
+
+        self.filepath = filepath
+        self.fieldnames = list(fieldnames)
+        self.durability = durability
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+
+        self._lock = threading.Lock()
+        self._pending = []
+        self._file = None
+        self._writer = None
+        self._oldest_pending = None
+        self._last_row_index = None
+        # Where the file was cut back to after a failed write, if that too failed
+        self._truncate_to = None
+
+    def _open(self):
+        dirname = os.path.dirname(self.filepath)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        if self._truncate_to is not None:
+            os.truncate(self.filepath, self._truncate_to)
+            self._truncate_to = None
+        self._file = open(self.filepath, "a", newline="", encoding="utf-8")
+        # Append mode positions at EOF, so an empty file still needs its header
+        if self._file.tell() == 0:
+            self._writer = csv.DictWriter(self._file, fieldnames=self.fieldnames)
+            self._writer.writeheader()
+        else:
+            # A ledger started under an older schema keeps its own columns
+            with open(self.filepath, "r", newline="", encoding="utf-8") as f:
+                header = next(csv.reader(f), None) or self.fieldnames
+            self._writer = csv.DictWriter(self._file, fieldnames=header, extrasaction="ignore")
+
+    def append(self, row):
+        """Queues a row, flushing if the batch is full or too old."""
+        with self._lock:
+            row_index = row.get("ledger_row_index")
+            # A retried append: its row is already queued (or written)
+            if row_index is None or row_index != self._last_row_index:
+                if not self._pending:
+                    self._oldest_pending = time.monotonic()
+                self._pending.append(row)
+                self._last_row_index = row_index
+            if len(self._pending) >= self.flush_rows or self._is_stale():
+                self._flush_locked()
+
+    def flush(self):
+        """Writes all queued rows (and fsyncs in group_commit mode)."""
+        with self._lock:
+            self._flush_locked()
+
+    def flush_if_stale(self):
+        with self._lock:
+            if self._is_stale():
+                self._flush_locked()
+
+    def close(self):
+        with self._lock:
+            self._flush_locked()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+                self._writer = None
+
+    @property
+    def pending_rows(self):
+        return len(self._pending)
+
+    def _is_stale(self):
+        if not self._pending or self._oldest_pending is None:
+            return False
+        return (time.monotonic() - self._oldest_pending) >= self.flush_seconds
+
+    def _flush_locked(self):
+        if not self._pending:
+            return
+        if self._file is None:
+            start = os.path.getsize(self.filepath) if os.path.exists(self.filepath) else 0
+            self._open()
+        else:
+            start = self._file.tell()
+        try:
+            self._writer.writerows(self._pending)
+            self._file.flush()
+            if self.durability == "group_commit":
+                os.fsync(self._file.fileno())
+        except Exception:
+            self._discard_partial(start)
+            raise
+        self._pending = []
+        self._oldest_pending = None
+
+
+    def _discard_partial(self, offset):
+        """Cuts a failed batch back off the file; the rows stay queued for the next flush."""
+        self._truncate_to = offset
+        try:
+            self._file.close()
+        except Exception:
+            pass
+        self._file = None
+        self._writer = None
+        try:
+            os.truncate(self.filepath, offset)
+            self._truncate_to = None
+        except OSError:
+            pass  # cut back when the file is next opened
+
+
+class FlushTicker:
+    """
+    Calls flush() every interval seconds on a daemon thread, so the rows of a
+    session that has gone quiet reach disk once their batch is old enough,
+    without every append having to check every session.
+    """
+
+    def __init__(self, flush, interval=LEDGER_TICK_SECONDS, name="step-ledger-flush"):
+        self._flush = flush
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self._flush()
+            except Exception as e:
+                print(f"Ledger flush failed: {e}")
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not threading.current_thread():
+            self._thread.join(timeout=5)
+
+
+class LedgerRegistry:
+    """
+    Process-wide map of ledger path -> open LedgerWriter. Writers not used for
+    idle_seconds are flushed, closed and dropped by the ticker; get() reopens
+    the ledger in append mode if the session comes back.
+    """
+
+    def __init__(self, fieldnames, idle_seconds=LEDGER_IDLE_SECONDS):
+        self.fieldnames = list(fieldnames)
+        self.idle_seconds = idle_seconds
+        self._lock = threading.Lock()
+        self._writers = {}
+        self._last_used = {}
+        self._ticker = None
+
+    def get(self, filepath):
+        with self._lock:
+            writer = self._writers.get(filepath)
+            if writer is None:
+                writer = LedgerWriter(filepath, self.fieldnames)
+                self._writers[filepath] = writer
+            self._last_used[filepath] = time.monotonic()
+            if self._ticker is None:
+                self._ticker = FlushTicker(self.flush_stale)
+            return writer
+
+    def flush(self, filepath):
+        with self._lock:
+            writer = self._writers.get(filepath)
+        if writer is not None:
+            writer.flush()
+
+    def flush_stale(self):
+        """
+        Enforces the time threshold for sessions that have gone quiet, and closes
+        the writers of sessions idle for idle_seconds (run by the ticker).
+        """
+        now = time.monotonic()
+        with self._lock:
+            for filepath in [p for p, used in self._last_used.items() if now - used >= self.idle_seconds]:
+                # Closed under the lock, so get() cannot hand out the writer meanwhile
+                try:
+                    self._writers[filepath].close()
+                except Exception as e:
+                    print(f"Closing idle ledger {filepath} failed: {e}")
+                    continue  # kept, with its rows, and tried again next tick
+                del self._writers[filepath]
+                del self._last_used[filepath]
+            writers = list(self._writers.values())
+        for writer in writers:
+            writer.flush_if_stale()
+
+    def close(self, filepath):
+        with self._lock:
+            writer = self._writers.pop(filepath, None)
+            self._last_used.pop(filepath, None)
+        if writer is not None:
+            writer.close()
+
+    def close_all(self):
+        with self._lock:
+            writers = list(self._writers.values())
+            self._writers = {}
+            self._last_used = {}
+            ticker, self._ticker = self._ticker, None
+        if ticker is not None:
+            ticker.stop()
+        for writer in writers:
+            writer.close()
+
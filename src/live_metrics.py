@@ -0,0 +1,306 @@
+import os
+import time
+import sqlite3
+import threading
+from collections import deque
+
+from src.replication import read_complete_records
+from src.storage import LEDGER_FILE_RE
+
+DASHBOARD_REFRESH_SECONDS = float(os.environ.get("STEP_DASHBOARD_REFRESH_S", "5"))
+# A session is active while it has logged a row this recently and not ended
+ACTIVE_WINDOW_SECONDS = 10 * 60
+THROUGHPUT_WINDOW_SECONDS = 60
+# The ledger directory is re-listed, and idle ledgers re-checked, at least this often
+RELIST_SECONDS = 30
+# and, when the directory's mtime shows new or deleted files, at most this often
+RELIST_MIN_SECONDS = 10
+SQLITE_BATCH_ROWS = 5000
+
+PHASES = ["Triage", "NASA-TLX", "Washout", "Post-survey"]
+FINISHED = "Finished"
+# All the metrics need (SQLite reads only these)
+METRIC_COLUMNS = ["session_id", "record_type", "event_type", "tool_id", "scenario_type", "is_practice",
+                  "Time_to_Tag", "Error_Class"]
+
+
+def phase_of(row):
+    """The study phase a session is in, judging by the last row it logged."""
+    record_type = row.get("record_type")
+    if record_type == "tlx":
+        return "NASA-TLX"
+    if record_type == "post":
+        return "Post-survey"
+    if record_type == "session_end":
+        return FINISHED
+    if row.get("event_type") == "washout_start":
+        return "Washout"
+    return "Triage"
+
+
+# --- Tails: the rows appended since the last poll ---
+
+class FileTail:
+    """
+    New complete rows of the ledger CSVs in a directory, read from per-file byte
+    offsets. A ledger is no longer checked once its session_end row is read. One
+    that has not changed for ACTIVE_WINDOW_SECONDS (an abandoned session) is set
+    idle and only re-checked every RELIST_SECONDS, when its mtime shows whether it
+    has grown. So a poll costs one stat per recently written ledger plus the new
+    bytes.
+    """
+
+    def __init__(self, directory="data_out"):
+        self.directory = directory
+        self.files = {}
+        self.last_checked = 0
+        self.listings = 0
+        self._listed_mtime = None
+        self._listed_at = None
+
+    def _relist(self, now):
+        """Picks up new ledgers; returns the session_ids of ledgers deleted since (withdrawn sessions)."""
+        if self._listed_at is not None:
+            since = now - self._listed_at
+            if since < RELIST_MIN_SECONDS:
+                return []
+            if since < RELIST_SECONDS:
+                try:
+                    if os.stat(self.directory).st_mtime_ns == self._listed_mtime:
+                        return []
+                except FileNotFoundError:
+                    pass
+        self._listed_at = now
+        self.listings += 1
+        try:
+            self._listed_mtime = os.stat(self.directory).st_mtime_ns
+            with os.scandir(self.directory) as entries:
+                names = {e.name for e in entries if LEDGER_FILE_RE.match(e.name)}
+        except FileNotFoundError:
+            self._listed_mtime, names = None, set()
+        removed = [self.files.pop(name)["session_id"] for name in set(self.files) - names]
+        for name in names - set(self.files):
+            self.files[name] = {"offset": 0, "header": None, "session_id": None, "done": False, "idle_mtime": None}
+        self._recheck_idle()
+        return [session_id for session_id in removed if session_id]
+
+    def _recheck_idle(self):
+        """Wakes idle ledgers whose mtime has changed (a resumed session)."""
+        for name, state in self.files.items():
+            if state["idle_mtime"] is None:
+                continue
+            self.last_checked += 1
+            try:
+                if os.stat(os.path.join(self.directory, name)).st_mtime_ns != state["idle_mtime"]:
+                    state["idle_mtime"] = None
+            except FileNotFoundError:
+                pass
+
+    def poll(self, now):
+        """Returns ([(rows, seen_at)], removed session_ids); seen_at is when the rows were written."""
+        self.last_checked = 0
+        removed = self._relist(now)
+        batches = []
+        for name, state in self.files.items():
+            if state["done"] or state["idle_mtime"] is not None:
+                continue
+            self.last_checked += 1
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            if stat.st_size != state["offset"]:
+                rows, state["header"], state["offset"] = read_complete_records(
+                    path, state["offset"], stat.st_size, state["header"])
+                if rows:
+                    state["session_id"] = state["session_id"] or rows[0].get("session_id")
+                    state["done"] = any(r.get("record_type") == "session_end" for r in rows)
+                    batches.append((rows, stat.st_mtime))
+            if not state["done"] and now - stat.st_mtime > ACTIVE_WINDOW_SECONDS:
+                state["idle_mtime"] = stat.st_mtime_ns
+        return batches, removed
+
+
+class SQLiteTail:
+    """New rows of the SQLite store's ledger table, read after the last row_id seen."""
+
+    def __init__(self, path):
+        self.path = path
+        self.row_id = 0
+        self.last_checked = 0
+        self._conn = None
+
+    def poll(self, now):
+        if self._conn is None:
+            if not os.path.exists(self.path):
+                return [], []
+            self._conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, timeout=30, check_same_thread=False)
+        from src.storage import _quote
+
+        cols = ", ".join(_quote(c) for c in METRIC_COLUMNS)
+        rows = []
+        while True:
+            fetched = self._conn.execute(
+                f"SELECT row_id, {cols} FROM ledger WHERE row_id > ? ORDER BY row_id LIMIT ?",
+                (self.row_id, SQLITE_BATCH_ROWS),
+            ).fetchall()
+            if not fetched:
+                break
+            self.row_id = fetched[-1][0]
+            rows.extend(dict(zip(METRIC_COLUMNS, ["" if v is None else v for v in values[1:]])) for values in fetched)
+        self.last_checked = 1
+        # Rows carry no wall clock: they count as written now, so on the first poll
+        # (history) every unfinished session looks active until the window passes
+        return ([(rows, now)] if rows else []), []
+
+
+def create_tail(source="files", directory="data_out", db_path=None):
+    if source == "sqlite":
+        from src import storage
+
+        return SQLiteTail(db_path or storage.SQLITE_PATH)
+    return FileTail(directory)
+
+
+# --- Running aggregates ---
+
+class LiveMetrics:
+    """
+    Running aggregates over every session ledger, updated from the rows appended
+    since the last poll: active participants per phase, mean Time_to_Tag and
+    the critical under-triage rate by tool and scenario, and event throughput.
+    After the first poll (which reads the history once), a poll costs the new
+    rows plus the tail's per-ledger check, and a snapshot the number of active
+    sessions, not the total history.
+    """
+
+    def __init__(self, tail, clock=time.time):
+        self.tail = tail
+        self.clock = clock
+        self._lock = threading.Lock()
+        self.sessions = {}
+        self.groups = {}
+        self.finished = 0
+        self.rows_read = 0
+        self.polls = 0
+        self.last_poll_at = None
+        self.last_poll_rows = 0
+        self.last_poll_ms = 0.0
+        # session_id -> last_seen, for unfinished sessions seen within ACTIVE_WINDOW_SECONDS
+        self._recent = {}
+        # (poll time, event rows) for polls within THROUGHPUT_WINDOW_SECONDS
+        self._arrivals = deque()
+        self._first_live_poll = None
+
+    def poll(self, min_interval=1.0):
+        """Reads the rows appended since the last poll (at most one poll per min_interval seconds)."""
+        with self._lock:
+            now = self.clock()
+            if self.last_poll_at is not None and now - self.last_poll_at < min_interval:
+                return 0
+            started = time.perf_counter()
+            batches, removed = self.tail.poll(now)
+            n_rows = n_events = 0
+            for rows, seen_at in batches:
+                for row in rows:
+                    self._add(row, seen_at)
+                    n_events += row.get("record_type") == "event"
+                n_rows += len(rows)
+            for session_id in removed:
+                self._forget(session_id)
+            # The first poll catches up on history, which is not throughput
+            if self.polls:
+                self._arrivals.append((now, n_events))
+                if self._first_live_poll is None:
+                    self._first_live_poll = self.last_poll_at
+            self.polls += 1
+            self.rows_read += n_rows
+            self.last_poll_at = now
+            self.last_poll_rows = n_rows
+            self.last_poll_ms = (time.perf_counter() - started) * 1000
+            return n_rows
+
+    def _add(self, row, seen_at):
+        session_id = row.get("session_id", "")
+        if not session_id:
+            return
+        session = self.sessions.get(session_id)
+        if session is None:
+            session = self.sessions[session_id] = {"phase": None, "last_seen": 0.0, "groups": {}}
+        if session["phase"] == FINISHED:
+            return
+        session["phase"] = phase_of(row)
+        session["last_seen"] = max(session["last_seen"], seen_at)
+        if session["phase"] == FINISHED:
+            self.finished += 1
+            self._recent.pop(session_id, None)
+        else:
+            self._recent[session_id] = session["last_seen"]
+
+        if row.get("record_type") == "encounter" and str(row.get("is_practice")) != "True":
+            key = (row.get("tool_id", ""), row.get("scenario_type", ""))
+            delta = [1, 0.0, 0, int(row.get("Error_Class") == "Critical_Under")]
+            try:
+                delta[1], delta[2] = float(row.get("Time_to_Tag")), 1
+            except (TypeError, ValueError):
+                pass
+            for totals in (self.groups.setdefault(key, [0, 0.0, 0, 0]), session["groups"].setdefault(key, [0, 0.0, 0, 0])):
+                for i, value in enumerate(delta):
+                    totals[i] += value
+
+    def _forget(self, session_id):
+        """Takes a deleted (withdrawn) session's rows back out of the aggregates."""
+        session = self.sessions.pop(session_id, None)
+        if session is None:
+            return
+        self._recent.pop(session_id, None)
+        self.finished -= session["phase"] == FINISHED
+        for key, partial in session["groups"].items():
+            totals = self.groups[key]
+            for i, value in enumerate(partial):
+                totals[i] -= value
+            if not totals[0]:
+                del self.groups[key]
+
+    def snapshot(self):
+        """The current aggregates, for display."""
+        with self._lock:
+            now = self.clock()
+            for session_id, last_seen in list(self._recent.items()):
+                if now - last_seen > ACTIVE_WINDOW_SECONDS:
+                    del self._recent[session_id]
+            active = {phase: 0 for phase in PHASES}
+            for session_id in self._recent:
+                active[self.sessions[session_id]["phase"]] += 1
+
+            while self._arrivals and now - self._arrivals[0][0] > THROUGHPUT_WINDOW_SECONDS:
+                self._arrivals.popleft()
+            window = min(THROUGHPUT_WINDOW_SECONDS, now - self._first_live_poll) if self._first_live_poll else 0
+            events = sum(n for _, n in self._arrivals)
+
+            groups = []
+            total = [0, 0.0, 0, 0]
+            for (tool_id, scenario_type), (encounters, tag_sum, tag_n, critical) in sorted(self.groups.items()):
+                groups.append({
+                    "tool_id": tool_id, "scenario_type": scenario_type, "encounters": encounters,
+                    "mean_time_to_tag_ms": tag_sum / tag_n if tag_n else None,
+                    "critical_under_rate": critical / encounters if encounters else None,
+                })
+                for i, value in enumerate((encounters, tag_sum, tag_n, critical)):
+                    total[i] += value
+            return {
+                "active_by_phase": active,
+                "active": sum(active.values()),
+                "sessions": len(self.sessions),
+                "finished": self.finished,
+                "encounters": total[0],
+                "mean_time_to_tag_ms": total[1] / total[2] if total[2] else None,
+                "critical_under_rate": total[3] / total[0] if total[0] else None,
+                "events_per_minute": events * 60 / window if window > 0 else None,
+                "groups": groups,
+                "rows_read": self.rows_read,
+                "last_poll_rows": self.last_poll_rows,
+                "last_poll_ms": self.last_poll_ms,
+                "ledgers_checked": self.tail.last_checked,
+            }
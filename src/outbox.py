@@ -0,0 +1,343 @@
+import streamlit as st
+import os
+import json
+import time
+import random
+import sqlite3
+import threading
+
+# Durable queue of rows waiting to be appended to Google Sheets (Mode C)
+OUTBOX_PATH = os.environ.get("STEP_OUTBOX_PATH", os.path.join("data_out", "sheets_outbox.sqlite3"))
+
+# The Sheets API allows about 60 write requests per minute per user; stay below it
+SHEETS_WRITES_PER_MINUTE = float(os.environ.get("STEP_SHEETS_WRITES_PER_MIN", "50"))
+SHEETS_WRITE_BURST = 5
+OUTBOX_BATCH_ROWS = 500
+
+# Truncated exponential backoff with jitter, as recommended for Google APIs
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 64.0
+OUTBOX_IDLE_SECONDS = 5.0
+# A batch that keeps failing (other than 429) is set aside after this many attempts
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get("STEP_OUTBOX_MAX_ATTEMPTS", "20"))
+# Sent rows are kept (as dedup keys only) this long, then deleted
+OUTBOX_KEEP_SENT_SECONDS = 7 * 24 * 3600
+OUTBOX_PURGE_SECONDS = 3600
+
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+_outboxes = []
+
+
+def error_status(exc):
+    """HTTP status of a gspread APIError (or similar), or None."""
+    status = getattr(exc, "code", None)
+    if not isinstance(status, int):
+        status = getattr(getattr(exc, "response", None), "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+class TokenBucket:
+    """Spaces out write requests to stay under a per-minute quota."""
+
+    def __init__(self, rate_per_minute, burst):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = float(burst)
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until a token is available. Returns the seconds waited."""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+class SheetsOutbox:
+    """
+    Rows bound for Google Sheets are first committed to a local SQLite outbox,
+    so a slow, throttled or unreachable API never blocks or loses a write.
+    A single flusher thread appends them with append_rows, one batch per
+    worksheet per request, paced by a token bucket and backing off
+    exponentially on errors. A batch rejected with a non-retryable status
+    (e.g. 400), or failing max_attempts times, is moved to a dead-letter state
+    so the rows behind it keep flowing; requeue_dead() sends it again. Each row
+    carries a dedup key (session_id and ledger_row_index): enqueueing the same
+    key twice is a no-op. Sent rows keep only their key, and are deleted after
+    keep_sent seconds.
+
+    open_worksheet(sheet_name, worksheet, header) must return an object with
+    gspread's append_rows(rows, value_input_option=...) and raise on failure.
+    """
+
+    def __init__(self, open_worksheet, path=OUTBOX_PATH, writes_per_minute=SHEETS_WRITES_PER_MINUTE,
+                 burst=SHEETS_WRITE_BURST, batch_rows=OUTBOX_BATCH_ROWS,
+                 backoff_base=BACKOFF_BASE_SECONDS, backoff_max=BACKOFF_MAX_SECONDS,
+                 max_attempts=OUTBOX_MAX_ATTEMPTS, keep_sent=OUTBOX_KEEP_SENT_SECONDS):
+        self.open_worksheet = open_worksheet
+        self.path = path
+        self.batch_rows = batch_rows
+        self.max_attempts = max_attempts
+        self.keep_sent = keep_sent
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.limiter = TokenBucket(writes_per_minute, burst)
+
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS outbox ("
+                "id INTEGER PRIMARY KEY, sheet_name TEXT, worksheet TEXT, header TEXT, dedup_key TEXT, "
+                "row TEXT, enqueued_at REAL, sent_at REAL, attempts INTEGER DEFAULT 0, last_error TEXT, dead_at REAL)"
+            )
+            # Outboxes created before the dead-letter state
+            if "dead_at" not in {row[1] for row in self._conn.execute("PRAGMA table_info(outbox)")}:
+                self._conn.execute("ALTER TABLE outbox ADD COLUMN dead_at REAL")
+            self._conn.execute(
+                "CREATE UNIQUE INDEX IF NOT EXISTS outbox_dedup ON outbox (sheet_name, worksheet, dedup_key)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS outbox_unsent ON outbox (sent_at, id)")
+
+        self._worksheets = {}
+        self._failures = 0
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+
+        self.batches = 0
+        self.rows_sent = 0
+        self.throttled = 0
+        self.errors = 0
+        self.dead_lettered = 0
+        self.duplicates = 0
+        self.rate_wait_s = 0.0
+        self.last_error = None
+        self._purged_at = 0.0
+
+        self._thread = threading.Thread(target=self._run, name="step-sheets-outbox", daemon=True)
+        self._thread.start()
+
+    def enqueue(self, sheet_name, worksheet, header, dedup_key, row):
+        """Durably queues row for worksheet. Returns False if dedup_key was already queued."""
+        with self._lock:
+            with self._conn:
+                cursor = self._conn.execute(
+                    "INSERT OR IGNORE INTO outbox (sheet_name, worksheet, header, dedup_key, row, enqueued_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (sheet_name, worksheet, json.dumps(header), str(dedup_key), json.dumps(row, default=str), time.time()),
+                )
+            inserted = cursor.rowcount == 1
+            if not inserted:
+                self.duplicates += 1
+        if inserted:
+            self._wake.set()
+        return inserted
+
+    def pending(self):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM outbox WHERE sent_at IS NULL AND dead_at IS NULL").fetchone()[0]
+
+    def flush_once(self):
+        """
+        Sends one batch for the worksheet with the oldest unsent row. Returns rows sent.
+        Raises on a retryable failure; a batch it moves to the dead-letter state is not raised.
+        """
+        with self._lock:
+            target = self._conn.execute(
+                "SELECT sheet_name, worksheet, header FROM outbox WHERE sent_at IS NULL AND dead_at IS NULL "
+                "ORDER BY id LIMIT 1"
+            ).fetchone()
+            if target is None:
+                return 0
+            sheet_name, worksheet, header = target
+            batch = self._conn.execute(
+                "SELECT id, row, attempts FROM outbox WHERE sent_at IS NULL AND dead_at IS NULL "
+                "AND sheet_name = ? AND worksheet = ? ORDER BY id LIMIT ?",
+                (sheet_name, worksheet, self.batch_rows),
+            ).fetchall()
+
+        ids = [row_id for row_id, _, _ in batch]
+        waited = self.limiter.acquire()
+        with self._lock:
+            self.rate_wait_s += waited
+        try:
+            ws = self._worksheets.get((sheet_name, worksheet))
+            if ws is None:
+                ws = self.open_worksheet(sheet_name, worksheet, json.loads(header))
+                self._worksheets[(sheet_name, worksheet)] = ws
+            ws.append_rows([json.loads(row) for _, row, _ in batch], value_input_option="RAW")
+        except Exception as e:
+            self._worksheets.pop((sheet_name, worksheet), None)
+            if self._record_failure(ids, max(attempts for _, _, attempts in batch) + (error_status(e) != 429), e):
+                return 0
+            raise
+
+        marks = ", ".join("?" for _ in ids)
+        with self._lock:
+            with self._conn:
+                # Only the dedup key is still needed
+                self._conn.execute(f"UPDATE outbox SET sent_at = ?, row = NULL, header = NULL WHERE id IN ({marks})",
+                                   [time.time()] + ids)
+            self.batches += 1
+            self.rows_sent += len(ids)
+        return len(ids)
+
+    def _record_failure(self, ids, attempts, exc):
+        """Counts a failed batch; returns True if it was moved to the dead-letter state."""
+        status = error_status(exc)
+        dead = status != 429 and (
+            (status is not None and status not in RETRYABLE_STATUS) or attempts >= self.max_attempts)
+        marks = ", ".join("?" for _ in ids)
+        with self._lock:
+            if status == 429:
+                self.throttled += 1
+            else:
+                self.errors += 1
+            self.last_error = f"{status or type(exc).__name__}: {exc}"
+            if dead:
+                self.dead_lettered += len(ids)
+            with self._conn:
+                self._conn.execute(
+                    # A 429 is the quota, not the batch: it does not count as an attempt
+                    f"UPDATE outbox SET attempts = attempts + ?, last_error = ?, dead_at = ? WHERE id IN ({marks})",
+                    [int(status != 429), self.last_error, time.time() if dead else None] + ids,
+                )
+        if dead:
+            print(f"Sheets outbox: {len(ids)} rows set aside after {attempts} attempt(s) ({self.last_error})")
+        return dead
+
+    def requeue_dead(self):
+        """Queues the dead-lettered rows to be sent again (e.g. once the sheet is fixed). Returns how many."""
+        with self._lock:
+            with self._conn:
+                cursor = self._conn.execute(
+                    "UPDATE outbox SET dead_at = NULL, attempts = 0 WHERE dead_at IS NOT NULL AND sent_at IS NULL")
+        self._wake.set()
+        return cursor.rowcount
+
+    def sheets_for(self, dedup_prefix):
+        """Sheets that rows with dedup_keys starting with dedup_prefix were queued for (until purged)."""
+        with self._lock:
+            fetched = self._conn.execute(
+                "SELECT DISTINCT sheet_name FROM outbox WHERE substr(dedup_key, 1, ?) = ?",
+                (len(dedup_prefix), dedup_prefix),
+            ).fetchall()
+        return sorted(name for (name,) in fetched)
+
+    def discard(self, dedup_prefix):
+        """Drops the queued rows whose dedup_key starts with dedup_prefix (e.g. a withdrawn session's). Returns how many."""
+        with self._lock:
+            with self._conn:
+                cursor = self._conn.execute(
+                    "DELETE FROM outbox WHERE sent_at IS NULL AND substr(dedup_key, 1, ?) = ?",
+                    (len(dedup_prefix), dedup_prefix),
+                )
+        return cursor.rowcount
+
+    def purge_sent(self, now=None):
+        """Deletes rows sent more than keep_sent seconds ago (their dedup keys expire). Returns how many."""
+        cutoff = (now or time.time()) - self.keep_sent
+        with self._lock:
+            with self._conn:
+                cursor = self._conn.execute("DELETE FROM outbox WHERE sent_at < ?", (cutoff,))
+        return cursor.rowcount
+
+    def _backoff_seconds(self):
+        delay = min(self.backoff_max, self.backoff_base * (2 ** (self._failures - 1)))
+        return delay * random.uniform(0.5, 1.0)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            if time.monotonic() - self._purged_at >= OUTBOX_PURGE_SECONDS:
+                self._purged_at = time.monotonic()
+                try:
+                    self.purge_sent()
+                except sqlite3.Error as e:
+                    print(f"Sheets outbox: purge failed ({e})")
+            try:
+                sent = self.flush_once()
+                self._failures = 0
+            except Exception as e:
+                self._failures += 1
+                delay = self._backoff_seconds()
+                kind = "throttled" if error_status(e) in RETRYABLE_STATUS else "append failed"
+                print(f"Sheets outbox: {kind} ({self.last_error}); retrying in {delay:.1f}s")
+                self._stopped.wait(delay)
+                continue
+            if not sent and self.pending():
+                continue  # a batch was set aside; send the next one
+            if not sent:
+                self._wake.wait(OUTBOX_IDLE_SECONDS)
+                self._wake.clear()
+
+    def drain(self, timeout=None):
+        """Waits until the outbox is empty. Returns False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.pending():
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            self._wake.set()
+            time.sleep(0.05)
+        return True
+
+    def metrics(self):
+        with self._lock:
+            pending, oldest = self._conn.execute(
+                "SELECT COUNT(*), MIN(enqueued_at) FROM outbox WHERE sent_at IS NULL AND dead_at IS NULL"
+            ).fetchone()
+            dead = self._conn.execute(
+                "SELECT COUNT(*) FROM outbox WHERE dead_at IS NOT NULL AND sent_at IS NULL").fetchone()[0]
+            return {
+                "pending": pending,
+                "oldest_pending_age_s": round(time.time() - oldest, 1) if oldest else 0.0,
+                "dead_letter": dead,
+                "rows_sent": self.rows_sent,
+                "batches": self.batches,
+                "throttled": self.throttled,
+                "errors": self.errors,
+                "rows_dead_lettered": self.dead_lettered,
+                "duplicates_ignored": self.duplicates,
+                "rate_limit_wait_s": round(self.rate_wait_s, 1),
+                "last_error": self.last_error,
+            }
+
+    def close(self, drain_timeout=0):
+        """Stops the flusher, optionally after trying to send what is queued. Unsent rows stay in the outbox."""
+        if drain_timeout:
+            self.drain(drain_timeout)
+        self._stopped.set()
+        self._wake.set()
+        self._thread.join(timeout=5)
+        with self._lock:
+            self._conn.close()
+
+
+@st.cache_resource
+def get_outbox():
+    """Returns the process-wide Google Sheets outbox (rows left from a previous run are sent first)."""
+    from src import cloud
+
+    outbox = SheetsOutbox(open_worksheet=cloud.open_log_worksheet)
+    _outboxes.append(outbox)
+    return outbox
+
+
+def close_all(drain_timeout=10):
+    """Gives queued rows a bounded chance to go out, then stops every outbox (interpreter exit)."""
+    while _outboxes:
+        _outboxes.pop().close(drain_timeout)
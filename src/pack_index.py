@@ -0,0 +1,230 @@
+import pandas as pd
+import os
+from types import MappingProxyType
+from collections import namedtuple
+
+# Action grid headers per tool, in display order (tools without a layout use SMART's)
+CATEGORY_LAYOUTS = {
+    "TST": {
+        "WALKING": ["walk"],
+        "SEVERE BLEEDING": ["hemorrhage", "hemorrhage_ctrl"],
+        "TALKING": ["talking"],
+        "AIRWAY/BREATHING": ["airway_obs", "airway_man", "recovery_pos"],
+        "PENETRATING INJURY": ["deadly_box"]
+    },
+    "SMART": {
+        "WALKING": ["walk"],
+        "INJURED": ["injured"],
+        "BREATHING": ["airway_obs"],
+        "OPEN AIRWAY": ["airway_man"],
+        "RESPIRATORY RATE": ["rr"],
+        "PULSE": ["pulse_rad", "pulse_rate"]
+    },
+}
+
+LABEL_PREFIXES = ["Airway:", "Breathing:", "Circulation:", "Disability:"]
+
+# Interventions stay on the grid even when the patient's finding is "not applicable"
+ALWAYS_VISIBLE_ACTIONS = ("airway_man", "hemorrhage_ctrl", "recovery_pos")
+
+AVATAR_DIR = "assets/img"
+DEFAULT_AVATAR = "default.png"
+
+ActionSpec = namedtuple("ActionSpec", ["key", "label", "cost_ms", "category", "valid_tools"])
+ToolButton = namedtuple("ToolButton", ["label", "colour"])
+
+
+def clean_label(label):
+    """Strips the A-B-C-D category prefix from a button label."""
+    label = str(label)
+    for prefix in LABEL_PREFIXES:
+        if label.startswith(prefix):
+            label = label[len(prefix):].strip()
+    return label.strip()
+
+def _to_cost(value):
+    if pd.isna(value):
+        return 0
+    value = float(value)
+    return int(value) if value.is_integer() else value
+
+
+class PatientRenderModel:
+    """
+    Everything the patient card and action grid need for one patient,
+    resolved at pack load time. Instances are read-only and shared by every
+    session using the pack.
+    """
+
+    __slots__ = (
+        "patient_id", "name", "scenario", "visible_text", "is_practice",
+        "avatar_file", "avatar_path", "results", "reference_tags", "_layouts",
+    )
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            object.__setattr__(self, name, fields[name])
+
+    def __setattr__(self, name, value):
+        raise AttributeError("PatientRenderModel is read-only")
+
+    def layout(self, tool_id):
+        """((position, header_name, (ActionSpec, ...)), ...) of the actions visible for this patient."""
+        return self._layouts.get(tool_id, ())
+
+
+def _resolve_avatar(avatar_file):
+    if pd.isna(avatar_file) or not avatar_file:
+        avatar_file = DEFAULT_AVATAR
+    path = os.path.join(AVATAR_DIR, avatar_file)
+    if not os.path.exists(path):
+        path = os.path.join(AVATAR_DIR, DEFAULT_AVATAR)
+    return avatar_file, path
+
+
+class ContentPackIndex:
+    """
+    Read-only lookups compiled once per content pack, so reruns and scoring
+    never scan the Config or Tools DataFrames.
+    """
+
+    def __init__(self, content_pack):
+        config_df = content_pack["Config"]
+        tools_df = content_pack["Tools"]
+
+        tool_ids = [t for t in tools_df["Tool_ID"].dropna().unique()] if "Tool_ID" in tools_df.columns else []
+        tool_ids += [c[:-len("_Order")] for c in config_df.columns if str(c).endswith("_Order")]
+        self.tool_ids = tuple(dict.fromkeys(str(t) for t in tool_ids))
+
+        # 1. Action specs in Config order (later duplicates win, as in the old iterrows lookups)
+        actions = {}
+        for record in config_df.to_dict("records"):
+            key = record.get("Action_Key")
+            if pd.isna(key):
+                continue
+            valid = record.get("Valid_Tools")
+            actions[key] = ActionSpec(
+                key=key,
+                label=clean_label(record.get("Button_Label", key)),
+                cost_ms=_to_cost(record.get("Cost_ms")),
+                category=record.get("Category", ""),
+                valid_tools="" if pd.isna(valid) else str(valid),
+            )
+        self.actions = actions
+        self.costs = {k: a.cost_ms for k, a in actions.items()}
+
+        # 2. Per-tool action lists, order maps and grid layouts
+        self._tool_actions = {t: self._compile_tool_actions(t) for t in self.tool_ids}
+        self._order_maps = {}
+        for tool_id in self.tool_ids:
+            order_col = f"{tool_id}_Order"
+            if order_col in config_df.columns:
+                self._order_maps[tool_id] = self._compile_order_map(config_df, order_col)
+        self._layouts = {t: self._compile_layout(t) for t in self.tool_ids}
+
+        # 3. Triage decision buttons per tool
+        self._tool_buttons = {}
+        if {"Tool_ID", "Button_Label", "Colour"}.issubset(tools_df.columns):
+            for record in tools_df.to_dict("records"):
+                self._tool_buttons.setdefault(str(record["Tool_ID"]), []).append(
+                    ToolButton(label=record["Button_Label"], colour=record["Colour"])
+                )
+        self._tool_buttons = {t: tuple(b) for t, b in self._tool_buttons.items()}
+
+        # 4. Per-patient render models
+        patients_df = content_pack["Patients"]
+        self._patients = MappingProxyType({
+            record["ID"]: self._compile_patient(record) for record in patients_df.to_dict("records")
+        })
+
+    def _compile_patient(self, patient):
+        # Imported here: engine owns the clinical defaults and reference lookup, and imports this module
+        from src.engine import get_investigation_result, get_gold_standard
+
+        results = {key: get_investigation_result(patient, key) for key in self.actions}
+
+        layouts = {}
+        for tool_id in self.tool_ids:
+            tool_layout = []
+            for position, header_name, keys in self.layout(tool_id):
+                visible = []
+                for key in keys:
+                    raw_result = str(patient.get(f"{key}_Text", ""))
+                    if key not in ALWAYS_VISIBLE_ACTIONS and "not applicable" in raw_result.lower():
+                        continue
+                    visible.append(self.actions[key])
+                if visible:
+                    tool_layout.append((position, header_name, tuple(visible)))
+            layouts[tool_id] = tuple(tool_layout)
+
+        visible_text = patient.get("Visible_Text")
+        if visible_text is None or pd.isna(visible_text):
+            visible_text = "No visible findings recorded."
+
+        avatar_file, avatar_path = _resolve_avatar(patient.get("Avatar_File", DEFAULT_AVATAR))
+
+        return PatientRenderModel(
+            patient_id=patient["ID"],
+            name=patient.get("Patient_Name", "Unknown"),
+            scenario=patient.get("Scenario", ""),
+            visible_text=visible_text,
+            is_practice=patient.get("Is_Practice", False),
+            avatar_file=avatar_file,
+            avatar_path=avatar_path,
+            results=MappingProxyType(results),
+            reference_tags=MappingProxyType({t: get_gold_standard(patient, t) for t in self.tool_ids}),
+            _layouts=MappingProxyType(layouts),
+        )
+
+    def _compile_tool_actions(self, tool_id):
+        # Substring match, as Valid_Tools.str.contains(tool_id) did
+        return tuple(k for k, a in self.actions.items() if tool_id in a.valid_tools)
+
+    @staticmethod
+    def _compile_order_map(config_df, order_col):
+        order_map = {}
+        for key, order_val in zip(config_df["Action_Key"], config_df[order_col]):
+            if pd.notna(key) and pd.notna(order_val):
+                try:
+                    order_map[key] = int(float(order_val))
+                except (ValueError, TypeError):
+                    pass
+        return order_map
+
+    def _compile_layout(self, tool_id):
+        valid = set(self.tool_actions(tool_id))
+        mapping = CATEGORY_LAYOUTS.get(tool_id, CATEGORY_LAYOUTS["SMART"])
+        layout = []
+        for position, (header_name, keys) in enumerate(mapping.items()):
+            present = tuple(k for k in keys if k in valid)
+            if present:
+                layout.append((position, header_name, present))
+        return tuple(layout)
+
+    def tool_actions(self, tool_id):
+        """Action keys valid for tool_id, in Config order."""
+        if tool_id in self._tool_actions:
+            return self._tool_actions[tool_id]
+        return self._compile_tool_actions(tool_id)
+
+    def order_map(self, tool_id):
+        """Action_Key -> {tool}_Order, or None when the Config has no order column."""
+        return self._order_maps.get(tool_id)
+
+    def layout(self, tool_id):
+        """((position, header_name, (action_key, ...)), ...) for the action grid.
+        position is the header's slot in CATEGORY_LAYOUTS, which fixes its column and colour."""
+        if tool_id in self._layouts:
+            return self._layouts[tool_id]
+        return self._compile_layout(tool_id)
+
+    def tool_buttons(self, tool_id):
+        return self._tool_buttons.get(tool_id, ())
+
+    def patient_ids(self):
+        return tuple(self._patients)
+
+    def patient_model(self, patient_id):
+        """The PatientRenderModel for patient_id, or None."""
+        return self._patients.get(patient_id)
+
@@ -0,0 +1,140 @@
+import streamlit as st
+import os
+import time
+import queue
+import threading
+from collections import deque
+from src.avatars import get_avatar_cache
+
+# Set STEP_PREFETCH=0 to load every card cold (for measuring the saving)
+PREFETCH_ENABLED = os.environ.get("STEP_PREFETCH", "1") != "0"
+PREFETCH_QUEUE_SIZE = 256
+LATENCY_SAMPLES = 1000
+
+
+def _mean(samples):
+    return sum(samples) / len(samples) if samples else 0.0
+
+
+class Prefetcher:
+    """
+    Warms the next patient's card on a background thread while the current one
+    is on screen. Avatars are resized and encoded into the shared avatar cache,
+    so the rerun that shows the next card finds them ready. Requests are
+    best-effort: a full queue drops them rather than slowing down a rerun.
+    """
+
+    def __init__(self, avatar_cache, maxsize=PREFETCH_QUEUE_SIZE):
+        self.avatar_cache = avatar_cache
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._prefetched = set()
+
+        self.requested = 0
+        self.warmed = 0
+        self.already_warm = 0
+        self.dropped = 0
+        self.hits = 0
+        self.misses = 0
+        self._warm_ms = deque(maxlen=LATENCY_SAMPLES)
+        self._render_ms = deque(maxlen=LATENCY_SAMPLES)
+        self._cold_render_ms = deque(maxlen=LATENCY_SAMPLES)
+
+        self._thread = threading.Thread(target=self._run, name="step-prefetch", daemon=True)
+        self._thread.start()
+
+    def request(self, model):
+        """Queues the card for model (a PatientRenderModel) to be warmed."""
+        if model is None:
+            return
+        source_path = model.avatar_path
+        with self._lock:
+            self.requested += 1
+            if source_path in self._pending:
+                return
+            if self.avatar_cache.is_warm(source_path):
+                self.already_warm += 1
+                return
+            self._pending.add(source_path)
+        try:
+            self._queue.put_nowait(source_path)
+        except queue.Full:
+            with self._lock:
+                self._pending.discard(source_path)
+                self.dropped += 1
+
+    def avatar_image(self, model):
+        """st.image argument for model's avatar, recording whether it was already warm."""
+        source_path = model.avatar_path
+        warm = self.avatar_cache.is_warm(source_path)
+        started = time.perf_counter()
+        image = self.avatar_cache.image(source_path)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self._lock:
+            # Only first views count: a card prefetched for this view is a hit,
+            # a cold card is a miss; re-renders of an already warm card are neither
+            if source_path in self._prefetched:
+                self._prefetched.discard(source_path)
+                self.hits += 1
+                self._render_ms.append(elapsed_ms)
+            elif not warm:
+                self.misses += 1
+                self._cold_render_ms.append(elapsed_ms)
+        return image
+
+    def metrics(self):
+        with self._lock:
+            shown = self.hits + self.misses
+            warm_ms = _mean(self._warm_ms)
+            return {
+                "requested": self.requested,
+                "warmed": self.warmed,
+                "already_warm": self.already_warm,
+                "dropped": self.dropped,
+                "queue_depth": self._queue.qsize(),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / shown if shown else 0.0,
+                "warm_ms_mean": warm_ms,
+                "hit_render_ms_mean": _mean(self._render_ms),
+                "miss_render_ms_mean": _mean(self._cold_render_ms),
+                # Each background warm is work a later rerun did not have to do
+                "saved_ms_total": warm_ms * self.warmed,
+            }
+
+    def _run(self):
+        while True:
+            source_path = self._queue.get()
+            started = time.perf_counter()
+            try:
+                self.avatar_cache.image(source_path)
+                with self._lock:
+                    self.warmed += 1
+                    self._prefetched.add(source_path)
+                    self._warm_ms.append((time.perf_counter() - started) * 1000)
+            except Exception as e:
+                print(f"Prefetch of {source_path} failed: {e}")
+            finally:
+                with self._lock:
+                    self._pending.discard(source_path)
+                self._queue.task_done()
+
+
+@st.cache_resource
+def get_prefetcher():
+    """Returns the process-wide prefetcher."""
+    return Prefetcher(get_avatar_cache())
+
+
+def prefetch(model):
+    """Warms model's card in the background (no-op when prefetch is disabled)."""
+    if PREFETCH_ENABLED:
+        get_prefetcher().request(model)
+
+
+def avatar_image(model):
+    """st.image argument for model's avatar."""
+    if PREFETCH_ENABLED:
+        return get_prefetcher().avatar_image(model)
+    return get_avatar_cache().image(model.avatar_path)
@@ -0,0 +1,595 @@
+import streamlit as st
+import os
+import io
+import csv
+import json
+import gzip
+import time
+import shutil
+import hashlib
+import sqlite3
+import threading
+from datetime import datetime
+
+# Where complete ledger rows are replicated, besides Mode C's own spreadsheet:
+#   "dir:<path>"            gzip CSV batches in a local directory (S3/MinIO stand-in)
+#   "s3://<bucket>/<prefix>" the same objects in S3 or any S3-compatible store (needs boto3;
+#                            set STEP_S3_ENDPOINT_URL for MinIO)
+REPLICATION_TARGET = os.environ.get("STEP_REPLICATION_TARGET", "")
+S3_ENDPOINT_URL = os.environ.get("STEP_S3_ENDPOINT_URL") or None
+REPLICATION_STATE_DIR = "data_out"
+REPLICATION_INTERVAL_SECONDS = 5.0
+REPLICATION_BATCH_ROWS = 500
+# The cursor is checkpointed at the end of each pass, and within a long pass every this many rows
+REPLICATION_SAVE_ROWS = 5000
+
+# Mode C: every ledger row of a Google Sheets pack is appended here, via the outbox
+LEDGER_WORKSHEET = "Ledger"
+# ... and a withdrawn session's id here, since appended rows are not deleted
+WITHDRAWALS_WORKSHEET = "Withdrawals"
+WITHDRAWALS_HEADER = ["session_id", "withdrawn_at"]
+
+_services = []
+
+
+def _atomic_write(path, data):
+    dirname = os.path.dirname(path)
+    if dirname:
+        os.makedirs(dirname, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def encode_batch(rows, columns):
+    """gzip-compressed CSV (with header) of rows. Returns (compressed, raw_size)."""
+    text = io.StringIO()
+    writer = csv.DictWriter(text, fieldnames=columns, extrasaction="ignore")
+    writer.writeheader()
+    writer.writerows(rows)
+    raw = text.getvalue().encode("utf-8")
+    return gzip.compress(raw, compresslevel=6), len(raw)
+
+
+def split_by_session(rows):
+    """{session_id: rows} in first-seen order, so each session's rows are stored apart."""
+    sessions = {}
+    for row in rows:
+        sessions.setdefault(row.get("session_id") or "unknown", []).append(row)
+    return sessions
+
+
+def object_key(prefix, session_id, batch_id):
+    """Objects are grouped by session, so a withdrawn session is one prefix to delete."""
+    return f"{prefix}/{session_id}/{batch_id.replace('/', '_')}.csv.gz"
+
+
+def read_complete_records(path, offset, size, header=None, max_rows=None):
+    """
+    The complete CSV records of a ledger between byte offset and size: a record is
+    complete at a newline outside quotes. header is the file's header row, or None
+    when reading from the start (it is then read first). Returns (rows as dicts,
+    header, offset after the last complete record read).
+    """
+    with open(path, "rb") as f:
+        f.seek(offset)
+        chunk = f.read(size - offset)
+
+    rows = []
+    pos = offset
+    record = b""
+    for line in chunk.split(b"\n")[:-1]:
+        record += line + b"\n"
+        if record.count(b'"') % 2:
+            continue
+        values = next(csv.reader([record.decode("utf-8")]), [])
+        pos += len(record)
+        record = b""
+        if header is None:
+            header = values
+            continue
+        if values:
+            rows.append(dict(zip(header, values)))
+        if max_rows is not None and len(rows) >= max_rows:
+            break
+    return rows, header, pos
+
+
+# --- Sources: read ledger rows after a cursor ---
+
+class FileLedgerSource:
+    """
+    Tails the per-session ledger CSVs in data_out/ by byte offset. Only complete
+    records are read (a record is complete at a newline outside quotes), so rows
+    still being written are picked up on the next pass. The directory is listed
+    once per scan(), and a batch takes rows from as many ledgers as it needs.
+    The cursor holds each ledger's offset and the index of its header in a
+    shared list, so a header is stored once however many ledgers use it. A
+    ledger in the cursor but gone from the scan was deleted (a withdrawn session).
+    """
+
+    def __init__(self, directory="data_out"):
+        self.directory = directory
+        self._sizes = None
+        self._names = []
+
+    def scan(self):
+        """Lists the ledgers and their sizes; read() and pending() work from this until the next scan."""
+        from src.storage import LEDGER_FILE_RE
+
+        sizes = {}
+        try:
+            with os.scandir(self.directory) as entries:
+                for entry in entries:
+                    if LEDGER_FILE_RE.match(entry.name):
+                        try:
+                            sizes[entry.name] = entry.stat().st_size
+                        except FileNotFoundError:
+                            pass
+        except FileNotFoundError:
+            pass
+        self._sizes = sizes
+        self._names = sorted(sizes)
+
+    def _snapshot(self):
+        if self._sizes is None:
+            self.scan()
+        return self._sizes
+
+    @staticmethod
+    def _entries(cursor):
+        """{name: [offset, header index]} and the header list, from either cursor layout."""
+        files, headers = cursor.get("files", {}), cursor.get("headers", [])
+        if isinstance(headers, dict):
+            # Written before headers were shared: {name: offset} and {name: header}
+            shared = []
+            entries = {}
+            for name, offset in files.items():
+                header = headers.get(name)
+                if header is not None and header not in shared:
+                    shared.append(header)
+                entries[name] = [offset, shared.index(header) if header is not None else None]
+            return entries, shared
+        return files, headers
+
+    def withdrawn(self, cursor):
+        """Session_ids of ledgers deleted since the cursor saw them, and the cursor without them."""
+        sizes = self._snapshot()
+        entries, headers = self._entries(cursor)
+        gone = [name for name in entries if name not in sizes]
+        if not gone:
+            return [], cursor
+        # logs_<session_id>_<date>_<time>.csv
+        session_ids = sorted({name.split("_")[1] for name in gone})
+        return session_ids, {"files": {n: e for n, e in entries.items() if n in sizes}, "headers": headers}
+
+    def read(self, cursor, max_rows):
+        """Returns (batch_id, rows, new_cursor), or None when caught up with the last scan."""
+        sizes = self._snapshot()
+        entries, headers = self._entries(cursor)
+        entries = dict(entries)
+        headers = list(headers)
+        rows, ranges = [], []
+        for name in self._names:
+            size = sizes[name]
+            offset, header_no = entries.get(name, (0, None))
+            if size < offset:
+                # Rewritten from scratch; start over
+                offset = 0
+            if size == offset:
+                continue
+            header = headers[header_no] if offset and header_no is not None else None
+            try:
+                got, header, pos = read_complete_records(os.path.join(self.directory, name), offset, size, header,
+                                                         max_rows - len(rows))
+            except FileNotFoundError:
+                # Deleted since the scan; withdrawn() picks it up on the next one
+                continue
+            if pos == offset:
+                continue
+            if header not in headers:
+                headers.append(header)
+            entries[name] = [pos, headers.index(header)]
+            rows += got
+            ranges.append(f"{name}:{offset}-{pos}")
+            if len(rows) >= max_rows:
+                break
+        if not ranges:
+            return None
+        # The same ranges give the same object key, so a batch re-sent after a crash overwrites itself
+        first, start = ranges[0].rsplit(":", 1)
+        digest = hashlib.sha1("\n".join(ranges).encode("utf-8")).hexdigest()[:12]
+        batch_id = f"{os.path.splitext(first)[0]}/{int(start.split('-')[0]):012d}-{digest}"
+        return batch_id, rows, {"files": entries, "headers": headers}
+
+    def pending(self, cursor):
+        """Bytes written but not yet replicated, as of the last scan."""
+        entries, _ = self._entries(cursor)
+        total = 0
+        for name, size in self._snapshot().items():
+            offset = entries.get(name, (0, None))[0]
+            total += size - offset if size >= offset else size
+        return total
+
+
+class SQLiteLedgerSource:
+    """
+    Reads the SQLite store's ledger table in row_id order, and its withdrawal
+    table for sessions deleted since.
+    """
+
+    def __init__(self, path, columns):
+        self.path = path
+        self.columns = list(columns)
+        self._conn = None
+
+    def _connection(self):
+        if self._conn is None:
+            if not os.path.exists(self.path):
+                return None
+            self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        return self._conn
+
+    def scan(self):
+        pass  # every read is a query
+
+    def withdrawn(self, cursor):
+        """Session_ids withdrawn since the cursor, and the cursor past them."""
+        conn = self._connection()
+        if conn is None:
+            return [], cursor
+        try:
+            fetched = conn.execute(
+                "SELECT id, session_id FROM withdrawal WHERE id > ? ORDER BY id", (cursor.get("withdrawal_id", 0),)
+            ).fetchall()
+        except sqlite3.OperationalError:
+            # Created before withdrawals were recorded
+            return [], cursor
+        if not fetched:
+            return [], cursor
+        return sorted({session_id for _, session_id in fetched}), dict(cursor, withdrawal_id=fetched[-1][0])
+
+    def read(self, cursor, max_rows):
+        conn = self._connection()
+        if conn is None:
+            return None
+        last = cursor.get("row_id", 0)
+        from src.storage import _quote
+
+        cols = ", ".join(_quote(c) for c in self.columns)
+        fetched = conn.execute(
+            f"SELECT row_id, {cols} FROM ledger WHERE row_id > ? ORDER BY row_id LIMIT ?", (last, max_rows)
+        ).fetchall()
+        if not fetched:
+            return None
+        rows = [dict(zip(self.columns, values[1:])) for values in fetched]
+        first_id, last_id = fetched[0][0], fetched[-1][0]
+        return f"rows/{first_id:012d}-{last_id:012d}", rows, dict(cursor, row_id=last_id)
+
+    def pending(self, cursor):
+        conn = self._connection()
+        if conn is None:
+            return 0
+        return conn.execute("SELECT COUNT(*) FROM ledger WHERE row_id > ?", (cursor.get("row_id", 0),)).fetchone()[0]
+
+
+# --- Sinks: receive batches of complete ledger rows ---
+
+class DirectorySink:
+    """gzip CSV objects under a local directory, laid out as they would be in a bucket."""
+
+    def __init__(self, root, columns, prefix="ledger"):
+        self.root = root
+        self.columns = list(columns)
+        self.prefix = prefix
+
+    def write(self, batch_id, rows):
+        sent = raw = 0
+        for session_id, session_rows in split_by_session(rows).items():
+            data, raw_size = encode_batch(session_rows, self.columns)
+            _atomic_write(os.path.join(self.root, object_key(self.prefix, session_id, batch_id)), data)
+            sent += len(data)
+            raw += raw_size
+        return sent, raw
+
+    def delete_session(self, session_id):
+        """Deletes a withdrawn session's objects."""
+        shutil.rmtree(os.path.join(self.root, self.prefix, session_id), ignore_errors=True)
+
+
+class S3Sink:
+    """gzip CSV objects in S3 or an S3-compatible store such as MinIO."""
+
+    def __init__(self, bucket, prefix, columns, endpoint_url=S3_ENDPOINT_URL):
+        try:
+            import boto3
+        except ImportError:
+            raise ImportError("S3 replication needs boto3: pip install boto3")
+        self.client = boto3.client("s3", endpoint_url=endpoint_url)
+        self.bucket = bucket
+        self.prefix = prefix.strip("/") or "ledger"
+        self.columns = list(columns)
+
+    def write(self, batch_id, rows):
+        sent = raw = 0
+        for session_id, session_rows in split_by_session(rows).items():
+            data, raw_size = encode_batch(session_rows, self.columns)
+            self.client.put_object(
+                Bucket=self.bucket,
+                Key=object_key(self.prefix, session_id, batch_id),
+                Body=data,
+                ContentType="text/csv",
+                ContentEncoding="gzip",
+            )
+            sent += len(data)
+            raw += raw_size
+        return sent, raw
+
+    def delete_session(self, session_id):
+        """Deletes a withdrawn session's objects."""
+        pages = self.client.get_paginator("list_objects_v2").paginate(
+            Bucket=self.bucket, Prefix=f"{self.prefix}/{session_id}/"
+        )
+        for page in pages:
+            keys = [{"Key": item["Key"]} for item in page.get("Contents", [])]
+            if keys:
+                # A page holds at most 1000 keys, delete_objects' limit
+                result = self.client.delete_objects(Bucket=self.bucket, Delete={"Objects": keys, "Quiet": True})
+                if result.get("Errors"):
+                    error = result["Errors"][0]
+                    raise RuntimeError(f"Could not delete {error.get('Key')}: {error.get('Message')}")
+
+
+class SheetsSink:
+    """
+    Appends each row to the Ledger worksheet of the Google Sheet its content pack
+    came from (routes: content_pack_hash -> sheet name). Delivery goes through the
+    Sheets outbox, which batches, rate-limits and deduplicates by ledger row.
+    Appended rows are not deleted; a withdrawal drops the session's queued rows
+    and is recorded in each sheet's Withdrawals worksheet instead.
+    """
+
+    def __init__(self, columns, routes):
+        self.columns = list(columns)
+        self.routes = routes
+
+    def write(self, batch_id, rows):
+        from src import outbox
+
+        box = outbox.get_outbox()
+        for row in rows:
+            sheet_name = self.routes.get(row.get("content_pack_hash"))
+            if sheet_name:
+                box.enqueue(
+                    sheet_name, LEDGER_WORKSHEET, self.columns,
+                    f"{row.get('session_id')}:{row.get('ledger_row_index')}",
+                    [row.get(c, "") for c in self.columns],
+                )
+        return 0, 0
+
+    def delete_session(self, session_id):
+        """Drops a withdrawn session's unsent rows and queues its tombstone for every routed sheet."""
+        from src import outbox
+
+        box = outbox.get_outbox()
+        # Sent rows keep their keys until purged; after that, every routed sheet gets the tombstone
+        sheet_names = box.sheets_for(f"{session_id}:") or sorted(set(self.routes.values()))
+        box.discard(f"{session_id}:")
+        withdrawn_at = datetime.now().isoformat()
+        for sheet_name in sheet_names:
+            box.enqueue(sheet_name, WITHDRAWALS_WORKSHEET, WITHDRAWALS_HEADER, f"withdrawn:{session_id}",
+                        [session_id, withdrawn_at])
+
+
+# --- Replicator ---
+
+class Replicator:
+    """
+    Ships ledger rows from a source to a sink in batches and checkpoints the
+    source cursor at the end of each pass (and every save_rows rows within one),
+    so a restart resumes close to where it stopped. Delivery is at-least-once:
+    a batch re-sent after a crash reuses its object key, and rows carry
+    (session_id, ledger_row_index) for deduplication. Sessions withdrawn since
+    the last pass are deleted from the sink before any rows are shipped.
+    """
+
+    def __init__(self, name, source, sink, state_path=None, batch_rows=REPLICATION_BATCH_ROWS,
+                 interval=REPLICATION_INTERVAL_SECONDS, save_rows=REPLICATION_SAVE_ROWS):
+        self.name = name
+        self.source = source
+        self.sink = sink
+        self.state_path = state_path or os.path.join(REPLICATION_STATE_DIR, f"replication_{name}.json")
+        self.batch_rows = batch_rows
+        self.interval = interval
+        self.save_rows = save_rows
+
+        state = {}
+        if os.path.exists(self.state_path):
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        self.cursor = state.get("cursor", {})
+        self.extra = state.get("extra", {})
+
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self.rows_replicated = 0
+        self.sessions_deleted = 0
+        self.batches = 0
+        self.bytes_raw = 0
+        self.bytes_sent = 0
+        self.behind_since = None
+        self.last_success_at = None
+        self.last_error = None
+
+    def save_state(self):
+        state = {"cursor": self.cursor, "extra": self.extra, "updated_at": datetime.now().isoformat()}
+        _atomic_write(self.state_path, json.dumps(state).encode("utf-8"))
+
+    def run_once(self):
+        """Replicates until caught up. Returns the number of rows shipped."""
+        shipped = unsaved = 0
+        moved = False
+        with self._lock:
+            self.source.scan()
+            if self.source.pending(self.cursor) and self.behind_since is None:
+                self.behind_since = time.time()
+            try:
+                session_ids, cursor = self.source.withdrawn(self.cursor)
+                for session_id in session_ids:
+                    self.sink.delete_session(session_id)
+                if session_ids:
+                    # Forgotten only once every delete succeeded; a failed one is retried next pass
+                    self.sessions_deleted += len(session_ids)
+                    self.cursor = cursor
+                    moved = True
+                while True:
+                    batch = self.source.read(self.cursor, self.batch_rows)
+                    if batch is None:
+                        break
+                    batch_id, rows, new_cursor = batch
+                    if rows:
+                        sent, raw = self.sink.write(batch_id, rows)
+                        self.bytes_sent += sent
+                        self.bytes_raw += raw
+                        self.batches += 1
+                        shipped += len(rows)
+                        unsaved += len(rows)
+                    self.cursor = new_cursor
+                    moved = True
+                    if unsaved >= self.save_rows:
+                        self.save_state()
+                        unsaved, moved = 0, False
+            finally:
+                # Acknowledged batches are kept even if a later one fails
+                self.rows_replicated += shipped
+                if moved:
+                    self.save_state()
+            self.last_success_at = time.time()
+            # Rows written during the pass are still behind; the clock runs until a pass catches up
+            self.source.scan()
+            if not self.source.pending(self.cursor):
+                self.behind_since = None
+        return shipped
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=f"step-replication-{self.name}", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                self.run_once()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = f"{type(e).__name__}: {e}"
+                print(f"Replication to {self.name} failed: {self.last_error}")
+            self._stopped.wait(self.interval)
+
+    def stop(self, final_pass=True):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=30)
+        if final_pass:
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"Final replication pass to {self.name} failed: {e}")
+
+    def metrics(self):
+        pending = self.source.pending(self.cursor)
+        if pending and self.behind_since is None:
+            self.behind_since = time.time()
+        return {
+            "sink": self.name,
+            "rows_replicated": self.rows_replicated,
+            "sessions_deleted": self.sessions_deleted,
+            "batches": self.batches,
+            "pending": pending,
+            "pending_unit": "bytes" if isinstance(self.source, FileLedgerSource) else "rows",
+            # Age of the oldest unreplicated data: since pending was first seen non-zero
+            "lag_seconds": round(time.time() - self.behind_since, 1) if pending and self.behind_since else 0.0,
+            "compression_ratio": round(self.bytes_raw / self.bytes_sent, 1) if self.bytes_sent else None,
+            "last_success_at": datetime.fromtimestamp(self.last_success_at).isoformat() if self.last_success_at else None,
+            "last_error": self.last_error,
+        }
+
+
+def create_source(columns):
+    from src import storage
+
+    if storage.STORAGE_BACKEND == "sqlite":
+        return SQLiteLedgerSource(storage.SQLITE_PATH, columns)
+    return FileLedgerSource()
+
+
+def create_target_sink(target, columns):
+    """Sink for a STEP_REPLICATION_TARGET value."""
+    if target.startswith("dir:"):
+        return DirectorySink(target[len("dir:"):], columns)
+    if target.startswith("s3://"):
+        bucket, _, prefix = target[len("s3://"):].partition("/")
+        return S3Sink(bucket, prefix, columns)
+    raise ValueError(f"Unknown replication target: {target}")
+
+
+class ReplicationService:
+    """The replicators of one server process: the configured target and Mode C's sheets."""
+
+    def __init__(self, columns, target=REPLICATION_TARGET):
+        self.columns = list(columns)
+        self.replicators = {}
+        if target:
+            replicator = Replicator("target", create_source(self.columns), create_target_sink(target, self.columns))
+            replicator.start()
+            self.replicators["target"] = replicator
+
+        # Mode C rows left unsent by a previous run still go to their sheets
+        if os.path.exists(os.path.join(REPLICATION_STATE_DIR, "replication_sheets.json")):
+            self._sheets_replicator()
+
+    def _sheets_replicator(self):
+        replicator = self.replicators.get("sheets")
+        if replicator is None:
+            replicator = Replicator("sheets", create_source(self.columns), SheetsSink(self.columns, {}))
+            # Routes are persisted with the cursor, so rows written before a restart still find their sheet
+            replicator.sink.routes = replicator.extra.setdefault("routes", {})
+            self.replicators["sheets"] = replicator
+            if replicator.sink.routes:
+                replicator.start()
+        return replicator
+
+    def route_to_sheet(self, content_hash, sheet_name):
+        """Replicates rows of content_hash's sessions to sheet_name's Ledger worksheet."""
+        replicator = self._sheets_replicator()
+        if replicator.sink.routes.get(content_hash) != sheet_name:
+            with replicator._lock:
+                replicator.sink.routes[content_hash] = sheet_name
+                replicator.save_state()
+        # Started only once a route exists, so no rows are skipped for want of one
+        replicator.start()
+
+    def metrics(self):
+        return [r.metrics() for r in self.replicators.values()]
+
+    def stop(self):
+        for replicator in self.replicators.values():
+            replicator.stop()
+
+
+@st.cache_resource
+def get_replication(_columns):
+    """Returns the process-wide replication service."""
+    service = ReplicationService(_columns)
+    _services.append(service)
+    return service
+
+
+def stop_all():
+    """Runs a final pass and stops replication (interpreter exit)."""
+    while _services:
+        _services.pop().stop()
@@ -0,0 +1,244 @@
+import numpy as np
+import pandas as pd
+from src.engine import (
+    DEVIATION_LEVELS, OUTCOME_LEVELS, OUTCOME_NA_TAGS, gold_standard_column,
+)
+from src.pack_index import ContentPackIndex
+from src.storage import list_ledger_files
+
+SCORED_EVENTS = ("reveal", "decision")
+
+# Columns of an encounter row that re-scoring recomputes, in ledger order
+ENCOUNTER_SCORE_COLUMNS = [
+    "Time_to_First_Action", "Time_to_Tag", "Time_to_Hemorrhage_Ctrl", "Time_to_Airway_Ctrl",
+    "Dwell_rr", "Dwell_pulse_rad", "Dwell_Measurable", "Seq_Error_Count", "Seq_Error_Measurable",
+    "LSI_Applicable", "Required_LSI", "Missed_LSI_Flag", "Missing_LSI_List", "Error_Class",
+]
+
+
+def load_ledgers(directory="data_out", record_types=("event", "encounter")):
+    """Rows of the given record types from every ledger CSV in directory, as the strings written."""
+    frames = []
+    for path in list_ledger_files(directory):
+        df = pd.read_csv(path, dtype=str, keep_default_na=False)
+        frames.append(df[df["record_type"].isin(record_types)])
+    if not frames:
+        return pd.DataFrame(columns=["session_id", "ledger_row_index", "record_type"])
+    return pd.concat(frames, ignore_index=True)
+
+
+def _ledger_strings(values):
+    """Vectorised safe_str: how append_ledger_row writes each value."""
+    s = pd.Series(values)
+    if pd.api.types.is_float_dtype(s) or pd.api.types.is_integer_dtype(s):
+        s = s.astype("Int64")
+    out = s.astype(object).where(s.notna(), "").map(str)
+    return out.where(~out.str.strip().isin(["NA", "nan"]), "")
+
+
+def split_encounters(events):
+    """
+    Scored events (reveals and decisions) in ledger order, each labelled with its
+    encounter number. As live, an encounter is the events since the last decision
+    or patient change, up to its decision; reveals abandoned with "Go Back" have
+    no decision and are dropped.
+    """
+    ev = events[events["event_type"].isin(SCORED_EVENTS)].copy()
+    ev["_row"] = pd.to_numeric(ev["ledger_row_index"])
+    ev["_t"] = pd.to_numeric(ev["t_real_ms"])
+    ev = ev.sort_values(["session_id", "_row"], kind="stable").reset_index(drop=True)
+    if ev.empty:
+        ev["encounter"] = pd.Series(dtype=int)
+        return ev
+
+    session = ev["session_id"].to_numpy()
+    patient = ev["patient_id"].to_numpy()
+    is_decision = (ev["event_type"] == "decision").to_numpy()
+    starts = np.ones(len(ev), dtype=bool)
+    starts[1:] = (session[1:] != session[:-1]) | (patient[1:] != patient[:-1]) | is_decision[:-1]
+    encounter = np.cumsum(starts) - 1
+
+    decided = np.zeros(encounter[-1] + 1, dtype=bool)
+    decided[encounter[is_decision]] = True
+    keep = decided[encounter]
+    ev = ev[keep].reset_index(drop=True)
+    # Numbered 0..n-1 in ledger order
+    ev["encounter"] = np.unique(encounter[keep], return_inverse=True)[1]
+    return ev
+
+
+def _reference_tags(patients, encounters):
+    """Consensus reference per (patient_id, tool_id), as get_gold_standard reads it ("NA" when blank)."""
+    lookups = []
+    for tool_id in encounters["tool_id"].unique():
+        column = gold_standard_column(tool_id)
+        values = patients[column] if column in patients.columns else pd.Series(np.nan, index=patients.index)
+        lookups.append(pd.DataFrame({
+            "patient_id": patients["ID"].map(str),
+            "tool_id": tool_id,
+            "Reference_Tag": values.map(lambda v: str(v) if pd.notna(v) else "NA"),
+        }))
+    lookup = pd.concat(lookups, ignore_index=True).drop_duplicates(["patient_id", "tool_id"])
+    merged = encounters[["patient_id", "tool_id"]].merge(lookup, on=["patient_id", "tool_id"], how="left")
+    return merged["Reference_Tag"].fillna("NA").to_numpy()
+
+
+def outcome_classes(user_tags, reference_tags):
+    """evaluate_outcome_class over arrays of tags."""
+    user = pd.Series(user_tags, dtype=object)
+    reference = pd.Series(reference_tags, dtype=object)
+    diff = user.map(OUTCOME_LEVELS) - reference.map(OUTCOME_LEVELS)
+    classes = np.select(
+        [diff.isna(), diff == 0, diff == 1, diff >= 2, diff == -1, diff <= -2],
+        ["", "None", "Minor_Over", "Major_Over", "Minor_Under", "Critical_Under"],
+        default="",
+    )
+    na_black = user.isin(OUTCOME_NA_TAGS) | reference.isin(OUTCOME_NA_TAGS)
+    return np.where(na_black, "NA_Black", classes)
+
+
+def deviations(reference_tags, decisions, decisions_raw):
+    """
+    A decision row's deviation as log_event writes it: "" ungraded, "ERR" unmapped,
+    else the level gap. A button without a colour logs an empty tag but is still
+    graded (as "ERR"), which only its decision_raw label shows.
+    """
+    reference = pd.Series(reference_tags, dtype=object)
+    decision = pd.Series(decisions, dtype=object)
+    raw = pd.Series(decisions_raw, dtype=object)
+    gap = decision.map(DEVIATION_LEVELS) - reference.map(DEVIATION_LEVELS)
+    graded = (reference != "NA") & ((decision != "") | (raw != ""))
+    out = _ledger_strings(gap).where(gap.notna(), "ERR")
+    return out.where(graded, "").to_numpy()
+
+
+def _first_time(ev, action_key, n):
+    hits = ev[ev["action_key"] == action_key].groupby("encounter")["_t"].first()
+    return hits.reindex(range(n)).to_numpy()
+
+
+def rescore(events, content_pack):
+    """
+    Re-scores every encounter in a ledger's event rows against content_pack
+    (a prepared pack: references, LSI requirements and Config order columns).
+
+    Returns (encounters, decisions): one row per encounter with the encounter
+    row's scored columns plus User_Tag, Reference_Tag and the decision's
+    ledger_row_index, and each decision event's reference_tag_normalized and
+    deviation. Values are the strings the live app writes to the ledger.
+    """
+    ev = split_encounters(events)
+    n = int(ev["encounter"].max()) + 1 if not ev.empty else 0
+    index = ContentPackIndex(content_pack)
+    patients = content_pack["Patients"]
+
+    grouped = ev.groupby("encounter", sort=True)
+    decision_rows = ev[ev["event_type"] == "decision"].set_index("encounter").sort_index()
+    enc = pd.DataFrame({
+        "session_id": decision_rows["session_id"].to_numpy(),
+        "patient_id": decision_rows["patient_id"].to_numpy(),
+        "tool_id": decision_rows["tool_id"].to_numpy(),
+        "decision_row_index": decision_rows["ledger_row_index"].to_numpy(),
+        "User_Tag": decision_rows["user_tag_normalized"].to_numpy(),
+        "_decision_raw": decision_rows["decision_raw"].to_numpy(),
+    })
+
+    # Timings
+    enc["Time_to_First_Action"] = grouped["_t"].first().to_numpy()
+    enc["Time_to_Tag"] = decision_rows["_t"].to_numpy()
+    enc["Time_to_Hemorrhage_Ctrl"] = _first_time(ev, "hemorrhage_ctrl", n)
+    enc["Time_to_Airway_Ctrl"] = _first_time(ev, "airway_man", n)
+
+    # Dwell: time from the first rr / pulse_rad to the next event of the encounter
+    next_t = grouped["_t"].shift(-1)
+    first_of_key = ev.groupby(["encounter", "action_key"]).cumcount() == 0
+    dwell_measurable = np.ones(n, dtype=bool)
+    for action_key, column in [("rr", "Dwell_rr"), ("pulse_rad", "Dwell_pulse_rad")]:
+        first = first_of_key & (ev["action_key"] == action_key)
+        dwell = (next_t - ev["_t"])[first]
+        enc[column] = pd.Series(dwell.to_numpy(), index=ev.loc[first, "encounter"]).reindex(range(n)).to_numpy()
+        unmeasured = ev.loc[first & next_t.isna(), "encounter"].to_numpy()
+        dwell_measurable[unmeasured] = False
+    enc["Dwell_Measurable"] = dwell_measurable
+
+    # Sequence errors: a protocol step taken after a later step had already been taken
+    orders = pd.DataFrame(
+        [(tool_id, key, order) for tool_id in index.tool_ids
+         for key, order in (index.order_map(tool_id) or {}).items()],
+        columns=["tool_id", "action_key", "_order"],
+    )
+    order = ev[["tool_id", "action_key"]].merge(orders, on=["tool_id", "action_key"], how="left")["_order"]
+    order = order.fillna(0).clip(lower=0).to_numpy()
+    seen = pd.Series(order).groupby(ev["encounter"]).cummax()
+    seen_before = seen.groupby(ev["encounter"]).shift(1).fillna(0).to_numpy()
+    errors = pd.Series((order > 0) & (order < seen_before)).groupby(ev["encounter"]).sum()
+    has_order = enc["tool_id"].map(lambda t: index.order_map(t) is not None).to_numpy(dtype=bool)
+    enc["Seq_Error_Count"] = np.where(has_order, errors.reindex(range(n), fill_value=0).to_numpy(), np.nan)
+    enc["Seq_Error_Measurable"] = has_order
+
+    # Outcome against the (possibly revised) reference
+    enc["Reference_Tag"] = _reference_tags(patients, enc) if n else []
+    enc["Error_Class"] = outcome_classes(enc["User_Tag"], enc["Reference_Tag"])
+
+    # Life-saving interventions required for Red patients
+    lsi = pd.DataFrame({
+        "patient_id": patients["ID"].map(str),
+        "LSI_Applicable": patients.get("LSI_Applicable", pd.Series(False, index=patients.index)).map(
+            lambda v: str(v).strip().upper() == "TRUE" or v is True),
+        "Required_LSI": patients.get("Required_LSI", pd.Series(np.nan, index=patients.index)),
+    }).drop_duplicates("patient_id")
+    enc = enc.merge(lsi, on="patient_id", how="left")
+    enc["LSI_Applicable"] = enc["LSI_Applicable"].fillna(False).astype(bool)
+    graded = enc["LSI_Applicable"] & (enc["User_Tag"] == "Red")
+
+    required = enc.loc[graded, ["Required_LSI"]].dropna()
+    required = required["Required_LSI"].map(
+        lambda raw: [k.strip().lower() for k in str(raw).split(",") if k.strip()]).explode().dropna()
+    required = required.rename("key").rename_axis("encounter").reset_index()
+    clicked = pd.DataFrame({"encounter": ev["encounter"], "key": ev["action_key"].str.lower()})
+    clicked = clicked[ev["action_key"] != ""].drop_duplicates()
+    missing = required.merge(clicked, on=["encounter", "key"], how="left", indicator=True)
+    missing = missing[missing["_merge"] == "left_only"]
+    missing_list = missing.groupby("encounter", sort=True)["key"].agg(",".join)
+
+    enc["Missing_LSI_List"] = missing_list.reindex(range(n), fill_value="").to_numpy()
+    enc["Missed_LSI_Flag"] = np.where(graded, np.where(enc["Missing_LSI_List"] != "", "True", "False"), "")
+
+    for column in ENCOUNTER_SCORE_COLUMNS:
+        enc[column] = _ledger_strings(enc[column]).to_numpy()
+
+    decisions = pd.DataFrame({
+        "session_id": enc["session_id"],
+        "ledger_row_index": enc["decision_row_index"],
+        "reference_tag_normalized": _ledger_strings(enc["Reference_Tag"]).to_numpy(),
+        "deviation": deviations(enc["Reference_Tag"], enc["User_Tag"], enc["_decision_raw"]),
+    })
+    columns = ["session_id", "patient_id", "tool_id", "decision_row_index"] + ENCOUNTER_SCORE_COLUMNS + [
+        "User_Tag", "Reference_Tag"]
+    return enc[columns], decisions
+
+
+def compare_with_recorded(encounters, recorded):
+    """
+    Re-scored encounters next to the encounter rows the app wrote (each follows
+    its decision row in the ledger). Returns a frame of changes: session_id,
+    patient_id, column, recorded, rescored.
+    """
+    recorded = recorded[recorded["record_type"] == "encounter"].copy()
+    recorded["decision_row_index"] = (pd.to_numeric(recorded["ledger_row_index"]) - 1).map(str)
+    joined = encounters.merge(recorded, on=["session_id", "decision_row_index"], suffixes=("", "_recorded"))
+    changes = []
+    for column in ENCOUNTER_SCORE_COLUMNS:
+        if f"{column}_recorded" not in joined.columns:
+            continue
+        differs = joined[column] != joined[f"{column}_recorded"]
+        changes.append(pd.DataFrame({
+            "session_id": joined.loc[differs, "session_id"],
+            "patient_id": joined.loc[differs, "patient_id"],
+            "column": column,
+            "recorded": joined.loc[differs, f"{column}_recorded"],
+            "rescored": joined.loc[differs, column],
+        }))
+    if not changes:
+        return pd.DataFrame(columns=["session_id", "patient_id", "column", "recorded", "rescored"])
+    return pd.concat(changes, ignore_index=True)
@@ -0,0 +1,108 @@
+import os
+import io
+import csv
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+def _lock_file(f):
+    """Blocks until this process holds the exclusive lock on f."""
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+
+def _unlock_file(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class SessionIndex:
+    """
+    session_index.csv shared by every worker thread and server process.
+    Appends hold an exclusive file lock, so the header check and the row write
+    cannot race. Lookups use an in-memory index that is topped up from the byte
+    offset already read, so rows appended by other processes are picked up
+    without re-scanning the file.
+    """
+
+    def __init__(self, path, columns):
+        self.path = path
+        self.columns = list(columns)
+        self._lock = threading.Lock()
+        self._offset = 0
+        self._file_columns = None
+        self._by_session = {}
+        self._by_code = {}
+
+    def append(self, idx_row):
+        dirname = os.path.dirname(self.path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        with self._lock:
+            with open(self.path, "a+", newline="", encoding="utf-8") as f:
+                _lock_file(f)
+                try:
+                    f.seek(0, os.SEEK_END)
+                    writer = csv.DictWriter(f, fieldnames=self.columns)
+                    if f.tell() == 0:
+                        writer.writeheader()
+                    writer.writerow(idx_row)
+                    f.flush()
+                    os.fsync(f.fileno())
+                finally:
+                    _unlock_file(f)
+            self._refresh_locked()
+
+    def get(self, session_id):
+        """Latest index row for session_id, or None."""
+        with self._lock:
+            self._refresh_locked()
+            return self._by_session.get(session_id)
+
+    def find_by_completion_code(self, completion_code):
+        """Index row for a participant's completion code, or None."""
+        with self._lock:
+            self._refresh_locked()
+            return self._by_code.get(str(completion_code).strip())
+
+    def _refresh_locked(self):
+        if not os.path.exists(self.path):
+            return
+        size = os.path.getsize(self.path)
+        if size < self._offset:
+            # File was replaced or truncated; rebuild from scratch
+            self._offset = 0
+            self._file_columns = None
+            self._by_session = {}
+            self._by_code = {}
+        if size == self._offset:
+            return
+
+        with open(self.path, "rb") as f:
+            f.seek(self._offset)
+            chunk = f.read(size - self._offset)
+        # Only consume complete lines; a concurrent append may be mid-write
+        end = chunk.rfind(b"\n")
+        if end < 0:
+            return
+        self._offset += end + 1
+
+        reader = csv.reader(io.StringIO(chunk[:end + 1].decode("utf-8"), newline=""))
+        for values in reader:
+            if self._file_columns is None:
+                self._file_columns = values
+                continue
+            row = dict(zip(self._file_columns, values))
+            self._by_session[row.get("session_id")] = row
+            if row.get("completion_code"):
+                self._by_code[row["completion_code"]] = row
@@ -0,0 +1,375 @@
+import streamlit as st
+import os
+import re
+import json
+import glob
+import time
+import sqlite3
+import threading
+from datetime import datetime
+from src import checkpoint
+from src.session_index import SessionIndex
+from src.ledger import FlushTicker, LedgerRegistry, LEDGER_DURABILITY, LEDGER_FLUSH_ROWS, LEDGER_FLUSH_SECONDS
+
+# "files": per-session CSV ledgers and JSON checkpoints in data_out/ (default)
+# "sqlite": one WAL-mode database holding ledgers, checkpoints and the session index
+STORAGE_BACKEND = os.environ.get("STEP_STORAGE_BACKEND", "files")
+SQLITE_PATH = os.environ.get("STEP_SQLITE_PATH", os.path.join("data_out", "step.sqlite3"))
+# Files backend: also write each ledger as typed columns, one table per record type (src/columnar.py)
+LEDGER_COLUMNAR = os.environ.get("STEP_LEDGER_COLUMNAR", "0") == "1"
+SESSION_INDEX_PATH = os.path.join("data_out", "session_index.csv")
+# Per-session ledger CSVs are data_out/logs_{session_id}_{timestamp}.csv; sessions
+# started before the name was unified wrote session_{session_id}_{timestamp}.csv
+LEDGER_FILE_RE = re.compile(r"^(logs|session)_[0-9a-f-]{36}_\d{8}_\d{6}\.csv$")
+
+SESSION_INDEX_COLUMNS = [
+    "timestamp_utc", "session_id", "completion_code", "participant_role", "fatigue_status",
+    "prior_triage_training", "app_version", "schema_version", "content_pack_hash",
+    "n_real_encounters", "critical_under_rate",
+]
+
+
+def ledger_filepath(session_id, timestamp):
+    """The ledger CSV a session writes (also its ledger_path in the SQLite store)."""
+    return f"data_out/logs_{session_id}_{timestamp}.csv"
+
+
+def list_ledger_files(directory="data_out"):
+    """Every per-session ledger CSV in directory, under either name, in name order."""
+    return [p for p in sorted(glob.glob(os.path.join(directory, "*.csv")))
+            if LEDGER_FILE_RE.match(os.path.basename(p))]
+
+
+class SessionStore:
+    """
+    Storage behind the session ledger, checkpoints and session index.
+    Every method may be called from write-behind worker threads.
+    """
+
+    def append_ledger_row(self, ledger_path, row):
+        raise NotImplementedError
+
+    def flush_ledger(self, ledger_path):
+        raise NotImplementedError
+
+    def close_ledger(self, ledger_path):
+        raise NotImplementedError
+
+    def delete_ledger(self, ledger_path, session_id):
+        raise NotImplementedError
+
+    def persist_checkpoint(self, session_id, ops):
+        """Applies checkpoint.prepare() output."""
+        raise NotImplementedError
+
+    def load_checkpoint(self, session_id):
+        raise NotImplementedError
+
+    def delete_checkpoint(self, session_id):
+        raise NotImplementedError
+
+    def append_session_index(self, idx_row):
+        raise NotImplementedError
+
+    def lookup_session(self, session_id):
+        """Session index row for session_id, or None."""
+        raise NotImplementedError
+
+    def find_completion_code(self, completion_code):
+        """Session index row for a completion code, or None."""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class FileStore(SessionStore):
+    """The original data_out/ layout: one CSV ledger and one checkpoint per session."""
+
+    def __init__(self, ledger_columns, columnar=None):
+        self.ledger = LedgerRegistry(ledger_columns)
+        self.session_index = SessionIndex(SESSION_INDEX_PATH, SESSION_INDEX_COLUMNS)
+        # Typed columnar copy of the ledgers (src/columnar.py); the CSVs stay the record of truth
+        self.columnar = columnar
+        if columnar is None and LEDGER_COLUMNAR:
+            from src.columnar import ColumnarLedger
+
+            self.columnar = ColumnarLedger(ledger_columns)
+
+    def append_ledger_row(self, ledger_path, row):
+        self.ledger.get(ledger_path).append(row)
+        if self.columnar:
+            self.columnar.append(row)
+
+    def flush_ledger(self, ledger_path):
+        self.ledger.flush(ledger_path)
+        if self.columnar:
+            self.columnar.flush()
+
+    def close_ledger(self, ledger_path):
+        self.ledger.close(ledger_path)
+        if self.columnar:
+            self.columnar.flush()
+
+    def delete_ledger(self, ledger_path, session_id):
+        self.ledger.close(ledger_path)
+        if os.path.exists(ledger_path):
+            os.remove(ledger_path)
+        if self.columnar:
+            self.columnar.delete_session(session_id)
+
+    def persist_checkpoint(self, session_id, ops):
+        checkpoint.persist(session_id, ops)
+
+    def load_checkpoint(self, session_id):
+        return checkpoint.load(session_id)
+
+    def delete_checkpoint(self, session_id):
+        checkpoint.delete(session_id)
+
+    def append_session_index(self, idx_row):
+        self.session_index.append(idx_row)
+
+    def lookup_session(self, session_id):
+        return self.session_index.get(session_id)
+
+    def find_completion_code(self, completion_code):
+        return self.session_index.find_by_completion_code(completion_code)
+
+    def close(self):
+        self.ledger.close_all()
+        if self.columnar:
+            self.columnar.close_all()
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+class SQLiteStore(SessionStore):
+    """
+    Single-file store in WAL mode. Ledger rows from all sessions share one
+    pending batch, so a phase-boundary flush commits every session's rows in
+    one transaction.
+    """
+
+    def __init__(self, ledger_columns, path=SQLITE_PATH):
+        self.ledger_columns = list(ledger_columns)
+        self.path = path
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._pending = []
+        self._oldest_pending = None
+        self._ticker = None
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "PRAGMA synchronous=" + ("FULL" if LEDGER_DURABILITY == "group_commit" else "NORMAL")
+        )
+        self._create_schema()
+
+        cols = ["ledger_path"] + self.ledger_columns
+        self._insert_ledger_sql = (
+            f"INSERT OR IGNORE INTO ledger ({', '.join(_quote(c) for c in cols)}) "
+            f"VALUES ({', '.join('?' for _ in cols)})"
+        )
+
+    def _create_schema(self):
+        ledger_cols = ", ".join(f"{_quote(c)} TEXT" for c in self.ledger_columns)
+        index_cols = ", ".join(f"{_quote(c)} TEXT" for c in SESSION_INDEX_COLUMNS)
+        with self._conn:
+            self._conn.execute(
+                f"CREATE TABLE IF NOT EXISTS ledger (row_id INTEGER PRIMARY KEY, ledger_path TEXT, {ledger_cols})"
+            )
+            # Columns added to LEDGER_COLUMNS since the database was created
+            existing = {row[1] for row in self._conn.execute("PRAGMA table_info(ledger)")}
+            for column in self.ledger_columns:
+                if column not in existing:
+                    self._conn.execute(f"ALTER TABLE ledger ADD COLUMN {_quote(column)} TEXT")
+            self._conn.execute(
+                "CREATE UNIQUE INDEX IF NOT EXISTS ledger_session_row ON ledger (session_id, ledger_row_index)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS ledger_record_type ON ledger (record_type)")
+            # Withdrawn sessions, in order, so replicas can delete rows they already hold
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS withdrawal (id INTEGER PRIMARY KEY, session_id TEXT, withdrawn_at TEXT)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS checkpoint_snapshot "
+                "(session_id TEXT PRIMARY KEY, snapshot TEXT, updated_at TEXT)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS checkpoint_journal "
+                "(record_id INTEGER PRIMARY KEY, session_id TEXT, record TEXT)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS checkpoint_journal_session ON checkpoint_journal (session_id)"
+            )
+            self._conn.execute(
+                f"CREATE TABLE IF NOT EXISTS session_index (row_id INTEGER PRIMARY KEY, {index_cols})"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS session_index_session ON session_index (session_id)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS session_index_code ON session_index (completion_code)"
+            )
+
+    def _ledger_values(self, ledger_path, row):
+        return [ledger_path] + [row.get(c, "") for c in self.ledger_columns]
+
+    def append_ledger_row(self, ledger_path, row):
+        with self._lock:
+            if not self._pending:
+                self._oldest_pending = time.monotonic()
+            self._pending.append(self._ledger_values(ledger_path, row))
+            if len(self._pending) >= LEDGER_FLUSH_ROWS or self._is_stale():
+                self._flush_locked()
+            if self._ticker is None:
+                self._ticker = FlushTicker(self.flush_stale)
+
+    def _is_stale(self):
+        return bool(self._pending) and (time.monotonic() - self._oldest_pending) >= LEDGER_FLUSH_SECONDS
+
+    def flush_stale(self):
+        """Commits the pending batch once it is old enough, if no append has (run by the ticker)."""
+        with self._lock:
+            if self._is_stale():
+                self._flush_locked()
+
+    def insert_ledger_rows(self, ledger_path, rows):
+        """Bulk insert used by the migration tool; duplicates are ignored."""
+        with self._lock:
+            with self._conn:
+                self._conn.executemany(
+                    self._insert_ledger_sql, [self._ledger_values(ledger_path, r) for r in rows]
+                )
+
+    def flush_ledger(self, ledger_path):
+        with self._lock:
+            self._flush_locked()
+
+    def close_ledger(self, ledger_path):
+        self.flush_ledger(ledger_path)
+
+    def delete_ledger(self, ledger_path, session_id):
+        with self._lock:
+            self._flush_locked()
+            with self._conn:
+                self._conn.execute("DELETE FROM ledger WHERE session_id = ?", (session_id,))
+                self._conn.execute(
+                    "INSERT INTO withdrawal (session_id, withdrawn_at) VALUES (?, ?)",
+                    (session_id, datetime.now().isoformat()),
+                )
+
+    def _flush_locked(self):
+        if not self._pending:
+            return
+        with self._conn:
+            self._conn.executemany(self._insert_ledger_sql, self._pending)
+        self._pending = []
+        self._oldest_pending = None
+
+    def persist_checkpoint(self, session_id, ops):
+        if not ops:
+            return
+        now = datetime.now().isoformat()
+        with self._lock:
+            with self._conn:
+                for kind, text in ops:
+                    if kind == "snapshot":
+                        self._conn.execute(
+                            "INSERT OR REPLACE INTO checkpoint_snapshot (session_id, snapshot, updated_at) VALUES (?, ?, ?)",
+                            (session_id, text, now),
+                        )
+                        self._conn.execute("DELETE FROM checkpoint_journal WHERE session_id = ?", (session_id,))
+                    else:
+                        self._conn.execute(
+                            "INSERT INTO checkpoint_journal (session_id, record) VALUES (?, ?)",
+                            (session_id, text),
+                        )
+
+    def load_checkpoint(self, session_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT snapshot FROM checkpoint_snapshot WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            records = self._conn.execute(
+                "SELECT record FROM checkpoint_journal WHERE session_id = ? ORDER BY record_id", (session_id,)
+            ).fetchall()
+        return checkpoint.replay(json.loads(row[0]), (json.loads(r[0]) for r in records))
+
+    def delete_checkpoint(self, session_id):
+        with self._lock:
+            with self._conn:
+                self._conn.execute("DELETE FROM checkpoint_snapshot WHERE session_id = ?", (session_id,))
+                self._conn.execute("DELETE FROM checkpoint_journal WHERE session_id = ?", (session_id,))
+
+    def append_session_index(self, idx_row):
+        cols = ", ".join(_quote(c) for c in SESSION_INDEX_COLUMNS)
+        marks = ", ".join("?" for _ in SESSION_INDEX_COLUMNS)
+        with self._lock:
+            with self._conn:
+                self._conn.execute(
+                    f"INSERT INTO session_index ({cols}) VALUES ({marks})",
+                    [idx_row.get(c, "") for c in SESSION_INDEX_COLUMNS],
+                )
+
+    def _session_index_row(self, column, value):
+        cols = ", ".join(_quote(c) for c in SESSION_INDEX_COLUMNS)
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {cols} FROM session_index WHERE {_quote(column)} = ? ORDER BY row_id DESC LIMIT 1",
+                (value,),
+            ).fetchone()
+        return dict(zip(SESSION_INDEX_COLUMNS, row)) if row else None
+
+    def lookup_session(self, session_id):
+        return self._session_index_row("session_id", session_id)
+
+    def find_completion_code(self, completion_code):
+        return self._session_index_row("completion_code", str(completion_code).strip())
+
+    def session_index_rows(self):
+        cols = ", ".join(_quote(c) for c in SESSION_INDEX_COLUMNS)
+        with self._lock:
+            rows = self._conn.execute(f"SELECT {cols} FROM session_index ORDER BY row_id").fetchall()
+        return [dict(zip(SESSION_INDEX_COLUMNS, r)) for r in rows]
+
+    def close(self):
+        if self._ticker is not None:
+            self._ticker.stop()
+        with self._lock:
+            self._flush_locked()
+            self._conn.close()
+
+
+def create_store(ledger_columns, backend=None):
+    backend = backend or STORAGE_BACKEND
+    if backend == "files":
+        return FileStore(ledger_columns)
+    if backend == "sqlite":
+        return SQLiteStore(ledger_columns)
+    raise ValueError(f"Unknown storage backend: {backend}")
+
+
+_stores = []
+
+
+@st.cache_resource
+def get_store(_ledger_columns):
+    """Returns the process-wide session store selected by STEP_STORAGE_BACKEND."""
+    store = create_store(_ledger_columns)
+    _stores.append(store)
+    return store
+
+
+def close_stores():
+    """Closes the process-wide store, if this process opened one."""
+    while _stores:
+        _stores.pop().close()
@@ -0,0 +1,85 @@
+import streamlit as st
+import os
+import time
+import uuid
+from datetime import datetime
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+# perf_counter readings only compare within one process, so anchors carry this ID;
+# a session resumed in another process falls back to the wall clock
+PROCESS_CLOCK_ID = uuid.uuid4().hex[:12]
+
+# Set STEP_CLIENT_TIMING=1 to also record browser-side click timings (one extra rerun per patient card)
+CLIENT_TIMING_ENABLED = os.environ.get("STEP_CLIENT_TIMING", "0") == "1"
+CLICK_TIMER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "frontend", "click_timer")
+
+_click_timer_component = None
+
+
+def anchor():
+    """A point in time: a monotonic reading, plus the wall clock for use from another process."""
+    return {"ns": time.perf_counter_ns(), "clock": PROCESS_CLOCK_ID, "wall": datetime.now().isoformat()}
+
+
+def from_checkpoint(value):
+    """Anchor saved in a checkpoint (older checkpoints stored an ISO timestamp)."""
+    if not value:
+        return None
+    if isinstance(value, str):
+        return {"ns": None, "clock": None, "wall": value}
+    return value
+
+
+def elapsed_ms(start, end=None):
+    """Whole milliseconds from start to end (default now) and the clock used: "monotonic" or "wall"."""
+    if not start:
+        return 0, ""
+    end = end or anchor()
+    if start.get("ns") is not None and start.get("clock") == end["clock"]:
+        return (end["ns"] - start["ns"]) // 1_000_000, "monotonic"
+    delta = datetime.fromisoformat(end["wall"]) - datetime.fromisoformat(start["wall"])
+    return int(delta.total_seconds() * 1000), "wall"
+
+
+def mark_rerun():
+    """Anchors the start of this rerun (call first thing in the script)."""
+    st.session_state._rerun_anchor = anchor()
+
+
+def mark_fragment_rerun():
+    """
+    Anchors a fragment-only rerun (call first thing in a fragment): the script's
+    top level, and its mark_rerun, did not run. Full reruns keep their anchor.
+    """
+    ctx = get_script_run_ctx()
+    if ctx and ctx.fragment_ids_this_run:
+        mark_rerun()
+
+
+def server_latency_ms(now=None):
+    """
+    Server time between this rerun starting (the click reaching the script) and now.
+    Part of t_real_ms that is app latency, not participant time.
+    """
+    start = st.session_state.get("_rerun_anchor")
+    if not start:
+        return ""
+    ms, _ = elapsed_ms(start, now)
+    return ms
+
+
+def click_timer(card_key):
+    """
+    Browser-side click timing for the card on screen (card_key, or None when no
+    card is shown). Returns the report for the previous card once it arrives:
+    {"report": n, "card": key, "clicks": [{"key": widget_key, "t_client_ms": ms}, ...]},
+    where t_client_ms is performance.now() at the click minus when the card was painted.
+    """
+    global _click_timer_component
+    if not CLIENT_TIMING_ENABLED:
+        return None
+    if _click_timer_component is None:
+        import streamlit.components.v1 as components
+
+        _click_timer_component = components.declare_component("step_click_timer", path=CLICK_TIMER_DIR)
+    return _click_timer_component(card_key=card_key, key="step_click_timer", default=None)
@@ -1,8 +1,16 @@
 import pandas as pd
 import hashlib
 import os
+import glob
+import pickle
 import streamlit as st
 
+# Compiled content packs (validated + normalised DataFrames), keyed by SHA-256 of the source
+CONTENT_PACK_CACHE_DIR = os.path.join(".step_cache", "content_packs")
+# Bump when normalise_content_pack or the cached structure changes
+CONTENT_PACK_CACHE_VERSION = 1
+CONTENT_PACK_CACHE_MAX_ENTRIES = 8
+
 def calculate_hash(filepath):
     """Calculates SHA-256 hash of the file."""
     sha256_hash = hashlib.sha256()
@@ -12,6 +20,14 @@ def calculate_hash(filepath):
             sha256_hash.update(byte_block)
     return sha256_hash.hexdigest()
 
+def calculate_sheets_hash(sheets):
+    """SHA-256 of a content pack's data, for packs that do not come from a file."""
+    sha256_hash = hashlib.sha256()
+    for name in sorted(sheets):
+        sha256_hash.update(name.encode("utf-8"))
+        sha256_hash.update(sheets[name].to_csv(index=False).encode("utf-8"))
+    return sha256_hash.hexdigest()
+
 def load_content_pack(file_or_path):
     """Loads the Excel content pack into a dictionary of DataFrames."""
     if isinstance(file_or_path, str) and not os.path.exists(file_or_path):
@@ -55,3 +71,64 @@ def validate_content_pack(sheets):
         st.error(f"Patients tab missing columns. Required: {required_patient_cols}")
         st.stop()
     return True
+
+def normalise_content_pack(sheets):
+    """Coerces column types that differ between Excel and Google Sheets sources."""
+    # Defensively cast Is_Practice to boolean in case of string parsing (GSheets)
+    if "Patients" in sheets:
+        sheets["Patients"]["Is_Practice"] = sheets["Patients"].get("Is_Practice", False).apply(
+            lambda x: True if str(x).strip().upper() == "TRUE" or x is True else False
+        )
+    return sheets
+
+def prepare_content_pack(sheets):
+    """Validates and normalises a freshly loaded content pack."""
+    validate_content_pack(sheets)
+    return normalise_content_pack(sheets)
+
+def _content_pack_cache_path(content_hash):
+    return os.path.join(CONTENT_PACK_CACHE_DIR, f"{content_hash}.v{CONTENT_PACK_CACHE_VERSION}.pkl")
+
+def _prune_content_pack_cache():
+    entries = sorted(glob.glob(os.path.join(CONTENT_PACK_CACHE_DIR, "*.pkl")), key=os.path.getmtime, reverse=True)
+    for path in entries[CONTENT_PACK_CACHE_MAX_ENTRIES:]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def read_content_pack_cache(content_hash):
+    """The compiled pack for content_hash from the on-disk cache, or None."""
+    cache_path = _content_pack_cache_path(content_hash)
+    if os.path.exists(cache_path):
+        try:
+            with open(cache_path, "rb") as f:
+                return pickle.load(f)
+        except Exception as e:
+            # Corrupt or incompatible cache entry: fall back to the source
+            print(f"Ignoring content pack cache {cache_path}: {e}")
+    return None
+
+def write_content_pack_cache(content_hash, sheets):
+    """Stores a compiled pack in the on-disk cache (best effort); returns sheets."""
+    cache_path = _content_pack_cache_path(content_hash)
+    try:
+        os.makedirs(CONTENT_PACK_CACHE_DIR, exist_ok=True)
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(sheets, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+        _prune_content_pack_cache()
+    except OSError as e:
+        print(f"Could not write content pack cache: {e}")
+    return sheets
+
+def load_content_pack_cached(file_or_path, content_hash):
+    """
+    Loads a validated, normalised content pack, parsing the workbook only on a cache miss.
+    The cache is keyed by the file's SHA-256, so an edited pack is a miss and is recompiled.
+    """
+    sheets = read_content_pack_cache(content_hash)
+    if sheets is None:
+        sheets = write_content_pack_cache(content_hash, prepare_content_pack(load_content_pack(file_or_path)))
+    return sheets
@@ -0,0 +1,218 @@
+import streamlit as st
+import os
+import time
+import zlib
+import queue
+import threading
+from collections import deque
+
+# Set STEP_WRITE_BEHIND=0 to persist synchronously on the UI thread (debugging)
+WRITE_BEHIND_ENABLED = os.environ.get("STEP_WRITE_BEHIND", "1") != "0"
+WRITE_BEHIND_WORKERS = 4
+WRITE_BEHIND_QUEUE_SIZE = 1000
+LATENCY_SAMPLES = 1000
+# A failed write is retried after each of these delays (seconds) before it counts as failed
+WRITE_BEHIND_RETRY_DELAYS = (0.1, 0.5, 2.0)
+
+_STOP = object()
+_pools = []
+
+
+class WriteBehindError(RuntimeError):
+    """Background writes that still failed after their retries; their data was not persisted."""
+
+    def __init__(self, failures):
+        self.failures = failures
+        details = "; ".join(f"{name} ({key}): {error}" for key, name, error in failures)
+        super().__init__(f"{len(failures)} background write(s) failed: {details}")
+
+
+def _percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    idx = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[idx]
+
+
+class WriteBehind:
+    """
+    Persists ledger rows and checkpoints off the UI thread.
+    Each key (usually a session_id) is pinned to one worker, so writes for the
+    same session run in submission order. Queues are bounded: when a worker
+    falls behind, submit() blocks the caller instead of dropping writes.
+    A write that raises is retried with backoff (holding back the writes
+    queued behind it); if it still fails, the failure is kept and raised by
+    the key's next check(), sync() or by drain().
+    """
+
+    def __init__(self, n_workers=WRITE_BEHIND_WORKERS, maxsize=WRITE_BEHIND_QUEUE_SIZE,
+                 retry_delays=WRITE_BEHIND_RETRY_DELAYS):
+        self.retry_delays = retry_delays
+        self._failures = {}
+        self._queues = [queue.Queue(maxsize=maxsize) for _ in range(n_workers)]
+        self._threads = []
+        self._stopped = False
+
+        self._metrics_lock = threading.Lock()
+        self._enqueued = 0
+        self._completed = 0
+        self._failed = 0
+        self._blocked_submits = 0
+        self._max_depth = 0
+        self._write_ms = deque(maxlen=LATENCY_SAMPLES)
+        self._queue_ms = deque(maxlen=LATENCY_SAMPLES)
+
+        for i, q in enumerate(self._queues):
+            t = threading.Thread(target=self._run, args=(q,), name=f"step-write-behind-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def _queue_for(self, key):
+        return self._queues[zlib.crc32(str(key).encode("utf-8")) % len(self._queues)]
+
+    def submit(self, key, fn, *args):
+        """Queues fn(*args) behind all earlier work submitted under the same key."""
+        if self._stopped:
+            fn(*args)
+            return
+
+        q = self._queue_for(key)
+        item = (time.perf_counter(), key, fn, args)
+        try:
+            q.put_nowait(item)
+        except queue.Full:
+            # Backpressure: wait for the worker rather than reorder or drop writes
+            with self._metrics_lock:
+                self._blocked_submits += 1
+            q.put(item)
+
+        with self._metrics_lock:
+            self._enqueued += 1
+            self._max_depth = max(self._max_depth, q.qsize())
+
+    def check(self, key):
+        """Raises WriteBehindError for writes under key that have failed (each failure is raised once)."""
+        with self._metrics_lock:
+            failures = self._failures.pop(key, None)
+        if failures:
+            raise WriteBehindError(failures)
+
+    def sync(self, key, timeout=None):
+        """Blocks until everything submitted under key has been written; raises if any of it failed."""
+        done = threading.Event()
+        self.submit(key, done.set)
+        finished = done.wait(timeout)
+        self.check(key)
+        return finished
+
+    def drain(self):
+        """Blocks until every queue is empty; raises for every write that failed."""
+        for q in self._queues:
+            q.join()
+        with self._metrics_lock:
+            failures = [f for key_failures in self._failures.values() for f in key_failures]
+            self._failures = {}
+        if failures:
+            raise WriteBehindError(failures)
+
+    def shutdown(self):
+        """Drains outstanding writes and stops the workers."""
+        if self._stopped:
+            return
+        try:
+            self.drain()
+        except WriteBehindError as e:
+            print(f"Write-behind shutdown: {e}")
+        self._stopped = True
+        for q in self._queues:
+            q.put(_STOP)
+        for t in self._threads:
+            t.join(timeout=5)
+
+    def metrics(self):
+        """Snapshot of queue depth and latency counters."""
+        depths = [q.qsize() for q in self._queues]
+        with self._metrics_lock:
+            write_ms = list(self._write_ms)
+            queue_ms = list(self._queue_ms)
+            return {
+                "queue_depth": sum(depths),
+                "queue_depth_per_worker": depths,
+                "max_queue_depth": self._max_depth,
+                "enqueued": self._enqueued,
+                "completed": self._completed,
+                "failed": self._failed,
+                "blocked_submits": self._blocked_submits,
+                "write_ms_p50": _percentile(write_ms, 50),
+                "write_ms_p95": _percentile(write_ms, 95),
+                "write_ms_max": max(write_ms) if write_ms else 0.0,
+                "queue_wait_ms_p50": _percentile(queue_ms, 50),
+                "queue_wait_ms_p95": _percentile(queue_ms, 95),
+            }
+
+    def _run(self, q):
+        while True:
+            item = q.get()
+            if item is _STOP:
+                q.task_done()
+                return
+            enqueued_at, key, fn, args = item
+            started = time.perf_counter()
+            error = self._attempt(fn, args)
+            finished = time.perf_counter()
+            with self._metrics_lock:
+                self._completed += 1
+                if error is not None:
+                    self._failed += 1
+                    self._failures.setdefault(key, []).append((key, getattr(fn, "__name__", str(fn)), error))
+                self._queue_ms.append((started - enqueued_at) * 1000)
+                self._write_ms.append((finished - started) * 1000)
+            q.task_done()
+
+    def _attempt(self, fn, args):
+        """Runs fn(*args), retrying after each delay; returns the last error, or None once it succeeds."""
+        for delay in (0,) + tuple(self.retry_delays):
+            time.sleep(delay)
+            try:
+                fn(*args)
+                return None
+            except Exception as e:
+                error = e
+                print(f"Write-behind task {getattr(fn, '__name__', fn)} failed: {e}")
+        return error
+
+
+@st.cache_resource
+def get_write_behind():
+    """Returns the process-wide write-behind worker pool."""
+    pool = WriteBehind()
+    _pools.append(pool)
+    return pool
+
+
+def submit(key, fn, *args):
+    """Runs fn(*args) in the background, or inline when write-behind is disabled."""
+    if WRITE_BEHIND_ENABLED:
+        get_write_behind().submit(key, fn, *args)
+    else:
+        fn(*args)
+
+
+def sync(key):
+    """Waits for pending background writes under key (no-op when disabled); raises WriteBehindError if any failed."""
+    if WRITE_BEHIND_ENABLED:
+        get_write_behind().sync(key)
+
+
+def check(key):
+    """Raises WriteBehindError if earlier background writes under key failed (no wait)."""
+    if WRITE_BEHIND_ENABLED and _pools:
+        # The pool submit() routes to; its workers record the failures
+        get_write_behind().check(key)
+
+
+def shutdown():
+    """Drains and stops the worker pool, if this process started one."""
+    while _pools:
+        _pools.pop().shutdown()
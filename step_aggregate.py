@@ -0,0 +1,69 @@
+"""
+Builds one consolidated dataset from every session ledger: Parquet files under
+data_aggregate/, partitioned by content_pack_hash and tool_id.
+
+    python step_aggregate.py                       (CSV ledgers in data_out/)
+    python step_aggregate.py --source sqlite       (the SQLite session store)
+    python step_aggregate.py --full                (rebuild from scratch)
+
+Ledgers are streamed a block at a time, so memory does not grow with the number
+of sessions. Rows are validated against the app's LEDGER_COLUMNS and
+SCHEMA_VERSION and deduplicated on (session_id, ledger_row_index). Later runs
+read only ledgers that are new or have changed since (tracked in
+data_aggregate/_manifest.json). Read the result with pandas or any Parquet
+reader:
+
+    pd.read_parquet("data_aggregate", filters=[("tool_id", "=", "SMART")])
+"""
+import os
+import sys
+import time
+import argparse
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from src import aggregation, storage
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process (None where the resource module is missing, e.g. Windows)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return (peak if sys.platform == "darwin" else peak * 1024) / (1024 * 1024)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Aggregate session ledgers into a partitioned Parquet dataset.")
+    parser.add_argument("--source", choices=["files", "sqlite"], default=storage.STORAGE_BACKEND,
+                        help="Where the ledgers are (default: STEP_STORAGE_BACKEND)")
+    parser.add_argument("--ledgers", default="data_out", help="Directory of ledger CSVs (--source files)")
+    parser.add_argument("--db", default=storage.SQLITE_PATH, help="SQLite store (--source sqlite)")
+    parser.add_argument("--out", default=aggregation.AGGREGATE_DIR, help="Dataset directory")
+    parser.add_argument("--full", action="store_true", help="Discard the dataset and rebuild it")
+    args = parser.parse_args()
+
+    source = aggregation.create_source(args.source, directory=args.ledgers, db_path=args.db)
+    aggregator = aggregation.Aggregator(source, args.out)
+    started = time.perf_counter()
+    stats = aggregator.run(full=args.full)
+    elapsed = time.perf_counter() - started
+
+    print(f"{stats['ledgers']} ledgers: {stats['processed']} read, {stats['unchanged']} unchanged, "
+          f"{stats['removed']} removed since the last run")
+    peak = peak_rss_mb()
+    print(f"{stats['rows_written']} rows written of {stats['rows_read']} read in {elapsed:.2f}s "
+          f"({stats['rows_read'] / elapsed if elapsed else 0:.0f} rows/s); {stats['duplicates']} duplicates dropped"
+          + (f"; peak RSS {peak:.0f} MB" if peak else ""))
+    for reason, count in sorted(stats["rejected"].items()):
+        print(f"  rejected ({reason}): {count} rows")
+    for name, error in sorted(aggregator.failures().items()):
+        print(f"  ledger not aggregated: {name}: {error}")
+    if aggregator.failures():
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+"""
+Checks the ledger aggregator (src/aggregation.py, step_aggregate.py) on synthetic
+ledgers in a temp directory: older-schema files, duplicates within and across
+files, rows from a newer schema or without a key, a row still being written and
+a file with a foreign column. The Parquet dataset must hold exactly the valid,
+deduplicated rows. Then an incremental run must read only the changed, new and
+deleted ledgers, and the SQLite store must give the same dataset.
+
+    python verify_aggregate.py [--sessions 200]
+"""
+import os
+import sys
+import csv
+import time
+import uuid
+import random
+import shutil
+import argparse
+import tempfile
+
+sys.path.append(os.getcwd())
+
+import pandas as pd
+from src import aggregation, engine, storage
+
+OLD_SCHEMA_DROPS = ["server_latency_ms", "clock_source", "t_client_ms"]
+PACKS = ["a" * 64, "b" * 64]
+
+
+def check(label, condition, detail=""):
+    print(f"{'PASS' if condition else 'FAIL'}: {label}{f' ({detail})' if detail else ''}")
+    return condition
+
+
+def session_rows(rng, session_id, n_rows, schema_version=engine.SCHEMA_VERSION):
+    pack, tool = rng.choice(PACKS), rng.choice(["SMART", "TST"])
+    rows = []
+    for i in range(1, n_rows + 1):
+        row = {c: "" for c in engine.LEDGER_COLUMNS}
+        row.update(session_id=session_id, ledger_row_index=str(i), schema_version=schema_version,
+                   content_pack_hash=pack, tool_id=tool, record_type=rng.choice(["event", "event", "encounter"]),
+                   t_real_ms=str(rng.randint(0, 60000)), patient_id=f"p{rng.randint(1, 40):02d}")
+        if i == n_rows:
+            # Session-end rows carry no tool
+            row.update(record_type="session_end", tool_id="")
+        rows.append(row)
+    return rows
+
+
+def write_ledger(directory, rows, columns=engine.LEDGER_COLUMNS, prefix="logs", tail="", broken_after=None):
+    """A ledger CSV of rows; tail is appended as is, broken_after puts a short line after that many rows."""
+    path = os.path.join(directory, f"{prefix}_{rows[0]['session_id']}_20260101_{random.randint(0, 999999):06d}.csv")
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=columns, extrasaction="ignore")
+        writer.writeheader()
+        for i, row in enumerate(rows):
+            if i == broken_after:
+                f.write("a,short,line\r\n")
+            writer.writerow(row)
+        f.write(tail)
+    return path
+
+
+def build_ledgers(directory, sessions, rng):
+    """Writes the test ledgers; returns (expected rows by key, paths of interest)."""
+    expected = {}
+    paths = {}
+
+    def keep(rows):
+        for row in rows:
+            expected.setdefault((row["session_id"], row["ledger_row_index"]), row)
+
+    for _ in range(sessions):
+        rows = session_rows(rng, str(uuid.uuid4()), rng.randint(5, 80))
+        paths.setdefault("plain", []).append(write_ledger(directory, rows))
+        keep(rows)
+
+    # Written before the timing columns existed
+    rows = session_rows(rng, str(uuid.uuid4()), 30, schema_version="2.1")
+    paths["old_schema"] = write_ledger(directory, rows, [c for c in engine.LEDGER_COLUMNS if c not in OLD_SCHEMA_DROPS])
+    keep([dict(r, **{c: "" for c in OLD_SCHEMA_DROPS}) for r in rows])
+
+    # Duplicates: a repeated row, and a legacy-named copy of part of another session
+    rows = session_rows(rng, str(uuid.uuid4()), 20)
+    paths["repeated"] = write_ledger(directory, rows[:12] + rows[5:8] + rows[12:])
+    keep(rows)
+    copied = rows[:10]
+    paths["legacy_copy"] = write_ledger(directory, copied, prefix="session")
+
+    # Rows to reject: a newer schema, no session_id, a short line and a row cut off mid-write
+    rows = session_rows(rng, str(uuid.uuid4()), 15)
+    bad = [dict(rows[3], schema_version="9.0"), dict(rows[4], session_id="")]
+    cut = ",".join(f'"{v}"' for v in list(rows[14].values())[:20])
+    paths["in_progress"] = write_ledger(directory, rows[:3] + bad + rows[5:14], tail=cut, broken_after=8)
+    keep(rows[:3] + rows[5:14])
+    paths["in_progress_row"] = rows[14]
+
+    # Not a ledger this app wrote
+    rows = session_rows(rng, str(uuid.uuid4()), 5)
+    foreign = [dict(r, extra_column="x") for r in rows]
+    paths["foreign"] = write_ledger(directory, foreign, engine.LEDGER_COLUMNS + ["extra_column"])
+    # Not a ledger at all
+    pd.DataFrame([{"session_id": "x"}]).to_csv(os.path.join(directory, "session_index.csv"), index=False)
+    return expected, paths
+
+
+def dataset_matches(out_dir, expected):
+    """(ok, detail): the dataset holds exactly the expected rows and values."""
+    df = aggregation.read_dataset(out_dir)
+    got = df.drop(columns="source_ledger").set_index(["session_id", "ledger_row_index"]).sort_index()
+    want = pd.DataFrame(list(expected.values()), columns=engine.LEDGER_COLUMNS)
+    want = want.set_index(["session_id", "ledger_row_index"]).sort_index()[got.columns]
+    if len(got) != len(want) or not got.index.equals(want.index):
+        return False, f"{len(got)} rows vs {len(want)} expected"
+    differs = (got != want).any(axis=1)
+    return not differs.any(), f"{len(got)} rows, {int(differs.sum())} differ"
+
+
+def run_verification(sessions, seed):
+    print("Beginning Aggregation Verification...")
+    ok = True
+    rng = random.Random(seed)
+    random.seed(seed)
+    workdir = tempfile.mkdtemp(prefix="step_aggregate_")
+    ledgers = os.path.join(workdir, "data_out")
+    out_dir = os.path.join(workdir, "data_aggregate")
+    os.makedirs(ledgers)
+    try:
+        expected, paths = build_ledgers(ledgers, sessions, rng)
+
+        # 1. First run; small blocks so ledgers span several
+        aggregator = aggregation.Aggregator(aggregation.FileLedgers(ledgers, block_bytes=4096), out_dir)
+        started = time.perf_counter()
+        stats = aggregator.run()
+        elapsed = time.perf_counter() - started
+        ok &= check("every ledger file found, session_index.csv skipped", stats["ledgers"] == sessions + 5,
+                    f"{stats['ledgers']} ledgers")
+        ok &= check("dataset holds exactly the valid, deduplicated rows", *dataset_matches(out_dir, expected))
+        ok &= check("duplicates counted (3 repeated rows + 10 copied rows)", stats["duplicates"] == 13,
+                    str(stats["duplicates"]))
+        ok &= check("rejected rows counted by reason",
+                    stats["rejected"] == {"incomplete": 1, "malformed": 1, "no_key": 1, "schema_version": 1},
+                    str(stats["rejected"]))
+        failures = aggregator.failures()
+        ok &= check("ledger with a foreign column rejected whole",
+                    list(failures) == [os.path.basename(paths["foreign"])], str(failures))
+        partitions = {os.path.relpath(d, out_dir) for d, _, files in os.walk(out_dir) if any(
+            f.endswith(".parquet") for f in files)}
+        ok &= check("partitioned by content_pack_hash/tool_id",
+                    all(p.startswith("content_pack_hash=") and "/tool_id=" in p for p in partitions),
+                    f"{len(partitions)} partitions")
+        smart = aggregation.read_dataset(out_dir, filters=[("tool_id", "=", "SMART")])
+        ok &= check("partition filters read only matching rows",
+                    len(smart) == sum(r["tool_id"] == "SMART" for r in expected.values()))
+        print(f"First run: {stats['rows_read']} rows in {elapsed:.2f}s")
+
+        # 2. Nothing changed: nothing is read
+        stats = aggregation.Aggregator(aggregation.FileLedgers(ledgers), out_dir).run()
+        ok &= check("unchanged ledgers are skipped", stats["processed"] == 0 and stats["unchanged"] == sessions + 5,
+                    f"{stats['processed']} read")
+
+        # 3. One ledger grows (its cut row completed), one is deleted, one is new
+        row = paths["in_progress_row"]
+        with open(paths["in_progress"], "a", newline="", encoding="utf-8") as f:
+            f.write("," + ",".join(f'"{v}"' for v in list(row.values())[20:]) + "\r\n")
+        expected[(row["session_id"], row["ledger_row_index"])] = row
+        deleted = pd.read_csv(paths["plain"][0], dtype=str, keep_default_na=False)
+        os.remove(paths["plain"][0])
+        for key in list(expected):
+            if key[0] == deleted["session_id"].iloc[0]:
+                del expected[key]
+        rows = session_rows(rng, str(uuid.uuid4()), 25)
+        write_ledger(ledgers, rows)
+        for r in rows:
+            expected[(r["session_id"], r["ledger_row_index"])] = r
+        stats = aggregation.Aggregator(aggregation.FileLedgers(ledgers), out_dir).run()
+        ok &= check("incremental run reads only the changed and new ledgers",
+                    stats["processed"] == 2 and stats["removed"] == 1,
+                    f"{stats['processed']} read, {stats['removed']} removed")
+        ok &= check("dataset up to date after the incremental run", *dataset_matches(out_dir, expected))
+
+        # 4. The same sessions from the SQLite store
+        store = storage.SQLiteStore(engine.LEDGER_COLUMNS, os.path.join(workdir, "step.sqlite3"))
+        by_session = {}
+        for key, expected_row in expected.items():
+            by_session.setdefault(key[0], []).append(expected_row)
+        for session_id, session in by_session.items():
+            store.insert_ledger_rows(f"data_out/logs_{session_id}_20260101_000000.csv", session)
+        sqlite_out = os.path.join(workdir, "data_aggregate_sqlite")
+        sqlite_source = aggregation.SQLiteLedgers(store.path)
+        stats = aggregation.Aggregator(sqlite_source, sqlite_out).run()
+        ok &= check("SQLite store gives the same dataset", *dataset_matches(sqlite_out, expected))
+        store.insert_ledger_rows(f"data_out/logs_{row['session_id']}_20260101_000000.csv",
+                                 [dict(row, ledger_row_index="16")])
+        expected[(row["session_id"], "16")] = dict(row, ledger_row_index="16")
+        stats = aggregation.Aggregator(aggregation.SQLiteLedgers(store.path), sqlite_out).run()
+        ok &= check("SQLite incremental run reads only the ledger with new rows", stats["processed"] == 1,
+                    f"{stats['processed']} read")
+        ok &= check("SQLite dataset up to date", *dataset_matches(sqlite_out, expected))
+        store.close()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print("Aggregation Verification Complete." if ok else "Aggregation Verification FAILED.")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=5)
+    args = parser.parse_args()
+    sys.exit(0 if run_verification(args.sessions, args.seed) else 1)
@@ -0,0 +1,215 @@
+"""
+Checks the accuracy statistics (src/analysis.py, analyze.py) on synthetic
+sessions whose triage error rates are known. The sessions are written as ledger
+CSVs and consolidated with the aggregator, as in a study. Confusion matrices and
+point estimates must equal a direct count, the bootstrap intervals must match
+the normal approximation and cover the true rates about as often as they claim,
+and the whole analysis of 20,000 encounters must take seconds.
+
+    python verify_analysis.py [--sessions 500]
+"""
+import os
+import sys
+import csv
+import json
+import time
+import uuid
+import random
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+sys.path.append(os.getcwd())
+
+import numpy as np
+import pandas as pd
+from src import aggregation, analysis, engine
+
+TAGS = ["Red", "Yellow", "Green", "Black"]
+# Chance a participant tags a patient correctly, and of a critical (two-level) undertriage otherwise
+TOOLS = {"SMART": {"correct": 0.80, "critical": 0.15}, "TST": {"correct": 0.70, "critical": 0.30}}
+SCENARIOS = ["Day", "Night"]
+
+
+def check(label, condition, detail=""):
+    print(f"{'PASS' if condition else 'FAIL'}: {label}{f' ({detail})' if detail else ''}")
+    return condition
+
+
+def user_tag(rng, reference, rates, skill=0.0):
+    if reference == "Black" or rng.random() < rates["correct"] + skill:
+        return reference
+    if reference == "Red" and rng.random() < rates["critical"] / (1 - rates["correct"]) * 2:
+        return "Green"
+    return rng.choice([t for t in TAGS if t != reference])
+
+
+def write_sessions(directory, n_sessions, encounters_per_session, rng, skill_sd=0.0):
+    """Ledger CSVs of synthetic sessions; returns the real encounter rows written."""
+    written = []
+    for _ in range(n_sessions):
+        session_id = str(uuid.uuid4())
+        tool_id = rng.choice(sorted(TOOLS))
+        skill = rng.gauss(0, skill_sd)
+        rows, encounters = [], []
+        for order in range(encounters_per_session + 2):
+            reference = rng.choice(TAGS)
+            tag = user_tag(rng, reference, TOOLS[tool_id], skill)
+            patient = {c: "" for c in engine.LEDGER_COLUMNS}
+            patient.update(session_id=session_id, schema_version=engine.SCHEMA_VERSION, content_pack_hash="a" * 64,
+                           tool_id=tool_id, patient_id=f"P{order:02d}", scenario_type=SCENARIOS[order % 2],
+                           is_practice=str(order < 2))
+            rows.append(dict(patient, record_type="event", event_type="decision", user_tag_normalized=tag,
+                             reference_tag_normalized=reference, ledger_row_index=str(len(rows) + 1)))
+            rows.append(dict(patient, record_type="encounter", Time_to_Tag=str(rng.randint(1500, 30000)),
+                             Error_Class=engine.evaluate_outcome_class(tag, reference),
+                             ledger_row_index=str(len(rows) + 1)))
+            encounters.append(dict(rows[-1], User_Tag=tag, Reference_Tag=reference))
+        path = os.path.join(directory, f"logs_{session_id}_20260101_000000.csv")
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=engine.LEDGER_COLUMNS)
+            writer.writeheader()
+            writer.writerows(rows)
+        written += [r for r in encounters if r["is_practice"] == "False"]
+    return pd.DataFrame(written)
+
+
+def direct_statistics(written):
+    """Point estimates counted directly, per tool and scenario and per tool."""
+    df = written.assign(Time_to_Tag=written["Time_to_Tag"].astype(float))
+    expected = {}
+    for keys, group in list(df.groupby(["tool_id", "scenario_type"])) + [
+            ((tool, analysis.ALL_SCENARIOS), g) for tool, g in df.groupby("tool_id")]:
+        expected[keys] = {name: group["Error_Class"].isin(classes).mean()
+                          for name, classes in analysis.RATE_CLASSES.items()}
+        expected[keys]["accuracy"] = (group["User_Tag"] == group["Reference_Tag"]).mean()
+        expected[keys]["mean_time_to_tag_ms"] = group["Time_to_Tag"].mean()
+    return expected
+
+
+def coverage(rng, n, replicates, runs, confidence=0.95):
+    """How often the interval for a rate of 0.2 over n encounters contains 0.2."""
+    hits = 0
+    for _ in range(runs):
+        values = (rng.random(n) < 0.2).astype(float)[:, None]
+        boot = analysis.bootstrap_ratios(values, np.ones_like(values), replicates, rng)
+        low, high = analysis._interval(boot, confidence)
+        hits += low[0] <= 0.2 <= high[0]
+    return hits / runs
+
+
+def run_verification(sessions, seed):
+    print("Beginning Analysis Verification...")
+    ok = True
+    rng = random.Random(seed)
+    workdir = tempfile.mkdtemp(prefix="step_analysis_")
+    ledgers = os.path.join(workdir, "data_out")
+    dataset = os.path.join(workdir, "data_aggregate")
+    os.makedirs(ledgers)
+    try:
+        written = write_sessions(ledgers, sessions, 40, rng)
+        aggregation.Aggregator(aggregation.FileLedgers(ledgers), dataset).run()
+
+        # 1. The consolidated dataset's real encounters
+        started = time.perf_counter()
+        encounters = analysis.load_encounters(dataset)
+        loaded = time.perf_counter()
+        results = analysis.analyze(encounters, seed=seed)
+        elapsed = time.perf_counter() - loaded
+        ok &= check("real encounters read from the consolidated dataset", len(encounters) == len(written),
+                    f"{len(encounters)} encounters")
+        from_csv = analysis.load_encounters(ledgers_dir=ledgers)
+        ok &= check("same encounters read from the ledger CSVs", len(from_csv) == len(encounters))
+        ok &= check(f"{len(encounters)} encounters analysed in seconds", elapsed < 10,
+                    f"read {loaded - started:.2f}s, {analysis.BOOTSTRAP_REPLICATES} replicates {elapsed:.2f}s")
+
+        # 2. Confusion matrices and point estimates against a direct count
+        confusion = results["confusion"]
+        ok_matrices = True
+        for (tool_id, scenario_type), group in written.groupby(["tool_id", "scenario_type"]):
+            want = pd.crosstab(group["Reference_Tag"], group["User_Tag"])
+            got = analysis.confusion_matrix(confusion, tool_id, scenario_type)
+            ok_matrices &= got.loc[want.index, want.columns].equals(want) and got.to_numpy().sum() == len(group)
+        tool_totals = confusion[confusion["scenario_type"] == analysis.ALL_SCENARIOS].groupby("tool_id")["count"].sum()
+        ok &= check("confusion matrices match a direct count", ok_matrices and tool_totals.to_dict() == written.groupby(
+            "tool_id").size().to_dict())
+        ok &= check("matrix rows and columns run from most to least urgent",
+                    list(analysis.confusion_matrix(confusion, "SMART").index) == TAGS)
+
+        stats = results["statistics"].set_index(["tool_id", "scenario_type"])
+        expected = direct_statistics(written)
+        worst = max(abs(stats.loc[keys, name] - value) for keys, values in expected.items()
+                    for name, value in values.items())
+        ok &= check("point estimates match a direct count", len(stats) == len(expected) and worst < 1e-9,
+                    f"{len(stats)} groups")
+
+        # 3. Bootstrap intervals
+        ratios = []
+        for keys, row in stats.iterrows():
+            p, n = row["critical_under_rate"], row["encounters"]
+            wald = 2 * 1.96 * np.sqrt(p * (1 - p) / n)
+            ratios.append((row["critical_under_rate_ci_high"] - row["critical_under_rate_ci_low"]) / wald)
+        ok &= check("interval widths match the normal approximation", all(0.85 < r < 1.15 for r in ratios),
+                    f"ratios {min(ratios):.2f}-{max(ratios):.2f}")
+        np_rng = np.random.default_rng(seed)
+        rate = coverage(np_rng, 400, 1000, 300)
+        ok &= check("95% intervals cover the true rate about 95% of the time", 0.91 <= rate <= 0.98, f"{rate:.1%}")
+        again = analysis.analyze(encounters, seed=seed)["statistics"]
+        ok &= check("a seed reproduces the intervals", again.equals(results["statistics"]))
+
+        comparisons = results["comparisons"].set_index(["scenario_type", "statistic"])
+        accuracy = comparisons.loc[(analysis.ALL_SCENARIOS, "accuracy")]
+        ok &= check("tool difference in accuracy found (TST - SMART)",
+                    accuracy["tool_a"] == "SMART" and accuracy["ci_high"] < 0 and abs(
+                        accuracy["difference"] - (accuracy["value_b"] - accuracy["value_a"])) < 1e-12,
+                    f"{accuracy['difference']:.3f} [{accuracy['ci_low']:.3f}, {accuracy['ci_high']:.3f}]")
+        time_diff = comparisons.loc[(analysis.ALL_SCENARIOS, "mean_time_to_tag_ms")]
+        times = encounters.groupby("tool_id")["Time_to_Tag"]
+        wald = 2 * 1.96 * np.sqrt((times.var() / times.size()).sum())
+        width = (time_diff["ci_high"] - time_diff["ci_low"]) / wald
+        ok &= check("Time_to_Tag difference interval matches the normal approximation", 0.85 < width < 1.15,
+                    f"{time_diff['difference']:.0f} ms [{time_diff['ci_low']:.0f}, {time_diff['ci_high']:.0f}]")
+
+        # 4. Participants who differ in skill: session resampling gives wider intervals
+        clustered_dir = os.path.join(workdir, "clustered")
+        os.makedirs(clustered_dir)
+        write_sessions(clustered_dir, 200, 40, rng, skill_sd=0.15)
+        clustered = analysis.load_encounters(ledgers_dir=clustered_dir)
+        widths = {}
+        for cluster in ["encounter", "session"]:
+            s = analysis.accuracy_statistics(clustered, 1000, cluster=cluster, seed=seed)[0]
+            widths[cluster] = (s["accuracy_ci_high"] - s["accuracy_ci_low"]).mean()
+        ok &= check("session resampling widens intervals when participants differ",
+                    widths["session"] > 1.3 * widths["encounter"],
+                    f"{widths['encounter']:.3f} vs {widths['session']:.3f}")
+
+        # 5. The CLI's tables and JSON
+        out = os.path.join(workdir, "analysis_out")
+        cli = subprocess.run([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "analyze.py"),
+                              "--dataset", dataset, "--out", out, "--replicates", "500"],
+                             capture_output=True, text=True)
+        files = sorted(os.listdir(out)) if os.path.isdir(out) else []
+        ok &= check("analyze.py writes the tables and JSON", cli.returncode == 0 and files == [
+            "accuracy_statistics.csv", "analysis.json", "confusion_matrices.csv", "tool_comparisons.csv"],
+                    ", ".join(files) if cli.returncode == 0 else cli.stderr.strip()[-300:])
+        if files:
+            with open(os.path.join(out, "analysis.json"), encoding="utf-8") as f:
+                report = json.load(f)
+            matrix = report["confusion_matrices"]["TST"]["Night"]
+            ok &= check("JSON holds the matrices and statistics", len(report["statistics"]) == len(stats) and sum(
+                map(sum, matrix["counts"])) == int(stats.loc[("TST", "Night"), "encounters"]))
+        print(cli.stdout.strip())
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print("Analysis Verification Complete." if ok else "Analysis Verification FAILED.")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sessions", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=3)
+    args = parser.parse_args()
+    sys.exit(0 if run_verification(args.sessions, args.seed) else 1)
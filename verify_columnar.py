@@ -0,0 +1,234 @@
+"""
+Checks the columnar ledger (src/columnar.py) against the CSV ledgers it is
+written alongside. Synthetic sessions go through the files backend with a
+columnar copy, in a temp directory. The wide view rebuilt from the typed tables
+must equal the CSVs, cell for cell: while streams are open, after a server
+process dies mid-write and after shutdown compacts everything to Parquet.
+
+    python verify_columnar.py [--sessions 60]
+"""
+import os
+import sys
+import glob
+import json
+import random
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+sys.path.append(os.getcwd())
+
+import pandas as pd
+from src import columnar, engine, storage
+
+
+def check(label, condition, detail=""):
+    print(f"{'PASS' if condition else 'FAIL'}: {label}{f' ({detail})' if detail else ''}")
+    return condition
+
+
+def base(session_id, record_type, t_run_ms):
+    return {"t_run_ms": t_run_ms, "session_id": session_id, "record_type": record_type,
+            "schema_version": engine.SCHEMA_VERSION, "app_version": engine.APP_VERSION, "content_pack_hash": "c" * 64,
+            "participant_role": "Paramedic", "fatigue_status": "Rested", "prior_triage_training": "Yes",
+            "clock_source": "monotonic"}
+
+
+def session_phases(rng, session_id):
+    """A session's rows as logged (typed values), grouped by phase boundary: each list ends in a flush."""
+    tool = rng.choice(["SMART", "TST"])
+    t_run = 0
+    sim_extra = 0
+    phases = []
+    for order in range(1, rng.randint(6, 14)):
+        patient = {"patient_id": f"P{order:02d}", "tool_id": tool, "scenario_type": rng.choice(["Day", "Night"]),
+                   "is_practice": False}
+        rows = []
+        t_real = 0
+        for _ in range(rng.randint(0, 6)):
+            t_real += rng.randint(200, 9000)
+            # Fractional action costs make t_sim_ms a float; sometimes a whole one (1001.0)
+            sim_extra += rng.choice([0, 250, 0.5, 0.25])
+            rows.append(dict(base(session_id, "event", t_run + t_real), **patient, event_type="reveal",
+                             action_key=rng.choice(["rr", "pulse_rad", "walk", "cap_refill"]), t_real_ms=t_real,
+                             t_sim_ms=t_real + sim_extra, reference_tag_normalized="Red",
+                             server_latency_ms=rng.choice([rng.randint(1, 40), ""])))
+        t_real += rng.randint(200, 9000)
+        label = rng.choice(['Immediate "red"', "Delayed, yellow", "Not\ninjured"])
+        rows.append(dict(base(session_id, "event", t_run + t_real), **patient, event_type="decision",
+                         action_key="triage_decision", decision_raw=label, user_tag_normalized="Yellow",
+                         reference_tag_normalized="Red", deviation=rng.choice([-1, 0, 1, "ERR"]), t_real_ms=t_real,
+                         t_sim_ms=t_real + sim_extra, server_latency_ms=rng.randint(1, 40)))
+        rows.append(dict(base(session_id, "encounter", t_run + t_real), **patient, patient_sequence_order=order,
+                         Time_to_First_Action=rng.choice([rng.randint(0, 5000), ""]), Time_to_Tag=t_real,
+                         Time_to_Hemorrhage_Ctrl="", Time_to_Airway_Ctrl=rng.choice(["", 1200]),
+                         Dwell_rr=rng.choice(["", 800]), Dwell_pulse_rad="", Dwell_Measurable=rng.random() < 0.8,
+                         Seq_Error_Count=rng.randint(0, 2), Seq_Error_Measurable=True,
+                         LSI_Applicable=rng.random() < 0.5, Required_LSI="tourniquet,airway",
+                         Missed_LSI_Flag=rng.choice(["", "True", "False"]), Missing_LSI_List=rng.choice(["", "airway"]),
+                         Error_Class=rng.choice(["Correct", "Over", "Under", "Critical_Under"])))
+        if rng.random() < 0.3:
+            rows.append(dict(base(session_id, "client_timing", t_run + t_real), **patient, event_type="decision",
+                             action_key="triage_decision", patient_sequence_order=order,
+                             t_client_ms=rng.randint(100, 9000), clock_source="client"))
+        t_run += t_real
+        phases.append(rows)
+    phases.append([dict(base(session_id, "tlx", t_run), tool_id=tool, scenario_type="Day",
+                        **{f"nasa_{k}": rng.randint(0, 100) for k in ["mental", "temporal", "effort",
+                                                                        "frustration", "performance"]})])
+    # Values outside a record type's own columns, and a record type the columnar tables do not know
+    phases.append([dict(base(session_id, "post", t_run), tool_id=tool, patient_id="P01", post_understanding=70,
+                        post_preparedness=55, post_tool_effective=80),
+                   dict(base(session_id, "note", t_run), action_key="free text, with a comma")])
+    real = sum(1 for rows in phases for r in rows if r["record_type"] == "encounter")
+    phases.append([dict(base(session_id, "session_end", t_run), completion_code=session_id[-6:] + "_0000",
+                        n_encounters_total=real, n_practice_encounters=0, n_real_encounters=real,
+                        n_decisions_made=real, mean_time_to_tag_ms=rng.randint(1000, 90000) / rng.choice([3, 4, 1]),
+                        critical_under_rate=rng.randint(0, real) / real, total_ledger_rows=0)])
+    return phases
+
+
+def ledger_row(row, index):
+    """The row append_ledger_row hands to the store."""
+    fresh = {c: "" for c in engine.LEDGER_COLUMNS}
+    for k, v in row.items():
+        if k in fresh:
+            fresh[k] = engine.safe_str(v)
+    fresh["ledger_row_index"] = str(index)
+    return fresh
+
+
+def csv_view(paths):
+    """The CSV ledgers' rows, in the wide view's order."""
+    frames = [pd.read_csv(p, dtype=str, keep_default_na=False) for p in paths]
+    wide = pd.concat(frames, ignore_index=True)
+    wide["_order"] = pd.to_numeric(wide["ledger_row_index"])
+    return wide.sort_values(["session_id", "_order"], kind="stable").drop(columns="_order").reset_index(drop=True)
+
+
+def same(wide, expected):
+    """(ok, detail): the wide view equals the expected CSV rows."""
+    if list(wide.columns) != list(expected.columns) or len(wide) != len(expected):
+        return False, f"{len(wide)} rows x {len(wide.columns)} columns vs {len(expected)} x {len(expected.columns)}"
+    differs = (wide != expected).any(axis=1)
+    return not differs.any(), f"{len(wide)} rows, {int(differs.sum())} differ"
+
+
+def session_id_for(rng, n):
+    return f"{n:08d}-0000-4000-8000-{rng.getrandbits(48):012x}"
+
+
+def write_sessions(store, rng, first, count):
+    """Plays sessions through the store as engine.py does; returns their ledger paths."""
+    paths = []
+    for n in range(first, first + count):
+        session_id = session_id_for(rng, n)
+        path = storage.ledger_filepath(session_id, "20260101_000000")
+        index = 0
+        for rows in session_phases(rng, session_id):
+            for row in rows:
+                index += 1
+                store.append_ledger_row(path, ledger_row(row, index))
+            store.flush_ledger(path)
+        store.close_ledger(path)
+        paths.append(path)
+    return paths
+
+
+# Run in a child process that dies without shutting down, after cutting a batch short
+CRASH_SCRIPT = """
+import os, sys, glob, json, random
+sys.path.insert(0, {repo!r})
+from verify_columnar import write_sessions
+from src import columnar, engine, storage
+store = storage.FileStore(engine.LEDGER_COLUMNS, columnar=columnar.ColumnarLedger(engine.LEDGER_COLUMNS, batch_rows=1))
+paths = write_sessions(store, random.Random({seed}), 0, {count})
+store.ledger.close_all()
+with open(glob.glob("data_out/columnar/event/*.arrows")[0], "ab") as f:
+    f.write(bytes([255, 255, 255, 255, 64, 1, 0, 0]) + b"a batch cut off")
+print(json.dumps(paths), flush=True)
+os._exit(1)
+"""
+
+
+def run_verification(sessions, seed):
+    print("Beginning Columnar Ledger Verification...")
+    ok = True
+    rng = random.Random(seed)
+    repo = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix="step_columnar_")
+    os.chdir(workdir)
+    try:
+        # 1. A server process dies with its streams open (and a batch half written)
+        crashed = 5
+        child = subprocess.run([sys.executable, "-c", CRASH_SCRIPT.format(repo=repo, seed=seed, count=crashed)],
+                               capture_output=True, text=True)
+        paths = json.loads(child.stdout)
+        streams = glob.glob(os.path.join(columnar.COLUMNAR_DIR, "*", "*.arrows"))
+        ok &= check("a dead process leaves its streams", bool(streams), f"{len(streams)} streams")
+        ok &= check("streams are readable up to the cut-off batch", *same(columnar.read_wide(), csv_view(paths)))
+
+        # 2. The next process compacts them, and leaves a live process's streams alone
+        live = columnar.ColumnarLedger(engine.LEDGER_COLUMNS, batch_rows=50, roll_rows=1500)
+        left = glob.glob(os.path.join(columnar.COLUMNAR_DIR, "*", "*.arrows"))
+        ok &= check("orphaned streams compacted on start", not left, f"{len(left)} left")
+        store = storage.FileStore(engine.LEDGER_COLUMNS, columnar=live)
+        rng.seed(seed + 1)
+        paths += write_sessions(store, rng, crashed, sessions - crashed)
+        columnar.ColumnarLedger(engine.LEDGER_COLUMNS)
+        ok &= check("live streams are not compacted by another process",
+                    bool(glob.glob(os.path.join(columnar.COLUMNAR_DIR, "*", "*.arrows"))))
+
+        # 3. Rows written so far (parts and open streams) equal the CSVs; queued ones follow at the next boundary
+        live.flush(force=True)
+        ok &= check("wide view equals the CSVs with streams open", *same(columnar.read_wide(), csv_view(paths)))
+
+        # 4. Shutdown: everything compacted to Parquet
+        store.close()
+        leftovers = [f for f in glob.glob(os.path.join(columnar.COLUMNAR_DIR, "*", "*")) if not f.endswith(".parquet")]
+        ok &= check("shutdown compacts every stream into Parquet", not leftovers, ", ".join(leftovers))
+        ok &= check("wide view equals the CSVs after shutdown", *same(columnar.read_wide(), csv_view(paths)))
+        one = columnar.read_wide(session_id=columnar.read_columnar("session_end")["session_id"].iloc[3])
+        ok &= check("one session's wide view", *same(one, csv_view([p for p in paths if one["session_id"][0] in p])))
+        ok &= check("unknown record types and out-of-place values survive",
+                    set(one["record_type"]) >= {"note", "post"}
+                    and one.loc[one["record_type"] == "post", "patient_id"].tolist() == ["P01"])
+
+        # 5. Typed tables
+        events, encounters = columnar.read_columnar("event"), columnar.read_columnar("encounter")
+        session_end = columnar.read_columnar("session_end")
+        ok &= check("typed columns", str(events["t_real_ms"].dtype) == "int64"
+                    and str(events["t_sim_ms"].dtype) == "float64"
+                    and str(encounters["LSI_Applicable"].dtype) == "bool"
+                    and str(session_end["critical_under_rate"].dtype) == "float64",
+                    f"t_real_ms {events['t_real_ms'].dtype}, LSI_Applicable {encounters['LSI_Applicable'].dtype}")
+        expected = csv_view(paths)
+        ok &= check("one table per record type", len(encounters) == (expected["record_type"] == "encounter").sum()
+                    and len(session_end) == len(paths), f"{len(encounters)} encounters, {len(session_end)} sessions")
+
+        csv_bytes = sum(os.path.getsize(p) for p in paths)
+        columnar_bytes = sum(os.path.getsize(f) for f in glob.glob(os.path.join(columnar.COLUMNAR_DIR, "*", "*")))
+        print(f"{len(paths)} sessions: CSV {csv_bytes / 1024:.0f} KB, columnar {columnar_bytes / 1024:.0f} KB")
+
+        # 6. A withdrawn session is deleted from the columnar copy too
+        store = storage.FileStore(engine.LEDGER_COLUMNS, columnar=columnar.ColumnarLedger(engine.LEDGER_COLUMNS))
+        withdrawn = one["session_id"][0]
+        store.delete_ledger([p for p in paths if withdrawn in p][0], withdrawn)
+        ok &= check("delete_ledger removes the session's columnar rows",
+                    columnar.read_wide(session_id=withdrawn).empty and len(columnar.read_wide()) == len(expected) - len(one))
+        store.close()
+    finally:
+        os.chdir(repo)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print("Columnar Ledger Verification Complete." if ok else "Columnar Ledger Verification FAILED.")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sessions", type=int, default=60)
+    parser.add_argument("--seed", type=int, default=3)
+    args = parser.parse_args()
+    sys.exit(0 if run_verification(args.sessions, args.seed) else 1)
@@ -0,0 +1,338 @@
+"""
+Checks the live dashboard's running metrics (src/live_metrics.py, dashboard.py)
+on synthetic ledgers in a temp directory. After every poll the incremental
+aggregates must equal a full recompute over the rows written so far, a row still
+being written must wait for its newline, a deleted ledger must be taken back
+out, and a poll must read only the new rows and check only recently written
+ledgers, however much finished or abandoned history there is. The directory
+must not be re-listed on every poll. The SQLite tail must agree with the file
+tail, and the dashboard must render.
+
+    python verify_live_metrics.py [--sessions 300]
+"""
+import os
+import sys
+import time
+import uuid
+import random
+import shutil
+import argparse
+import tempfile
+
+sys.path.append(os.getcwd())
+
+import pandas as pd
+from src import engine, ledger, live_metrics, storage
+
+DASHBOARD = os.path.join(os.path.dirname(os.path.abspath(__file__)), "dashboard.py")
+
+
+def check(label, condition, detail=""):
+    print(f"{'PASS' if condition else 'FAIL'}: {label}{f' ({detail})' if detail else ''}")
+    return condition
+
+
+class Clock:
+    """Wall time, moved forward by hand to step past the tail's re-list intervals."""
+
+    def __init__(self):
+        self.offset = 0.0
+
+    def __call__(self):
+        return time.time() + self.offset
+
+    def advance(self, seconds=live_metrics.RELIST_MIN_SECONDS):
+        self.offset += seconds
+
+
+def session_phases(rng, session_id):
+    """A session's ledger rows, split where the app flushes (phase boundaries)."""
+    common = {"session_id": session_id, "schema_version": engine.SCHEMA_VERSION,
+              "tool_id": rng.choice(["SMART", "TST"])}
+    phases = []
+    for block, scenario in enumerate(["Day", "Night"]):
+        rows = []
+        for order in range(1, rng.randint(3, 6)):
+            patient = dict(common, scenario_type=scenario, patient_id=f"P{order:02d}", is_practice="False")
+            rows += [dict(patient, record_type="event", event_type="reveal") for _ in range(rng.randint(1, 4))]
+            rows.append(dict(patient, record_type="event", event_type="decision"))
+            rows.append(dict(patient, record_type="encounter", Time_to_Tag=str(rng.randint(800, 20000)),
+                             Error_Class=rng.choice(["Correct", "Correct", "Over", "Critical_Under"])))
+            phases.append(rows)
+            rows = []
+        phases.append([dict(common, record_type="tlx", scenario_type=scenario)])
+        if block == 0:
+            phases.append([dict(common, record_type="event", event_type="washout_start")])
+            phases.append([dict(common, record_type="event", event_type="washout_complete")])
+    phases.append([dict(common, record_type="post")])
+    phases.append([dict(common, record_type="session_end")])
+    return phases
+
+
+class Study:
+    """Ledgers written through the app's LedgerWriter, and every row written so far."""
+
+    def __init__(self, directory, rng):
+        self.directory = directory
+        self.rng = rng
+        self.sessions = {}
+
+    def start(self):
+        session_id = str(uuid.uuid4())
+        path = os.path.join(self.directory, f"logs_{session_id}_20260101_{self.rng.randint(0, 999999):06d}.csv")
+        self.sessions[session_id] = {"path": path, "phases": session_phases(self.rng, session_id), "written": []}
+        return session_id
+
+    def advance(self, session_id, n_phases=1):
+        """Writes the session's next phases; returns the rows written."""
+        session = self.sessions[session_id]
+        writer = ledger.LedgerWriter(session["path"], engine.LEDGER_COLUMNS, durability="buffered")
+        written = []
+        for rows in session["phases"][:n_phases]:
+            for row in rows:
+                full = {c: "" for c in engine.LEDGER_COLUMNS}
+                full.update(row, ledger_row_index=str(len(session["written"]) + 1))
+                writer.append(full)
+                session["written"].append(full)
+                written.append(full)
+            writer.flush()
+        writer.close()
+        del session["phases"][:n_phases]
+        return written
+
+    def finish(self, session_id):
+        return self.advance(session_id, len(self.sessions[session_id]["phases"]))
+
+    def unfinished(self):
+        return [s for s, session in self.sessions.items() if session["phases"]]
+
+    def delete(self, session_id):
+        os.remove(self.sessions.pop(session_id)["path"])
+
+
+def recompute(study):
+    """The metrics from scratch, over every row written so far."""
+    rows = pd.DataFrame([r for s in study.sessions.values() for r in s["written"]], columns=engine.LEDGER_COLUMNS)
+    last = rows.groupby("session_id").tail(1)
+    phases = last.apply(live_metrics.phase_of, axis=1)
+    active = {phase: int((phases == phase).sum()) for phase in live_metrics.PHASES}
+    encounters = rows[rows["record_type"] == "encounter"].copy()
+    encounters["Time_to_Tag"] = encounters["Time_to_Tag"].astype(float)
+    encounters["critical"] = encounters["Error_Class"] == "Critical_Under"
+    grouped = encounters.groupby(["tool_id", "scenario_type"]).agg(
+        encounters=("Time_to_Tag", "size"), mean_time_to_tag_ms=("Time_to_Tag", "mean"),
+        critical_under_rate=("critical", "mean")).reset_index()
+    return {"active_by_phase": active, "finished": int((phases == live_metrics.FINISHED).sum()),
+            "sessions": len(last), "encounters": len(encounters), "groups": grouped.to_dict("records")}
+
+
+def matches(snapshot, expected):
+    """(ok, detail): the running aggregates equal the recompute."""
+    if snapshot["active_by_phase"] != expected["active_by_phase"]:
+        return False, f"active {snapshot['active_by_phase']} vs {expected['active_by_phase']}"
+    for key in ["finished", "sessions", "encounters"]:
+        if snapshot[key] != expected[key]:
+            return False, f"{key} {snapshot[key]} vs {expected[key]}"
+    got, want = pd.DataFrame(snapshot["groups"]), pd.DataFrame(expected["groups"])
+    if len(got) != len(want) or not ((got[["tool_id", "scenario_type", "encounters"]]
+                                      == want[["tool_id", "scenario_type", "encounters"]]).all().all()):
+        return False, "groups differ"
+    for column in ["mean_time_to_tag_ms", "critical_under_rate"]:
+        if ((got[column] - want[column]).abs() > 1e-9).any():
+            return False, f"{column} differs"
+    return True, f"{expected['sessions']} sessions, {expected['encounters']} encounters"
+
+
+def timed_poll(metrics):
+    """Polls once new ledgers are due to be listed."""
+    metrics.clock.advance()
+    started = time.perf_counter()
+    n = metrics.poll(min_interval=0)
+    return n, time.perf_counter() - started
+
+
+def history_cost(workdir, finished, active, rng):
+    """(read only the new rows, ledgers checked, seconds) for one poll of new rows over a given amount of history."""
+    directory = os.path.join(workdir, f"history_{finished}")
+    os.makedirs(directory)
+    study = Study(directory, rng)
+    for _ in range(finished):
+        study.finish(study.start())
+    live = [study.start() for _ in range(active)]
+    for session_id in live:
+        study.advance(session_id)
+    metrics = live_metrics.LiveMetrics(live_metrics.FileTail(directory), clock=Clock())
+    timed_poll(metrics)
+    timed_poll(metrics)
+    written = sum(len(study.advance(session_id)) for session_id in live)
+    n, elapsed = timed_poll(metrics)
+    return n == written, metrics.tail.last_checked, elapsed
+
+
+def abandoned_sessions(workdir, rng):
+    """Ledgers last written long ago are set idle, and woken when written again."""
+    ok = True
+    directory = os.path.join(workdir, "abandoned")
+    os.makedirs(directory)
+    study = Study(directory, rng)
+    abandoned = [study.start() for _ in range(20)]
+    for session_id in abandoned:
+        study.advance(session_id, 2)
+        stale = time.time() - 2 * live_metrics.ACTIVE_WINDOW_SECONDS
+        os.utime(study.sessions[session_id]["path"], (stale, stale))
+    live = study.start()
+    study.advance(live)
+
+    metrics = live_metrics.LiveMetrics(live_metrics.FileTail(directory), clock=Clock())
+    timed_poll(metrics)
+    snapshot = metrics.snapshot()
+    ok &= check("abandoned sessions read but not active", snapshot["sessions"] == 21 and snapshot["active"] == 1,
+                f"{snapshot['active']} active of {snapshot['sessions']}")
+    timed_poll(metrics)
+    ok &= check("abandoned ledgers are no longer checked", metrics.tail.last_checked == 1,
+                f"{metrics.tail.last_checked} checked")
+
+    # A participant comes back to an abandoned session
+    resumed = study.advance(abandoned[0])
+    n, _ = timed_poll(metrics)
+    ok &= check("idle ledgers are not checked between re-lists", n == 0 and metrics.tail.last_checked == 1)
+    metrics.clock.advance(live_metrics.RELIST_SECONDS)
+    n, _ = timed_poll(metrics)
+    ok &= check("resumed session read at the next re-list", n == len(resumed) and metrics.snapshot()["active"] == 2,
+                f"{n} rows, {metrics.tail.last_checked} checked")
+    return ok
+
+
+def run_verification(sessions, seed):
+    print("Beginning Live Metrics Verification...")
+    ok = True
+    rng = random.Random(seed)
+    workdir = tempfile.mkdtemp(prefix="step_live_metrics_")
+    ledgers = os.path.join(workdir, "data_out")
+    os.makedirs(ledgers)
+    try:
+        study = Study(ledgers, rng)
+        for _ in range(sessions):
+            study.finish(study.start())
+        for _ in range(sessions // 10):
+            study.advance(study.start(), rng.randint(1, 8))
+
+        # 1. Catch-up over the history
+        metrics = live_metrics.LiveMetrics(live_metrics.FileTail(ledgers), clock=Clock())
+        n, elapsed = timed_poll(metrics)
+        ok &= check("first poll matches a full recompute", *matches(metrics.snapshot(), recompute(study)))
+        ok &= check("history is not counted as throughput", metrics.snapshot()["events_per_minute"] is None)
+        print(f"Catch-up: {n} rows in {elapsed:.2f}s")
+
+        # 2. Sessions move on, new ones start, one row is still being written
+        written = []
+        for session_id in rng.sample(study.unfinished(), 10):
+            written += study.advance(session_id, rng.randint(1, 3))
+        for _ in range(5):
+            written += study.advance(study.start(), 2)
+        cut_session = study.start()
+        written += study.advance(cut_session)
+        timed_poll(metrics)
+        cut_rows = study.advance(cut_session)
+        with open(study.sessions[cut_session]["path"], "rb") as f:
+            content = f.read()
+        cut_at = len(content) - 7
+        with open(study.sessions[cut_session]["path"], "wb") as f:
+            f.write(content[:cut_at])
+        study.sessions[cut_session]["written"] = study.sessions[cut_session]["written"][:-1]
+        n, elapsed = timed_poll(metrics)
+        events = sum(r["record_type"] == "event" for r in written + cut_rows[:-1])
+        ok &= check("incremental poll matches a full recompute", *matches(metrics.snapshot(), recompute(study)))
+        ok &= check("poll reads only the new complete rows", n == len(cut_rows) - 1, f"{n} rows, {elapsed * 1000:.1f} ms")
+        ok &= check("new events counted as throughput", sum(k for _, k in metrics._arrivals) == events,
+                    f"{metrics.snapshot()['events_per_minute']:.0f}/min")
+        with open(study.sessions[cut_session]["path"], "ab") as f:
+            f.write(content[cut_at:])
+        study.sessions[cut_session]["written"].append(cut_rows[-1])
+        n, _ = timed_poll(metrics)
+        ok &= check("row still being written is read once complete", n == 1 and matches(
+            metrics.snapshot(), recompute(study))[0], f"{n} rows")
+
+        # 3. A withdrawn session's ledger is deleted, finished and unfinished
+        for session_id in [next(iter(study.sessions)), study.unfinished()[0]]:
+            study.delete(session_id)
+        timed_poll(metrics)
+        ok &= check("deleted ledgers are taken back out", *matches(metrics.snapshot(), recompute(study)))
+
+        # 4. Everyone finishes: nothing is left active
+        for session_id in study.unfinished():
+            study.finish(session_id)
+        timed_poll(metrics)
+        snapshot = metrics.snapshot()
+        ok &= check("finished sessions leave the active count", snapshot["active"] == 0 and matches(
+            snapshot, recompute(study))[0], f"{snapshot['finished']} finished")
+        timed_poll(metrics)
+        ok &= check("finished ledgers are no longer checked", metrics.tail.last_checked == 0)
+
+        # 5. Abandoned sessions stop being checked until their ledger changes
+        ok &= abandoned_sessions(workdir, rng)
+
+        # 6. The directory is re-listed when its mtime changes, but not on every poll
+        metrics.clock.advance(live_metrics.RELIST_SECONDS)
+        timed_poll(metrics)
+        listings = metrics.tail.listings
+        for _ in range(5):
+            study.advance(study.start())
+            metrics.clock.advance(1)
+            metrics.poll(min_interval=0)
+        ok &= check("new ledgers do not re-list the directory every poll", metrics.tail.listings == listings)
+        timed_poll(metrics)
+        ok &= check("new ledgers picked up at the next re-list", metrics.tail.listings == listings + 1 and matches(
+            metrics.snapshot(), recompute(study))[0])
+        timed_poll(metrics)
+        ok &= check("unchanged directory not re-listed", metrics.tail.listings == listings + 1)
+        for session_id in study.unfinished():
+            study.finish(session_id)
+
+        # 7. A poll's cost does not depend on the history
+        small_ok, small_checked, small_s = history_cost(workdir, sessions // 10, 10, rng)
+        large_ok, large_checked, large_s = history_cost(workdir, sessions * 3, 10, rng)
+        ok &= check("poll over a long history reads only the new rows", small_ok and large_ok)
+        ok &= check("poll checks only recently written ledgers", small_checked == large_checked == 10,
+                    f"{sessions // 10} finished: {small_s * 1000:.1f} ms, {sessions * 3} finished: {large_s * 1000:.1f} ms")
+
+        # 8. The SQLite store through its tail
+        store = storage.SQLiteStore(engine.LEDGER_COLUMNS, os.path.join(workdir, "step.sqlite3"))
+        for session in study.sessions.values():
+            store.insert_ledger_rows(session["path"], session["written"])
+        sqlite_metrics = live_metrics.LiveMetrics(live_metrics.SQLiteTail(store.path), clock=Clock())
+        sqlite_metrics.poll(min_interval=0)
+        ok &= check("SQLite tail matches a full recompute", *matches(sqlite_metrics.snapshot(), recompute(study)))
+        session_id = study.start()
+        rows = study.advance(session_id, 3)
+        store.insert_ledger_rows(study.sessions[session_id]["path"], rows)
+        n, _ = timed_poll(sqlite_metrics)
+        ok &= check("SQLite poll reads only the new rows", n == len(rows) and matches(
+            sqlite_metrics.snapshot(), recompute(study))[0], f"{n} rows")
+        store.close()
+
+        # 9. The dashboard renders over the same ledgers
+        from streamlit.testing.v1 import AppTest
+
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        try:
+            app = AppTest.from_file(DASHBOARD, default_timeout=60).run()
+        finally:
+            os.chdir(cwd)
+        values = {m.label: m.value for m in app.metric}
+        ok &= check("dashboard renders", not app.exception and values.get("Active participants") == "1",
+                    str(values))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print("Live Metrics Verification Complete." if ok else "Live Metrics Verification FAILED.")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sessions", type=int, default=300)
+    parser.add_argument("--seed", type=int, default=11)
+    args = parser.parse_args()
+    sys.exit(0 if run_verification(args.sessions, args.seed) else 1)
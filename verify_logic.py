@@ -74,17 +74,20 @@ def run_verification():
     # 5. Engine / Queue Generation
     print("Testing Queue Generation...")
     # Setup session state for engine
-    st.session_state.content_pack = sheets
+    content_hash = utils.calculate_hash(content_path)
+    engine.register_content_pack(content_hash, utils.normalise_content_pack(sheets))
+    st.session_state.content_pack_hash = content_hash
     st.session_state.current_patient_index = 0
-    st.session_state.patient_queue = []
+    st.session_state.patient_queue_ids = []
     
     try:
         engine.generate_patient_queue()
-        queue = st.session_state.patient_queue
+        queue = st.session_state.patient_queue_ids
         print(f"Queue Generated. Length: {len(queue)}")
         if len(queue) > 0:
-            print(f"First Patient ID: {queue[0].get('ID')}")
-            print(f"Is Tutorial: {queue[0].get('Is_Tutorial')}")
+            first_patient = engine.get_patient(queue[0])
+            print(f"First Patient ID: {first_patient.get('ID')}")
+            print(f"Is Tutorial: {first_patient.get('Is_Tutorial')}")
     except Exception as e:
         print(f"FAIL: Queue generation failed - {e}")
 
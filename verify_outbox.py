@@ -0,0 +1,185 @@
+"""
+Exercises the Google Sheets outbox against a local fake of gspread's
+Spreadsheet/Worksheet API: batching, deduplication, 429 backoff, rate limiting,
+resuming unsent rows after a restart, setting aside batches that cannot be
+sent, and compacting sent rows. No Google account is needed.
+
+    python verify_outbox.py
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+import threading
+
+sys.path.append(os.getcwd())
+
+from src.outbox import SheetsOutbox
+
+
+class FakeResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+class FakeAPIError(Exception):
+    """Shaped like gspread.exceptions.APIError (code + response.status_code)."""
+
+    def __init__(self, status_code, message):
+        super().__init__(message)
+        self.code = status_code
+        self.response = FakeResponse(status_code)
+
+
+class FakeWorksheet:
+    def __init__(self, server, title, header):
+        self.server = server
+        self.title = title
+        self.rows = [list(header)]
+
+    def append_rows(self, rows, value_input_option="RAW"):
+        self.server.request(self, rows)
+
+
+class FakeSheetsServer:
+    """In-memory stand-in for the Sheets API with scripted failures."""
+
+    def __init__(self):
+        self.worksheets = {}
+        self.calls = []
+        self.fail_next = []
+        self._lock = threading.Lock()
+
+    def open_worksheet(self, sheet_name, title, header):
+        with self._lock:
+            key = (sheet_name, title)
+            if key not in self.worksheets:
+                self.worksheets[key] = FakeWorksheet(self, title, header)
+            return self.worksheets[key]
+
+    def request(self, worksheet, rows):
+        with self._lock:
+            self.calls.append((time.monotonic(), worksheet.title, len(rows)))
+            if self.fail_next:
+                raise self.fail_next.pop(0)
+            worksheet.rows.extend(list(r) for r in rows)
+
+
+def check(label, condition, detail=""):
+    print(f"{'PASS' if condition else 'FAIL'}: {label}{f' ({detail})' if detail else ''}")
+    return condition
+
+
+def run_verification():
+    print("Beginning Outbox Verification...")
+    workdir = tempfile.mkdtemp(prefix="step_outbox_")
+    path = os.path.join(workdir, "outbox.sqlite3")
+    header = ["Timestamp", "PatientID", "TriageCategory", "SessionID", "LedgerRowIndex"]
+    ok = True
+
+    try:
+        # 1. Batching and dedup: 3 sessions x 40 decisions, every row enqueued twice
+        server = FakeSheetsServer()
+        outbox = SheetsOutbox(server.open_worksheet, path=path, writes_per_minute=6000, burst=2,
+                              batch_rows=50, backoff_base=0.05, backoff_max=0.2)
+        inserted = 0
+        for attempt in range(2):
+            for session in ("s1", "s2", "s3"):
+                for idx in range(1, 41):
+                    row = ["2026-01-01T00:00:00", f"p{idx}", "RED", session, idx]
+                    inserted += outbox.enqueue("Pack", "Triage_Logs", header, f"{session}:{idx}", row)
+        ok &= check("duplicates ignored at enqueue", inserted == 120, f"{inserted} inserted")
+        ok &= check("drained", outbox.drain(timeout=10))
+        rows = server.worksheets[("Pack", "Triage_Logs")].rows[1:]
+        keys = [(r[3], r[4]) for r in rows]
+        ok &= check("every row delivered once", len(rows) == 120 and len(set(keys)) == 120, f"{len(rows)} rows")
+        ok &= check("rows kept in enqueue order", keys == sorted(keys, key=lambda k: (k[0], k[1])))
+        ok &= check("append_rows batched", max(n for _, _, n in server.calls) <= 50 and len(server.calls) < 120,
+                    f"{len(server.calls)} requests")
+
+        # 2. 429s and a 503 are retried with backoff; nothing is lost or duplicated
+        server.fail_next = [FakeAPIError(429, "Quota exceeded")] * 3 + [FakeAPIError(503, "Unavailable")]
+        for idx in range(41, 61):
+            outbox.enqueue("Pack", "Triage_Logs", header, f"s1:{idx}", ["t", f"p{idx}", "GREEN", "s1", idx])
+        ok &= check("drained after throttling", outbox.drain(timeout=10))
+        metrics = outbox.metrics()
+        rows = server.worksheets[("Pack", "Triage_Logs")].rows[1:]
+        ok &= check("429s counted", metrics["throttled"] == 3 and metrics["errors"] == 1, str(metrics))
+        ok &= check("no loss or duplication after retries", len(rows) == 140 and len({(r[3], r[4]) for r in rows}) == 140)
+        outbox.close()
+
+        # 3. Rate limiting: 60 writes/min with burst 2 -> third request waits ~1 s
+        server = FakeSheetsServer()
+        outbox = SheetsOutbox(server.open_worksheet, path=os.path.join(workdir, "rate.sqlite3"),
+                              writes_per_minute=60, burst=2, batch_rows=1)
+        for idx in range(3):
+            outbox.enqueue("Pack", "Triage_Logs", header, f"r:{idx}", ["t", idx, "RED", "r", idx])
+        outbox.drain(timeout=10)
+        spacing = server.calls[2][0] - server.calls[0][0]
+        ok &= check("requests paced by token bucket", spacing >= 0.9, f"{spacing:.2f}s for 3 requests")
+        outbox.close()
+
+        # 4. Restart: rows queued while the API is down are sent by the next process
+        server = FakeSheetsServer()
+        server.fail_next = [FakeAPIError(503, "Unavailable")] * 1000
+        restart_path = os.path.join(workdir, "restart.sqlite3")
+        outbox = SheetsOutbox(server.open_worksheet, path=restart_path, writes_per_minute=6000,
+                              backoff_base=0.01, backoff_max=0.02)
+        for idx in range(10):
+            outbox.enqueue("Pack", "Triage_Logs", header, f"x:{idx}", ["t", idx, "RED", "x", idx])
+        time.sleep(0.2)
+        outbox.close()
+        server.fail_next = []
+        outbox = SheetsOutbox(server.open_worksheet, path=restart_path, writes_per_minute=6000)
+        ok &= check("unsent rows survive a restart", outbox.drain(timeout=10)
+                    and len(server.worksheets[("Pack", "Triage_Logs")].rows) == 11)
+        outbox.close()
+
+        # 5. A non-retryable 400 sets its batch aside; the rows behind it still go out
+        server = FakeSheetsServer()
+        server.fail_next = [FakeAPIError(400, "Invalid range")]
+        outbox = SheetsOutbox(server.open_worksheet, path=os.path.join(workdir, "dead.sqlite3"),
+                              writes_per_minute=6000, batch_rows=5, backoff_base=0.01, backoff_max=0.02)
+        for idx in range(10):
+            outbox.enqueue("Pack", "Triage_Logs", header, f"d:{idx}", ["t", idx, "RED", "d", idx])
+        drained = outbox.drain(timeout=10)
+        metrics = outbox.metrics()
+        dead = metrics["dead_letter"]
+        sent = [r[4] for r in server.worksheets[("Pack", "Triage_Logs")].rows[1:]]
+        ok &= check("400 batch set aside, later rows sent", drained and 1 <= dead <= 5
+                    and sent == list(range(dead, 10)), str(metrics))
+        ok &= check("set-aside rows sent again on requeue", outbox.requeue_dead() == dead and outbox.drain(timeout=10)
+                    and len(server.worksheets[("Pack", "Triage_Logs")].rows) == 11)
+
+        # 6. A retryable error is given up on after max_attempts; a 429 never is
+        outbox.max_attempts = 3
+        server.fail_next = [FakeAPIError(429, "Quota exceeded")] * 4 + [FakeAPIError(500, "Internal")] * 3
+        outbox.enqueue("Pack", "Triage_Logs", header, "d:10", ["t", 10, "RED", "d", 10])
+        outbox.enqueue("Pack", "Other", header, "d:11", ["t", 11, "RED", "d", 11])
+        drained = outbox.drain(timeout=10)
+        metrics = outbox.metrics()
+        ok &= check("repeated 500s set aside after max_attempts, 429s not counted", drained and metrics["dead_letter"] == 1
+                    and 10 not in [r[4] for r in server.worksheets[("Pack", "Triage_Logs")].rows]
+                    and len(server.worksheets[("Pack", "Other")].rows) == 2, str(metrics))
+
+        # 7. Sent rows keep only their dedup key, and are deleted once old enough
+        conn = outbox._conn
+        with outbox._lock:
+            stored = conn.execute("SELECT COUNT(*) FROM outbox WHERE sent_at IS NOT NULL AND row IS NOT NULL").fetchone()[0]
+        ok &= check("sent rows compacted", stored == 0)
+        ok &= check("resent key still deduplicated", not outbox.enqueue("Pack", "Triage_Logs", header, "d:0", ["t"]))
+        purged = outbox.purge_sent(now=time.time() + outbox.keep_sent + 1)
+        with outbox._lock:
+            left = conn.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+        ok &= check("old sent rows purged", purged == 11 and left == 1, f"{purged} purged, {left} left")
+        outbox.close()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print("Outbox Verification Complete." if ok else "Outbox Verification FAILED.")
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if run_verification() else 1)
@@ -0,0 +1,187 @@
+"""
+Exercises ledger replication end to end with local stand-ins: every row
+reaches the directory sink exactly once, objects are grouped per session, a
+restart resumes from the saved cursor, and a withdrawn session's rows are
+deleted from the replica (file and SQLite sources) or, for Google Sheets,
+dropped from the outbox and recorded in the Withdrawals worksheet.
+
+    python verify_replication.py
+"""
+import os
+import sys
+import csv
+import gzip
+import uuid
+import shutil
+import tempfile
+
+sys.path.append(os.getcwd())
+
+from src.engine import LEDGER_COLUMNS
+from src import outbox, replication
+from src.storage import SQLiteStore
+
+
+def check(label, condition, detail=""):
+    print(f"{'PASS' if condition else 'FAIL'}: {label}" + (f" ({detail})" if detail else ""))
+    return condition
+
+
+def make_row(session_id, i, content_hash="pack1"):
+    row = {col: "" for col in LEDGER_COLUMNS}
+    row.update({"session_id": session_id, "ledger_row_index": str(i), "record_type": "event",
+                "event_type": "reveal", "content_pack_hash": content_hash})
+    return row
+
+
+def write_ledger(directory, session_id, rows, n):
+    path = os.path.join(directory, f"logs_{session_id}_20260101_{n:06d}.csv")
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=LEDGER_COLUMNS)
+        writer.writeheader()
+        writer.writerows(make_row(session_id, i) for i in range(1, rows + 1))
+    return path
+
+
+def replica_rows(root):
+    """{session_id: [ledger_row_index, ...]} across every object of a directory sink."""
+    found = {}
+    for dirpath, _, names in os.walk(root):
+        for name in names:
+            with gzip.open(os.path.join(dirpath, name), "rt", encoding="utf-8") as f:
+                for row in csv.DictReader(f):
+                    found.setdefault(row["session_id"], []).append(row["ledger_row_index"])
+    return found
+
+
+class Unavailable(Exception):
+    code = 503
+
+
+def unavailable(sheet_name, worksheet, header):
+    raise Unavailable("sheets unavailable")
+
+
+def run_verification():
+    print("Beginning Replication Verification...")
+    workdir = tempfile.mkdtemp(prefix="step_replication_")
+    try:
+        # 1. File ledgers to a directory sink
+        ledgers = os.path.join(workdir, "data_out")
+        os.makedirs(ledgers)
+        sessions = [str(uuid.uuid4()) for _ in range(6)]
+        paths = {sid: write_ledger(ledgers, sid, 40 + 10 * n, n) for n, sid in enumerate(sessions)}
+        replica = os.path.join(workdir, "replica")
+        state_path = os.path.join(workdir, "replication_files.json")
+
+        def file_replicator():
+            return replication.Replicator("files", replication.FileLedgerSource(ledgers),
+                                          replication.DirectorySink(replica, LEDGER_COLUMNS),
+                                          state_path=state_path, batch_rows=70)
+
+        replicator = file_replicator()
+        shipped = replicator.run_once()
+        found = replica_rows(replica)
+        expected = sum(40 + 10 * n for n in range(len(sessions)))
+        check("every row shipped once", shipped == expected and
+              all(sorted(found[sid], key=int) == [str(i) for i in range(1, 41 + 10 * n)]
+                  for n, sid in enumerate(sessions)), f"{shipped} / {expected}")
+        check("objects grouped per session",
+              sorted(os.listdir(os.path.join(replica, "ledger"))) == sorted(sessions))
+
+        # 2. A restart resumes from the cursor; only appended rows are shipped
+        with open(paths[sessions[0]], "a", newline="", encoding="utf-8") as f:
+            csv.DictWriter(f, fieldnames=LEDGER_COLUMNS).writerow(make_row(sessions[0], 41))
+        replicator = file_replicator()
+        check("restart ships only new rows", replicator.run_once() == 1 and
+              replica_rows(replica)[sessions[0]].count("41") == 1)
+
+        # 3. Withdrawn sessions are deleted from the replica, and only they
+        withdrawn = sessions[1:3]
+        for sid in withdrawn:
+            os.remove(paths[sid])
+        replicator.run_once()
+        found = replica_rows(replica)
+        check("withdrawn sessions deleted from replica", not any(sid in found for sid in withdrawn),
+              f"{replicator.sessions_deleted} deleted")
+        check("other sessions kept", all(sid in found for sid in sessions if sid not in withdrawn))
+        check("withdrawn ledgers dropped from cursor",
+              not any(sid in name for name in replicator.cursor["files"] for sid in withdrawn))
+
+        # 4. A failed delete is retried on the next pass
+        class FlakySink(replication.DirectorySink):
+            fail = True
+
+            def delete_session(self, session_id):
+                if self.fail:
+                    self.fail = False
+                    raise OSError("replica unavailable")
+                super().delete_session(session_id)
+
+        flaky = replication.Replicator("files", replication.FileLedgerSource(ledgers),
+                                       FlakySink(replica, LEDGER_COLUMNS), state_path=state_path)
+        os.remove(paths[sessions[3]])
+        try:
+            flaky.run_once()
+        except OSError:
+            pass
+        retried = flaky.run_once() == 0 and sessions[3] not in replica_rows(replica)
+        check("failed delete retried next pass", retried)
+
+        # 5. SQLite store: withdrawals are read from its withdrawal table
+        db_path = os.path.join(workdir, "step.sqlite3")
+        store = SQLiteStore(LEDGER_COLUMNS, path=db_path)
+        db_sessions = [str(uuid.uuid4()) for _ in range(3)]
+        for sid in db_sessions:
+            for i in range(1, 21):
+                store.append_ledger_row(f"logs_{sid}.csv", make_row(sid, i))
+            store.flush_ledger(f"logs_{sid}.csv")
+        db_replica = os.path.join(workdir, "db_replica")
+        db_replicator = replication.Replicator(
+            "db", replication.SQLiteLedgerSource(db_path, LEDGER_COLUMNS),
+            replication.DirectorySink(db_replica, LEDGER_COLUMNS),
+            state_path=os.path.join(workdir, "replication_db.json"))
+        db_replicator.run_once()
+        store.delete_ledger(f"logs_{db_sessions[0]}.csv", db_sessions[0])
+        for i in range(21, 26):
+            store.append_ledger_row(f"logs_{db_sessions[1]}.csv", make_row(db_sessions[1], i))
+        store.flush_ledger(f"logs_{db_sessions[1]}.csv")
+        shipped = db_replicator.run_once()
+        found = replica_rows(db_replica)
+        check("sqlite withdrawal deleted from replica", db_sessions[0] not in found and shipped == 5 and
+              len(found[db_sessions[1]]) == 25 and len(found[db_sessions[2]]) == 20)
+        check("sqlite withdrawal cursor kept with row cursor",
+              db_replicator.cursor.get("withdrawal_id") == 1 and db_replicator.cursor.get("row_id") == 65,
+              str(db_replicator.cursor))
+        store.close()
+
+        # 6. Sheets: queued rows are dropped and a tombstone is queued for the session's sheet
+        box = outbox.SheetsOutbox(open_worksheet=unavailable, path=os.path.join(workdir, "outbox.sqlite3"),
+                                  backoff_base=60, backoff_max=60)
+        get_outbox = outbox.get_outbox
+        outbox.get_outbox = lambda: box
+        try:
+            sink = replication.SheetsSink(LEDGER_COLUMNS, {"pack1": "Study A", "pack2": "Study B"})
+            kept, gone = str(uuid.uuid4()), str(uuid.uuid4())
+            sink.write("b1", [make_row(kept, i) for i in range(1, 4)] + [make_row(gone, i) for i in range(1, 4)])
+            sink.delete_session(gone)
+            with box._lock:
+                queued = box._conn.execute(
+                    "SELECT sheet_name, worksheet, dedup_key, row FROM outbox WHERE sent_at IS NULL").fetchall()
+            tombstones = [q for q in queued if q[1] == replication.WITHDRAWALS_WORKSHEET]
+            check("sheets: withdrawn session's queued rows dropped",
+                  not any(q[2].startswith(f"{gone}:") for q in queued) and
+                  sum(q[2].startswith(f"{kept}:") for q in queued) == 3)
+            check("sheets: tombstone queued for the session's sheet only",
+                  len(tombstones) == 1 and tombstones[0][0] == "Study A" and gone in tombstones[0][3],
+                  str([(q[0], q[2]) for q in tombstones]))
+        finally:
+            outbox.get_outbox = get_outbox
+            box.close()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    print("Replication Verification Complete.")
+
+
+if __name__ == "__main__":
+    run_verification()
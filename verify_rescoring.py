@@ -0,0 +1,211 @@
+"""
+Checks the batch re-scoring engine (src/rescoring.py) against the live scoring
+in src/engine.py. Synthetic sessions are played through engine.log_event on a
+fake clock, and the ledger rows it writes are captured. The event rows are then
+re-scored in bulk and must reproduce every encounter row and decision grade:
+first against the same content pack, then against a pack with revised
+references, which is compared to a live replay under that revision.
+
+    python verify_rescoring.py [--sessions 100]
+"""
+import os
+import sys
+import copy
+import time
+import random
+import argparse
+
+import streamlit as st
+
+
+# Mock session_state (as verify_logic.py does)
+class MockSessionState(dict):
+    def __getattr__(self, key):
+        return self.get(key)
+    def __setattr__(self, key, value):
+        self[key] = value
+
+
+st.session_state = MockSessionState()
+
+sys.path.append(os.getcwd())
+
+import pandas as pd
+from src import utils, engine, timing, writebehind, rescoring
+
+CONTENT_PATH = "config/study_content_pack.xlsx"
+# A decision colour outside the grading scales, to exercise "ERR" (the pack's own
+# colourless "Not injured" button covers the empty-tag path)
+STRAY_DECISIONS = [("Purple", "Purple")]
+
+
+class CapturingStore:
+    """Stands in for the session store: keeps the rows append_ledger_row writes."""
+
+    def __init__(self):
+        self.rows = []
+
+    def append_ledger_row(self, path, row):
+        self.rows.append(row)
+
+    def flush_ledger(self, path):
+        pass
+
+
+class FakeClock:
+    def __init__(self):
+        self.ns = 0
+
+    def advance(self, rng):
+        self.ns += rng.randint(200, 9000) * 1_000_000
+
+    def anchor(self):
+        return {"ns": self.ns, "clock": timing.PROCESS_CLOCK_ID, "wall": "2026-01-01T00:00:00"}
+
+
+def play_session(session_no, seed, content_hash, clock):
+    """One participant through the queue; the same seed gives the same clicks under any pack."""
+    rng = random.Random(seed)
+    random.seed(seed)  # generate_patient_queue shuffles with the global RNG
+    st.session_state.clear()
+    st.session_state.update({
+        "session_id": f"verify{session_no:05d}", "log_filepath": "captured", "app_version": engine.APP_VERSION,
+        "content_pack_hash": content_hash, "tool_id": rng.choice(["SMART", "TST"]),
+        "current_patient_index": 0, "patient_queue_ids": [],
+    })
+    engine.generate_patient_queue()
+    st.session_state.block_start_time = clock.anchor()
+    index = engine.get_pack_index()
+    tool_id = st.session_state.tool_id
+    actions = list(index.tool_actions(tool_id))
+    buttons = [(b.label, b.colour) for b in index.tool_buttons(tool_id)] + STRAY_DECISIONS
+    queue = st.session_state.patient_queue_ids
+    patients = [engine.get_patient(pid) for pid in queue]
+
+    def reveal_some(count):
+        for key in rng.sample(actions, min(count, len(actions))) + rng.choices(actions, k=rng.randint(0, 1)):
+            clock.advance(rng)
+            engine.log_event(event_type="reveal", action_key=key)
+
+    def decide():
+        clock.advance(rng)
+        label, colour = rng.choice(buttons)
+        engine.log_event(event_type="decision", action_key="triage_decision", decision_raw=label,
+                         decision_normalized=colour)
+
+    position = 0
+    can_go_back = False
+    while position < len(queue):
+        st.session_state.current_patient_index = position
+        engine.start_new_patient()
+        reveal_some(rng.randint(0, 6))
+        # "Go Back" as app.py allows it: once, within a block; reveals here are abandoned
+        previous, current = patients[position - 1], patients[position]
+        if can_go_back and previous["Scenario"] == current["Scenario"] \
+                and previous.get("Is_Practice") == current.get("Is_Practice") and rng.random() < 0.1:
+            st.session_state.current_patient_index = position - 1
+            engine.start_new_patient()
+            reveal_some(rng.randint(0, 3))
+            decide()
+            can_go_back = False
+            continue
+        decide()
+        can_go_back = True
+        if rng.random() < 0.05:
+            engine.log_event(event_type="washout_start")
+        position += 1
+
+
+def replay(sessions, content_hash, seed):
+    """Plays every session under content_hash; returns the ledger rows written."""
+    store = CapturingStore()
+    clock = FakeClock()
+    patched = (engine.get_store, writebehind.submit, timing.anchor)
+    engine.get_store = lambda: store
+    writebehind.submit = lambda key, fn, *args, **kwargs: fn(*args, **kwargs)
+    timing.anchor = clock.anchor
+    try:
+        for session_no in range(sessions):
+            play_session(session_no, seed + session_no, content_hash, clock)
+    finally:
+        engine.get_store, writebehind.submit, timing.anchor = patched
+    return pd.DataFrame(store.rows, columns=engine.LEDGER_COLUMNS, dtype=str)
+
+
+def revise(sheets):
+    """A copy of the pack with consensus references moved one level for every other patient."""
+    revised = copy.deepcopy(sheets)
+    shift = {"Red": "Yellow", "Yellow": "Green", "Green": "Red", "P1": "P2", "P2": "P3", "P3": "P1"}
+    patients = revised["Patients"]
+    for column in ["Ref_SMART", "Ref_Standard_TST"]:
+        if column in patients.columns:
+            rows = patients.index[::2]
+            patients.loc[rows, column] = patients.loc[rows, column].map(lambda v: shift.get(v, v))
+    return revised
+
+
+def check(label, condition, detail=""):
+    print(f"{'PASS' if condition else 'FAIL'}: {label}{f' ({detail})' if detail else ''}")
+    return condition
+
+
+def parity(label, ledger, encounters, decisions):
+    """Re-scored values vs the rows the live engine wrote."""
+    ok = True
+    recorded = ledger[ledger["record_type"] == "encounter"]
+    changes = rescoring.compare_with_recorded(encounters, ledger)
+    ok &= check(f"{label}: one re-scored encounter per recorded encounter row",
+                len(encounters) == len(recorded), f"{len(encounters)} vs {len(recorded)}")
+    ok &= check(f"{label}: encounter columns match live scoring", changes.empty,
+                "" if changes.empty else changes.groupby("column").size().to_dict())
+    if not changes.empty:
+        print(changes.head(10).to_string())
+
+    live = ledger[(ledger["record_type"] == "event") & (ledger["event_type"] == "decision")]
+    merged = live.merge(decisions, on=["session_id", "ledger_row_index"], suffixes=("", "_rescored"))
+    for column in ["reference_tag_normalized", "deviation"]:
+        differs = merged[column] != merged[f"{column}_rescored"]
+        ok &= check(f"{label}: decision {column} matches live", len(merged) == len(live) and not differs.any(),
+                    f"{int(differs.sum())} differ")
+    return ok
+
+
+def run_verification(sessions, seed):
+    print("Beginning Re-scoring Verification...")
+    ok = True
+    sheets = utils.prepare_content_pack(utils.load_content_pack(CONTENT_PATH))
+    original_hash = utils.calculate_hash(CONTENT_PATH)
+    engine.register_content_pack(original_hash, sheets)
+    revised = revise(sheets)
+    engine.register_content_pack("revised-" + original_hash, revised)
+
+    # 1. Same pack: the bulk re-score reproduces what was recorded
+    ledger = replay(sessions, original_hash, seed)
+    events = ledger[ledger["record_type"] == "event"]
+    encounters, decisions = rescoring.rescore(events, sheets)
+    ok &= parity("same pack", ledger, encounters, decisions)
+
+    # 2. Revised references: re-scoring the old events matches a live run under the revision
+    started = time.perf_counter()
+    encounters, decisions = rescoring.rescore(events, revised)
+    rescore_s = time.perf_counter() - started
+    relive = replay(sessions, "revised-" + original_hash, seed)
+    ok &= check("replay under the revision logs the same events",
+                relive.loc[relive["record_type"] == "event", "t_real_ms"].tolist() == events["t_real_ms"].tolist())
+    ok &= parity("revised pack", relive, encounters, decisions)
+    changed = rescoring.compare_with_recorded(encounters, ledger)
+    ok &= check("revision changes some Error_Class values", (changed["column"] == "Error_Class").any(),
+                f"{int((changed['column'] == 'Error_Class').sum())} encounters")
+
+    print(f"Re-scored {len(encounters)} encounters ({len(events)} event rows, {sessions} sessions) "
+          f"in {rescore_s * 1000:.0f} ms")
+    print("Re-scoring Verification Complete." if ok else "Re-scoring Verification FAILED.")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sessions", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=11)
+    args = parser.parse_args()
+    sys.exit(0 if run_verification(args.sessions, args.seed) else 1)
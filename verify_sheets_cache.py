@@ -0,0 +1,145 @@
+"""
+Exercises the revision-aware Google Sheets content pack cache against a local
+fake of gspread's Spreadsheet API, using the bundled Excel content pack as the
+sheet's data. No Google account is needed.
+
+    python verify_sheets_cache.py
+"""
+import os
+import sys
+import time
+import threading
+
+sys.path.append(os.getcwd())
+
+import pandas as pd
+from src import utils
+from src.cloud import CONTENT_TABS, SheetRevisionCache, fetch_content_tabs
+
+
+class SlowSpreadsheet:
+    """Wraps a FakeSpreadsheet whose Drive and Sheets calls each take `delay` seconds."""
+
+    def __init__(self, spreadsheet, delay):
+        self.spreadsheet = spreadsheet
+        self.delay = delay
+
+    def get_lastUpdateTime(self):
+        time.sleep(self.delay)
+        return self.spreadsheet.get_lastUpdateTime()
+
+    def values_batch_get(self, ranges):
+        time.sleep(self.delay)
+        return self.spreadsheet.values_batch_get(ranges)
+
+
+class FakeSpreadsheet:
+    """Serves tab values as the Sheets API does (formatted strings, trailing blanks trimmed)."""
+
+    def __init__(self, frames):
+        self.tabs = {tab: self._values(df) for tab, df in frames.items()}
+        self.modified_time = "2026-01-01T00:00:00.000Z"
+        self.drive_calls = 0
+        self.batch_calls = 0
+
+    @staticmethod
+    def _values(df):
+        rows = [list(map(str, df.columns))]
+        for record in df.itertuples(index=False):
+            row = ["" if pd.isna(v) else str(v) for v in record]
+            while row and row[-1] == "":
+                row.pop()
+            rows.append(row)
+        return rows
+
+    def edit(self, tab, row, column, value):
+        header = self.tabs[tab][0]
+        cells = self.tabs[tab][row + 1]
+        cells.extend([""] * (len(header) - len(cells)))
+        cells[header.index(column)] = value
+        self.modified_time = f"2026-01-01T00:00:{len(str(value)):02d}.000Z"
+
+    def get_lastUpdateTime(self):
+        self.drive_calls += 1
+        return self.modified_time
+
+    def values_batch_get(self, ranges):
+        self.batch_calls += 1
+        return {"valueRanges": [{"range": r, "values": self.tabs[r.strip("'")]} for r in ranges]}
+
+
+def check(label, condition, detail=""):
+    print(f"{'PASS' if condition else 'FAIL'}: {label}{f' ({detail})' if detail else ''}")
+    return condition
+
+
+def run_verification():
+    print("Beginning Sheets Cache Verification...")
+    ok = True
+    frames = pd.read_excel("config/study_content_pack.xlsx", sheet_name=CONTENT_TABS)
+    spreadsheet = FakeSpreadsheet(frames)
+
+    # 1. One batch request for all tabs; the result loads like the Excel pack
+    cache = SheetRevisionCache(check_interval=0)
+    sheets = cache.get("Pack", spreadsheet)
+    ok &= check("all tabs in one batchGet", spreadsheet.batch_calls == 1, f"{spreadsheet.batch_calls} requests")
+    try:
+        sheets = utils.prepare_content_pack(sheets)
+        ok &= check("fetched pack validates", True)
+    except Exception as e:
+        ok &= check("fetched pack validates", False, str(e))
+    ok &= check("patients match the source", len(sheets["Patients"]) == len(frames["Patients"]),
+                f"{len(sheets['Patients'])} rows")
+    first_hash = utils.calculate_sheets_hash(sheets)
+
+    # 2. Unchanged sheet: revision check only, no download, same content hash
+    again = utils.prepare_content_pack(cache.get("Pack", spreadsheet))
+    ok &= check("unchanged sheet not re-downloaded", spreadsheet.batch_calls == 1 and cache.not_modified == 1,
+                str(cache.stats()))
+    ok &= check("unchanged sheet keeps its hash", utils.calculate_sheets_hash(again) == first_hash)
+
+    # 3. Callers get their own copies (normalisation mutates frames in place)
+    again["Patients"]["Patient_Name"] = "mutated"
+    ok &= check("cached frames not shared", (cache.get("Pack", spreadsheet)["Patients"]["Patient_Name"] != "mutated").all())
+
+    # 4. Edited sheet: re-downloaded and the content hash changes, so resume sees a new pack
+    spreadsheet.edit("Patients", 0, "Patient_Name", "Edited Name")
+    edited = utils.prepare_content_pack(cache.get("Pack", spreadsheet))
+    ok &= check("edited sheet re-downloaded", spreadsheet.batch_calls == 2, f"{spreadsheet.batch_calls} requests")
+    ok &= check("edit changes the content hash", utils.calculate_sheets_hash(edited) != first_hash)
+
+    # 5. Within the check interval, Drive is not asked at all
+    throttled = SheetRevisionCache(check_interval=60)
+    throttled.get("Pack", spreadsheet)
+    calls = spreadsheet.drive_calls
+    for _ in range(50):
+        throttled.get("Pack", spreadsheet)
+    ok &= check("revision checks rate-limited", spreadsheet.drive_calls == calls, f"{spreadsheet.drive_calls - calls} extra")
+
+    # 6. A slow sheet does not hold up others; concurrent sessions on one sheet share its fetch
+    shared = SheetRevisionCache(check_interval=60)
+    shared.get("Fast", spreadsheet)
+    slow = FakeSpreadsheet(frames)
+    threads = [threading.Thread(target=shared.get, args=("Slow", SlowSpreadsheet(slow, 0.5))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.1)
+    started = time.perf_counter()
+    shared.get("Fast", spreadsheet)
+    waited = time.perf_counter() - started
+    for thread in threads:
+        thread.join()
+    ok &= check("other sheets served during a slow fetch", waited < 0.1, f"{waited * 1000:.1f} ms")
+    ok &= check("concurrent sessions share one fetch", slow.drive_calls == 1 and slow.batch_calls == 1,
+                f"{slow.drive_calls} revision checks, {slow.batch_calls} downloads")
+
+    # 7. Direct fetch helper reads the same frames
+    direct = fetch_content_tabs(spreadsheet, "Pack")
+    ok &= check("fetch_content_tabs returns every tab", sorted(direct) == sorted(CONTENT_TABS))
+
+    print("Sheets Cache Verification Complete." if ok else "Sheets Cache Verification FAILED.")
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if run_verification() else 1)